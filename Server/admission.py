@@ -0,0 +1,86 @@
+# This is meant to be imported and used as a module.
+# It is not meant to be run directly.
+
+### Imports for admission ###
+import collections
+import threading
+import time
+
+
+### Rate limiter ###
+# Token bucket per key (an IP address or a user).
+# Each key holds up to burst tokens and regains rate tokens per second, a request takes one.
+# Only the most recently seen max_keys keys are remembered, a forgotten key starts with a full bucket.
+class RateLimiter:
+    def __init__(self, rate, burst, max_keys=100000, clock=time.monotonic):
+        # Tokens regained per second, 0 to disable the limiter
+        self.rate = rate
+        # Most tokens a key can hold, so the size of a burst that is let through at once
+        self.burst = burst
+        self.max_keys = max_keys
+        self.clock = clock
+        # Key -> (tokens, time they were counted), least recently seen first
+        self.buckets = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    # Take a token of a key, returns 0 if the request may go ahead, otherwise the seconds until it may retry
+    def take(self, key, cost=1):
+        if self.rate <= 0:
+            return 0
+        now = self.clock()
+        with self.lock:
+            tokens, counted = self.buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - counted) * self.rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0
+            else:
+                wait = (cost - tokens) / self.rate
+            self.buckets[key] = (tokens, now)
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+            return wait
+
+
+### Keys ###
+# Requests are limited per user under one key, whether they authenticate with a token or a password.
+# A password attempt is only charged to its user once the password checks out, otherwise anyone could
+# lock a user out with bad passwords, so until then it is limited by IP address and the username it tries.
+
+# Get the rate limiter key of an authenticated user
+def user_key(user_id):
+    return ('user', user_id)
+
+# Get the rate limiter key of a password attempt
+def attempt_key(address, username):
+    return ('attempt', address, username)
+
+
+### Concurrency limit ###
+# Bounds how many requests run an expensive step at once, like password hashing.
+# A request that can't get a slot within wait seconds is turned away instead of queueing.
+class ConcurrencyLimit:
+    def __init__(self, limit, wait=0):
+        # Most requests at once, 0 for no limit
+        self.limit = limit
+        # Seconds to wait for a free slot
+        self.wait = wait
+        self.semaphore = threading.BoundedSemaphore(limit) if limit > 0 else None
+        # Requests holding a slot
+        self.active = 0
+        self.lock = threading.Lock()
+
+    # Take a slot, returns False if none became free in time
+    def acquire(self):
+        if self.semaphore is not None and not self.semaphore.acquire(timeout=self.wait):
+            return False
+        with self.lock:
+            self.active += 1
+        return True
+
+    # Give back a slot taken by acquire
+    def release(self):
+        with self.lock:
+            self.active -= 1
+        if self.semaphore is not None:
+            self.semaphore.release()
@@ -0,0 +1,134 @@
+# This is meant to be imported and used as a module.
+# It is not meant to be run directly.
+
+### Imports for analytics ###
+import time
+# NumPy is optional, analytics are unavailable without it
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Most item buckets and hours in one utilization result
+max_cells = 1000000
+max_hours = 24 * 366 * 5
+
+
+### Reserved time ###
+# Get the total reserved seconds before each boundary for intervals [starts, ends).
+# With starts and ends sorted, the reserved time before t is the sum of (t - start) over starts before t
+# minus the sum of (t - end) over ends before t, so each boundary costs two binary searches.
+def reserved_before(starts, ends, boundaries):
+    starts = numpy.sort(starts)
+    ends = numpy.sort(ends)
+    start_sums = numpy.concatenate(([0], numpy.cumsum(starts)))
+    end_sums = numpy.concatenate(([0], numpy.cumsum(ends)))
+    started = numpy.searchsorted(starts, boundaries)
+    ended = numpy.searchsorted(ends, boundaries)
+    return (started * boundaries - start_sums[started]) - (ended * boundaries - end_sums[ended])
+
+# Get the reserved seconds per group and bucket for intervals [starts, ends) relative to the window start.
+# Every group gets its own stretch of the time axis, span seconds long, so all groups are handled in one pass:
+# intervals of earlier groups add the same amount before both ends of a bucket and cancel out.
+def reserved_per_bucket(groups, starts, ends, group_count, span, offsets):
+    boundaries = numpy.arange(group_count, dtype=numpy.int64)[:, None] * span + offsets[None, :]
+    reserved = reserved_before(groups * span + starts, groups * span + ends, boundaries.ravel())
+    return numpy.diff(reserved.reshape(group_count, len(offsets)), axis=1)
+
+
+### Local time ###
+# Get the UTC offsets of local time between start_time and end_time as (changes, offsets) arrays,
+# where offsets[i] is in effect from changes[i] on. The offset is looked up once a day,
+# and a day where it differs is searched for the second it changed, so hours map to local time
+# with one array lookup instead of a localtime call each.
+def offset_changes(start_time, end_time):
+    changes = [start_time]
+    offsets = [time.localtime(start_time).tm_gmtoff]
+    previous = start_time
+    for day in list(range(start_time + 86400, end_time, 86400)) + [end_time]:
+        offset = time.localtime(day).tm_gmtoff
+        if offset != offsets[-1]:
+            # Offset is the old one at low and the new one at high
+            low, high = previous, day
+            while high - low > 1:
+                middle = (low + high) // 2
+                if time.localtime(middle).tm_gmtoff == offsets[-1]:
+                    low = middle
+                else:
+                    high = middle
+            changes.append(high)
+            offsets.append(offset)
+        previous = day
+    return numpy.array(changes, dtype=numpy.int64), numpy.array(offsets, dtype=numpy.int64)
+
+
+### Utilization ###
+# Compute utilization of items between start_time and end_time (inclusive timestamps).
+# items are (id, name, quantity) and rows a (n, 4) array of (item_id, start_time, end_time, shown)
+# where shown is 1 if the item was lent out, 0 if not and -1 if it isn't tracked, like for occurrences of
+# recurring reservations, which then count as reserved but not towards no-shows. Returns a dictionary ready to be sent as JSON with:
+# - per item: reservations, utilization (reserved share of all units over the window),
+#   no_show_rate (share of started reservations never lent out) and occupancy per bucket
+# - heatmap: reserved share of all units by weekday (0 is Monday) and hour of day, in local time
+def utilization(items, rows, start_time, end_time, bucket, now=None):
+    now = time.time() if now is None else now
+    # Window and buckets as seconds from start_time, the last bucket may be shorter
+    length = end_time + 1 - start_time
+    offsets = numpy.append(numpy.arange(0, length, bucket, dtype=numpy.int64), length)
+    # Map item ids to rows of the result, dropping reservations of other items
+    items = sorted(items)
+    item_ids = numpy.array([item[0] for item in items], dtype=numpy.int64)
+    quantities = numpy.array([item[2] for item in items], dtype=numpy.float64)
+    groups = numpy.searchsorted(item_ids, rows[:, 0])
+    known = groups < len(item_ids)
+    known[known] = item_ids[groups[known]] == rows[known, 0]
+    rows = rows[known]
+    groups = groups[known]
+    # Clip reservations to the window, end times become exclusive
+    starts = numpy.clip(rows[:, 1] - start_time, 0, length)
+    ends = numpy.clip(rows[:, 2] + 1 - start_time, 0, length)
+    # Reserved seconds per item and bucket, divided by the seconds all units were available
+    reserved = reserved_per_bucket(groups, starts, ends, len(items), length + 1, offsets)
+    occupancy = reserved / (numpy.diff(offsets)[None, :] * quantities[:, None])
+    usage = reserved.sum(axis=1) / (length * quantities)
+    # No-shows among reservations that already started
+    counts = numpy.bincount(groups, minlength=len(items))
+    started = (rows[:, 1] <= now) & (rows[:, 3] >= 0)
+    started_counts = numpy.bincount(groups[started], minlength=len(items))
+    no_shows = numpy.bincount(groups[started], weights=1 - rows[started, 3], minlength=len(items))
+    no_show_rates = numpy.divide(no_shows, started_counts, out=numpy.full(len(items), numpy.nan), where=started_counts > 0)
+    # Reserved share of all units by local weekday and hour, hours aligned to the hour
+    first_hour = start_time // 3600 * 3600
+    hour_offsets = numpy.append(numpy.arange(first_hour, end_time + 1, 3600, dtype=numpy.int64), end_time + 1) - first_hour
+    hourly = reserved_per_bucket(numpy.zeros(len(rows), dtype=numpy.int64), starts + (start_time - first_hour), ends + (start_time - first_hour), 1, hour_offsets[-1] + 1, hour_offsets)[0]
+    # Shift hours to local time with the UTC offset in effect at each, then split into days and hours.
+    # Day 0 of the epoch was a Thursday (weekday 3).
+    hour_starts = first_hour + hour_offsets[:-1]
+    changes, utc_offsets = offset_changes(first_hour, end_time)
+    local_hours = hour_starts + utc_offsets[numpy.searchsorted(changes, hour_starts, side='right') - 1]
+    weekdays = (local_hours // 86400 + 3) % 7
+    hours = local_hours % 86400 // 3600
+    # Seconds of each hour that are inside the window
+    window_seconds = numpy.diff(numpy.clip(hour_offsets, start_time - first_hour, end_time + 1 - first_hour))
+    heat = numpy.zeros((7, 24))
+    available = numpy.zeros((7, 24))
+    numpy.add.at(heat, (weekdays, hours), hourly)
+    numpy.add.at(available, (weekdays, hours), window_seconds * quantities.sum())
+    heatmap = numpy.divide(heat, available, out=numpy.zeros((7, 24)), where=available > 0)
+    # Round for JSON
+    occupancy = numpy.round(occupancy, 4).tolist()
+    return {
+        'start_time': start_time,
+        'end_time': end_time,
+        'bucket': bucket,
+        'buckets': (offsets[:-1] + start_time).tolist(),
+        'reservations': len(rows),
+        'items': {item[1]: {
+            'quantity': item[2],
+            'reservations': int(counts[index]),
+            'utilization': round(float(usage[index]), 4),
+            'no_show_rate': None if numpy.isnan(no_show_rates[index]) else round(float(no_show_rates[index]), 4),
+            'occupancy': occupancy[index],
+        } for index, item in enumerate(items)},
+        'heatmap': numpy.round(heatmap, 4).tolist(),
+    }
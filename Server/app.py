@@ -1,15 +1,55 @@
 # Flask API for a reservation system
-import sqlite3
 from werkzeug.utils import secure_filename
-from flask import Flask, request, jsonify, render_template
-import random
-import hashlib
+from werkzeug.exceptions import HTTPException
+from flask import Flask, Response, request, jsonify, render_template, g, has_app_context, make_response, abort
+import secrets
 import timestamp
 import datetime
 import os
 import json
-# Import tests.py
-import tests
+import itertools
+import time
+import heapq
+import contextlib
+import io
+import csv
+import gzip
+import zlib
+import functools
+# Import intervals.py
+import intervals
+# Import sessions.py
+import sessions
+# Import database.py
+import database
+# Import writer.py
+import writer
+# Import cache.py
+import cache
+# Import hashing.py
+import hashing
+# Import metrics.py
+import metrics
+# Import migrations.py
+import migrations
+# Import archive.py
+import archive
+# Import deadlines.py
+import deadlines
+# Import feed.py
+import feed
+# Import shards.py
+import shards
+# Import analytics.py
+import analytics
+# Import bulk.py
+import bulk
+# Import versions.py
+import versions
+# Import admission.py
+import admission
+# Import schemas.py
+import schemas
 
 
 ### Configure Flask app ###
@@ -19,80 +59,575 @@ app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = './uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 # Set flask secret key as urandom string
-app.config['SECRET_KEY'] = ''.join(random.choice('0123456789ABCDEF') for i in range(16))
+app.config['SECRET_KEY'] = secrets.token_hex(32)
 
 # Define other configurations
 database_path = './Data/database.db'
 config_path = 'Data/configs.json'
 
+# Load configurations from config file
+with open(config_path, 'r') as config_file:
+    config = json.load(config_file)
+
+# Metrics exposed on /metrics
+registry = metrics.Registry()
+request_seconds = registry.histogram('simpleresv_request_duration_seconds', 'Request latency by route', ('route', 'method', 'status'))
+request_statements = registry.histogram('simpleresv_request_sql_statements', 'SQL statements per request by route', ('route',), buckets=(0, 1, 2, 5, 10, 20, 50, 100))
+request_sql_seconds = registry.histogram('simpleresv_request_sql_duration_seconds', 'SQL time per request by route', ('route',))
+sql_seconds = registry.histogram('simpleresv_sql_duration_seconds', 'SQL statement latency by statement type', ('statement',))
+connections_opened = registry.counter('simpleresv_db_connections_opened_total', 'Database connections opened')
+hash_seconds = registry.histogram('simpleresv_password_hash_duration_seconds', 'Time spent in get_hash')
+# Requests slower than this are logged with their queries, 0 to disable
+slow_request_ms = config.get('metrics', {}).get('slow_request_ms', 0)
+
+# Record a SQL statement for metrics and for the current request
+def record_query(sql, seconds):
+    words = sql.split(None, 1)
+    sql_seconds.observe(seconds, statement=words[0].upper() if words else '')
+    if has_app_context() and 'request_queries' in g:
+        g.request_queries.append((sql, seconds))
+
+# Record a new database connection for metrics and for the current request
+def record_connection():
+    connections_opened.inc()
+    if has_app_context() and 'request_connections' in g:
+        g.request_connections += 1
+
+# Pool of database connections shared by all requests
+database_config = config.get('database', {})
+db_pool = database.ConnectionPool(database_path,
+    size=database_config.get('pool_size', 8),
+    synchronous=database_config.get('synchronous', 'NORMAL'),
+    cache_size=database_config.get('cache_size', -16000),
+    on_query=record_query,
+    on_open=record_connection)
+
+# Writer thread that applies reservation writes in groups
+# Callers give up after timeout seconds, and the index is rebuilt if a commit hook fails
+writer_config = config.get('writer', {})
+write_queue = writer.WriteQueue(db_pool, max_batch=writer_config.get('max_batch', 64), timeout=writer_config.get('timeout', 30),
+    on_commit_error=lambda error: rebuild_index())
+
+# Reservations partitioned by item across shard files, shard 0 is the main database
+shard_set = shards.ShardSet(db_pool, write_queue,
+    count=database_config.get('shards', 1),
+    path_template=database_config.get('shard_path', './Data/shard{}.db'),
+    max_batch=writer_config.get('max_batch', 64))
+
+# Session tokens signed with the flask secret key
+session_store = sessions.SessionStore(app.config['SECRET_KEY'], config.get('sessions', {}).get('lifetime', 86400))
+
+# In-memory index of reservations by item, loaded at startup
+reservation_index = intervals.IntervalIndex()
+# Ids of items removed since startup, item ids are never reused
+# Shard writers reject reservations of these, so one that read the item before it was removed can't land after its reservations were purged
+removed_items = set()
+
+# Change counters of each table behind the ETags of conditional responses, reservation writes are counted by the index
+table_versions = versions.TableVersions()
+reservation_index.watchers.append(table_versions)
+not_modified = registry.counter('simpleresv_not_modified_total', 'Responses answered with 304 Not Modified by route', ('route',))
+
+# Requests whose fields didn't match the route's schema
+invalid_requests = registry.counter('simpleresv_invalid_requests_total', 'Requests rejected for invalid fields by route', ('route',))
+
+# JSON, NDJSON and CSV responses of at least min_size bytes are gzipped for clients that accept it
+compression_config = config.get('compression', {})
+compress_min_size = compression_config.get('min_size', 1024)
+compress_level = compression_config.get('level', 6)
+compressed_types = ('application/json', 'application/x-ndjson', 'text/csv')
+compressed_responses = registry.counter('simpleresv_compressed_responses_total', 'Responses sent gzipped')
+
+# Admission control in front of the expensive routes and of every request that hashes a password
+# Requests are turned away with 429 when their IP address or user runs out of tokens,
+# or when too many requests are hashing passwords already
+admission_config = config.get('admission', {})
+admission_routes = set(admission_config.get('routes', ['/login', '/token', '/reserve', '/reserve/batch', '/reserve/recurring', '/cancel', '/recurring/cancel', '/admin/register', '/admin/import/<kind>']))
+ip_limiter = admission.RateLimiter(admission_config.get('ip_rate', 10), admission_config.get('ip_burst', 50), admission_config.get('max_keys', 100000))
+user_limiter = admission.RateLimiter(admission_config.get('user_rate', 2), admission_config.get('user_burst', 10), admission_config.get('max_keys', 100000))
+# At most max_hashing requests hash at once, 0 for one per CPU
+hash_slots = admission.ConcurrencyLimit(admission_config.get('max_hashing', 0) or os.cpu_count() or 1, admission_config.get('hash_wait', 0.5))
+admission_admitted = registry.counter('simpleresv_admission_admitted_total', 'Requests to limited routes that were let through')
+admission_rejected = registry.counter('simpleresv_admission_rejected_total', 'Requests turned away with 429 by reason (ip, user or hashing)', ('reason',))
+registry.gauge('simpleresv_admission_hashing', 'Requests holding a password hashing slot', lambda: hash_slots.active)
+registry.gauge('simpleresv_admission_tracked_keys', 'IP addresses and users with a rate limiter bucket', lambda: len(ip_limiter.buckets) + len(user_limiter.buckets))
+
+# Cache of /items results, invalidated whenever the index changes
+cache_config = config.get('cache', {})
+availability_cache = cache.AvailabilityCache(cache_config.get('max_entries', 1024), cache_config.get('ttl', 60))
+reservation_index.listeners.append(lambda item, start_time, end_time: availability_cache.invalidate(start_time, end_time))
+registry.gauge('simpleresv_availability_cache_hits_total', 'Availability cache hits', lambda: availability_cache.hits, 'counter')
+registry.gauge('simpleresv_availability_cache_misses_total', 'Availability cache misses', lambda: availability_cache.misses, 'counter')
+registry.gauge('simpleresv_availability_cache_entries', 'Availability cache entries', lambda: len(availability_cache.entries))
+
+# Remove archived reservations from the index
+def forget_reservations(reservation_ids):
+    for reservation_id in reservation_ids:
+        reservation_index.remove(reservation_id)
+
+# Background jobs that move finished reservations to the archive table, one per shard
+archive_config = config.get('archive', {})
+archivers = [archive.Archiver(shard_writer,
+    retention=archive_config.get('retention', 86400),
+    interval=archive_config.get('interval', 3600),
+    batch_size=archive_config.get('batch_size', 1000),
+    on_archive=forget_reservations) for shard_writer in shard_set.writers]
+registry.gauge('simpleresv_reservations_archived_total', 'Reservations moved to the archive', lambda: sum(archiver.archived for archiver in archivers), 'counter')
+
+# Log of reservation and item changes streamed to clients on /events
+feed_config = config.get('feed', {})
+change_feed = feed.ChangeFeed(feed_config.get('capacity', 10000))
+# Seconds between keepalive comments on /events, and longest wait on /events/poll
+feed_keepalive = feed_config.get('keepalive', 15)
+feed_max_wait = feed_config.get('max_wait', 30)
+registry.gauge('simpleresv_feed_sequence', 'Sequence number of the last change event', lambda: change_feed.sequence)
+registry.gauge('simpleresv_feed_subscribers', 'Clients streaming /events', lambda: change_feed.subscribers)
+
+# Publish a change to a reservation on the feed
+def publish_reservation(type, reservation_id, item, start_time, end_time):
+    change_feed.publish(type, {'id': reservation_id, 'item': item, 'start_time': start_time, 'end_time': end_time})
+
+# Expire late reservations on their shards and publish them on the feed
+def expire_reservations(reservation_ids):
+    rows = fetch_reservations(reservation_ids)
+    groups = {}
+    for row in rows.values():
+        groups.setdefault(shard_set.shard_of(row[6]), []).append(row[0])
+    for shard, ids in groups.items():
+        for reservation_id in archivers[shard].expire(ids):
+            row = rows[reservation_id]
+            publish_reservation('reservation.expired', row[0], row[4], row[2], row[3])
+
+# Overdue and late reservations kept up to date from the index, late ones are optionally expired
+deadlines_config = config.get('deadlines', {})
+deadline_tracker = deadlines.DeadlineTracker(deadlines_config.get('expire_after'), expire_reservations)
+reservation_index.watchers.append(deadline_tracker)
+registry.gauge('simpleresv_overdue_reservations', 'Lent reservations past their end time', lambda: deadline_tracker.stats()['overdue'])
+registry.gauge('simpleresv_late_reservations', 'Pending reservations past their start time', lambda: deadline_tracker.stats()['late'])
+
+# Longest a recurring reservation can be, in occurrences
+recurring_max_occurrences = config.get('recurring', {}).get('max_occurrences', 520)
+# Periods that can be given by name when creating a recurring reservation
+recurring_periods = {'daily': 86400, 'weekly': 7 * 86400}
+
+# Bulk imports validate and insert this many rows per transaction
+bulk_config = config.get('bulk', {})
+bulk_batch_size = bulk_config.get('batch_size', 500)
+# Most per-row errors listed in an import result, the rest are only counted
+bulk_max_errors = bulk_config.get('max_errors', 1000)
+
 ### Helpers ###
 
 # Define database connection and cursor
+# The connection is borrowed from the pool once per request and shared by all helpers
 def connect_db():
-    return sqlite3.connect(database_path)
+    if 'db' not in g:
+        g.db = db_pool.acquire()
+    return g.db
 def db_cursor():
     return connect_db().cursor()
 
-# Create two tables: users, reservations, and items
-def initialize_db():
-    db = connect_db()
-    db_cur = db.cursor()
-    db_cur.execute('''CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE NOT NULL,
-        hash TEXT NOT NULL,
-        salt TEXT NOT NULL,
-        email TEXT NOT NULL,
-        permissions TEXT NOT NULL
-    )''')
-    db_cur.execute('''CREATE TABLE IF NOT EXISTS reservations (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT NOT NULL,
-        start_time INTEGER NOT NULL,
-        end_time INTEGER NOT NULL,
-        item TEXT NOT NULL,
-        status TEXT NOT NULL
-    )''')
-    db_cur.execute('''CREATE TABLE IF NOT EXISTS items (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT UNIQUE NOT NULL,
-        description TEXT NOT NULL,
-        status TEXT NOT NULL
-    )''')
-    # Commit changes to database
-    db.commit()
-    db.close()
+# Return the request's database connection to the pool
+@app.teardown_appcontext
+def release_db(exception):
+    db = g.pop('db', None)
+    if db is not None:
+        db_pool.release(db)
+
+# Start measuring a request
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.request_queries = []
+    g.request_connections = 0
+    g.request_hash_seconds = 0
+
+# Paths that hash new passwords however the request authenticates
+hashing_paths = ('/admin/register', '/admin/import/users')
+
+# Get the rate limiter key of a request without hashing a password
+# Token requests are limited as their user, password attempts by IP address and username until check_password
+# charges the user. Returns (key, will_hash) where will_hash tells if the request authenticates with a password or hashes new ones
+def admission_key():
+    fields = request_fields()
+    # Registering and importing users hash the new passwords
+    will_hash = request.path in hashing_paths
+    token = fields.get('token')
+    authorization = request.headers.get('Authorization', '')
+    if authorization.startswith('Bearer '):
+        token = authorization[len('Bearer '):]
+    if token and request.path not in ('/login', '/token'):
+        user = session_store.verify(token)
+        return admission.user_key(user[2]) if user is not None else None, will_hash
+    username = fields.get('username')
+    will_hash = will_hash or (bool(username) and 'password' in fields)
+    return admission.attempt_key(request.remote_addr, username) if username else None, will_hash
+
+# Turn a request away with 429 Too Many Requests
+def too_many_requests(reason, wait):
+    admission_rejected.inc(reason=reason)
+    response = jsonify({'status': 'error', 'error': 'Too many requests'})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, int(wait + 0.999)))
+    return response
+
+# Admit or shed a request before any work is done for it
+@app.before_request
+def admit_request():
+    if request.url_rule is None:
+        return None
+    key, will_hash = admission_key()
+    if request.url_rule.rule not in admission_routes and not will_hash:
+        return None
+    wait = ip_limiter.take(request.remote_addr)
+    if wait:
+        return too_many_requests('ip', wait)
+    if key is not None:
+        wait = user_limiter.take(key)
+        if wait:
+            return too_many_requests('user', wait)
+    # Hold a hashing slot for the rest of the request
+    if will_hash:
+        if not hash_slots.acquire():
+            return too_many_requests('hashing', hash_slots.wait)
+        g.hash_slot = True
+    admission_admitted.inc()
+    return None
+
+# Charge a request to its user once its password checked out, or turn it away
+def charge_user(user_id):
+    wait = user_limiter.take(admission.user_key(user_id))
+    if wait:
+        abort(too_many_requests('user', wait))
+
+# Give back the hashing slot of a request
+@app.teardown_request
+def release_hash_slot(exception):
+    if g.pop('hash_slot', False):
+        hash_slots.release()
+
+# Record request latency and SQL usage by route
+@app.after_request
+def record_request_metrics(response):
+    if 'request_started' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_started
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    sql_time = sum(query[1] for query in g.request_queries)
+    request_seconds.observe(elapsed, route=route, method=request.method, status=response.status_code)
+    request_statements.observe(len(g.request_queries), route=route)
+    request_sql_seconds.observe(sql_time, route=route)
+    # Log slow requests with a breakdown of their queries
+    if slow_request_ms and elapsed * 1000 >= slow_request_ms:
+        breakdown = {}
+        for sql, seconds in g.request_queries:
+            count, total = breakdown.get(sql, (0, 0))
+            breakdown[sql] = (count + 1, total + seconds)
+        queries = ''.join('\n    {}x {:.1f} ms {}'.format(count, total * 1000, ' '.join(sql.split()))
+            for sql, (count, total) in sorted(breakdown.items(), key=lambda entry: -entry[1][1]))
+        app.logger.warning('Slow request %s %s %.1f ms: %d queries %.1f ms, %d connections opened, hashing %.1f ms%s',
+            request.method, route, elapsed * 1000, len(g.request_queries), sql_time * 1000,
+            g.request_connections, g.request_hash_seconds * 1000, queries)
+    return response
+
+# Gzip a streamed response chunk by chunk, flushing after each chunk so rows still arrive as they are read
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED, 31)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+    finally:
+        # Let the original stream give back its connections
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+# Compress JSON, NDJSON and CSV responses when the client accepts gzip
+@app.after_request
+def compress_response(response):
+    if response.status_code != 200 or 'Content-Encoding' in response.headers or response.mimetype not in compressed_types:
+        return response
+    response.vary.add('Accept-Encoding')
+    if not request.accept_encodings['gzip']:
+        return response
+    if response.is_streamed:
+        response.response = gzip_stream(response.response)
+    else:
+        data = response.get_data()
+        if len(data) < compress_min_size:
+            return response
+        response.set_data(gzip.compress(data, compress_level))
+    response.headers['Content-Encoding'] = 'gzip'
+    compressed_responses.inc()
+    return response
+
+# Answer errors the routes don't handle with a JSON error instead of an HTML page
+# HTTP errors like 404 and 405 keep their own response
+@app.errorhandler(Exception)
+def internal_error(e):
+    if isinstance(e, HTTPException):
+        return e
+    app.logger.exception('Unhandled error on %s %s', request.method, request.path)
+    response = jsonify({'status': 'error', 'error': 'Internal server error'})
+    response.status_code = 500
+    return response
+
+# Create or upgrade the database schema
+def migrate_db():
+    migrations.migrate(connect_db())
+    shard_set.migrate()
+
+# Load the reservations of every shard into the index
+def load_index():
+    dbs = [pool.acquire() for pool in shard_set.pools]
+    try:
+        reservation_index.load(*dbs)
+    finally:
+        for pool, db in zip(shard_set.pools, dbs):
+            pool.release(db)
+
+# Reload the index from the database after a commit hook failed to update it
+# Cached availability may have been computed from the wrong index, so it is dropped too
+def rebuild_index():
+    app.logger.warning('Rebuilding the reservation index after a failed commit hook')
+    load_index()
+    availability_cache.clear()
 
 
 ### Utility functions ###
 
 # Get hash from a password and salt
+# Runs on the hashing process pool when the server is started with serve.py
 def get_hash(password, salt):
+    started = time.perf_counter()
     # Hash password
-    hash = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, 100000)
-    # Return hash
-    return hash.hex()
-
-# Convert readable time to timestamp
-def readable_to_timestamp(readable_time):
-    # Convert readable time to datetime object
-    readable_time = datetime.datetime.strptime(readable_time, '%Y-%m-%d %H:%M:%S')
-    # Convert datetime object to timestamp
-    timestamp = int(readable_time.timestamp())
-    # Return timestamp
-    return int(timestamp)
+    hash = hashing.hash_password(password, salt)
+    # Record hashing time
+    elapsed = time.perf_counter() - started
+    hash_seconds.observe(elapsed)
+    if has_app_context() and 'request_hash_seconds' in g:
+        g.request_hash_seconds += elapsed
+    return hash
+
+# Convert timestamp to readable time
+def timestamp_to_readable(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+# Check reservation times, returns an error or None
+def check_reservation_times(start_time, end_time, now):
+    if end_time < now:
+        return 'End time is before current time'
+    if start_time < now:
+        return 'Start time is before current time'
+    if start_time > end_time:
+        return 'Start time is after end time'
+    return None
+
+# Get request fields from a JSON body or a form
+# A malformed body has no fields, parse_fields reports it
+def request_fields():
+    if request.is_json:
+        fields = request.get_json(silent=True)
+        return fields if isinstance(fields, dict) else {}
+    return request.form
+
+# Parse the request's fields with a schema before the view runs
+# The view gets the typed fields as its first argument, a request with invalid fields gets the list of errors instead
+def parse_fields(schema):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            # Malformed JSON is reported like any other invalid body
+            fields, errors = schema.parse(request.get_json(silent=True) if request.is_json else request.form)
+            if errors is not None:
+                invalid_requests.inc(route=request.url_rule.rule)
+                return jsonify({'status': 'error', 'error': schema.error or errors[0]['error'], 'errors': errors})
+            return view(fields, *args, **kwargs)
+        return wrapper
+    return decorator
+
+# Paging fields shared by the listings
+# limit is the number of rows per page, everything if not given, cursor is returned with the previous page,
+# and format ndjson streams newline delimited JSON instead of a single JSON object
+paging_fields = (schemas.Integer('limit', required=False, minimum=1), schemas.Text('cursor', required=False), schemas.Text('format', required=False))
+paging_schema = schemas.Schema(*paging_fields)
+
+# Get paging fields of a listing from the parsed fields
+# Returns (limit, cursor, ndjson)
+def listing_fields(fields):
+    ndjson = fields.format == 'ndjson' or 'application/x-ndjson' in request.headers.get('Accept', '')
+    return fields.limit, fields.cursor, ndjson
+
+# Answer a view with 304 Not Modified when the client already has its response
+# The weak ETag covers the versions of the given tables, the request's path, fields and Accept header,
+# the authenticated user if authenticate is given, and the value of extra() if given.
+# It is checked before the view runs, so an unchanged response costs no query at all.
+def conditional(*tables, authenticate=None, extra=None):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            user = None
+            if authenticate is not None:
+                # Let the view report failed authentication
+                user = authenticate()
+                if user is None:
+                    return view(*args, **kwargs)
+            fields = request_fields()
+            fields = fields.to_dict(flat=False) if hasattr(fields, 'to_dict') else fields
+            if isinstance(fields, dict):
+                fields = {key: value for key, value in fields.items() if key != 'token'}
+            etag = table_versions.etag(tables, [request.path, fields, request.headers.get('Accept'),
+                user[2] if user is not None else None, extra() if extra is not None else None])
+            if request.if_none_match.contains_weak(etag):
+                not_modified.inc(route=request.url_rule.rule)
+                response = Response(status=304)
+                response.set_etag(etag, weak=True)
+                return response
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag, weak=True)
+            return response
+        return wrapper
+    return decorator
+
+# Reject start_time and end_time in the past
+# Checked before conditional, so a window that has passed gets no 304 or cached result from when it was valid
+def future_times(view):
+    @functools.wraps(view)
+    def wrapper(fields, *args, **kwargs):
+        now = time.time()
+        if fields.start_time < now or fields.end_time < now:
+            return jsonify({'status': 'error', 'error': 'Invalid time'})
+        return view(fields, *args, **kwargs)
+    return wrapper
 
 ### BACKEND ###
+# Select reservations as (id, username, start_time, end_time, item, status, item_id, user_id)
+reservation_select = '''SELECT reservations.id, users.username, reservations.start_time, reservations.end_time, items.name, reservations.status, reservations.item_id, reservations.user_id
+    FROM reservations
+    JOIN users ON users.id = reservations.user_id
+    JOIN items ON items.id = reservations.item_id'''
+
+# Select current and archived reservations as (id, username, start_time, end_time, item, status)
+# Archived reservations of removed items are kept, with None as item
+history_select = '''SELECT history.id, users.username, history.start_time, history.end_time, items.name, history.status
+    FROM (SELECT id, user_id, item_id, start_time, end_time, status FROM reservations
+        UNION ALL SELECT id, user_id, item_id, start_time, end_time, status FROM reservations_archive) AS history
+    JOIN users ON users.id = history.user_id
+    LEFT JOIN items ON items.id = history.item_id'''
+
+# Select recurring reservations as (id, username, item, start_time, end_time, period, until)
+recurring_select = '''SELECT recurring_reservations.id, users.username, items.name, recurring_reservations.start_time, recurring_reservations.end_time,
+    recurring_reservations.period, recurring_reservations.until
+    FROM recurring_reservations
+    JOIN users ON users.id = recurring_reservations.user_id
+    JOIN items ON items.id = recurring_reservations.item_id'''
+
+# Get current reservations from their shards as {id: reservation}
+# The index knows the item, and so the shard, of every current reservation
+def fetch_reservations(reservation_ids):
+    groups = {}
+    for reservation_id in reservation_ids:
+        item = reservation_index.get_item(reservation_id)
+        if item is not None:
+            groups.setdefault(shard_set.shard_of(item), []).append(reservation_id)
+    reservations = {}
+    for shard, ids in groups.items():
+        with shard_set.pools[shard].connection() as db:
+            for index in range(0, len(ids), 500):
+                chunk = ids[index:index + 500]
+                rows = db.execute(reservation_select + ' WHERE reservations.id IN ({})'.format(', '.join('?' * len(chunk))), chunk).fetchall()
+                reservations.update((row[0], row) for row in rows)
+    return reservations
+
 def get_reservation(reservation_id):
-    # Define db and db_cur
-    db = connect_db()
-    db_cur = db.cursor()
-    # Get reservation from database
-    reservation = db_cur.execute('SELECT * FROM reservations WHERE id = ?', (reservation_id,)).fetchone()
-    # Close db connection
-    db.close()
-    # Return reservation
-    return reservation
+    # Get reservation from its shard
+    return fetch_reservations([reservation_id]).get(reservation_id)
+
+# Get (start_time, end_time, period, until, id) of an item's recurring reservations that can overlap the given times
+def select_rules(db_cur, item_id, start_time, end_time):
+    return db_cur.execute('SELECT start_time, end_time, period, until, id FROM recurring_reservations WHERE item_id = ? AND start_time <= ? AND until + (end_time - start_time) >= ?',
+        (item_id, end_time, start_time)).fetchall()
+
+# Get (start_time, end_time, ...) of an item's recurring occurrences overlapping the given times
+def select_occurrences(db_cur, item_id, start_time, end_time):
+    occurrences = []
+    for rule in select_rules(db_cur, item_id, start_time, end_time):
+        occurrences += intervals.occurrences(rule, start_time, end_time)
+    return occurrences
+
+# Get (start_time, end_time, ...) of an item's reservations and recurring occurrences overlapping the given times
+def select_overlapping(db_cur, item_id, start_time, end_time):
+    overlapping = db_cur.execute('SELECT start_time, end_time FROM reservations WHERE item_id = ? AND start_time <= ? AND end_time >= ?', (item_id, end_time, start_time)).fetchall()
+    return overlapping + select_occurrences(db_cur, item_id, start_time, end_time)
+
+# Reject a reservation of an item removed after it was looked up, runs on the writer thread of the item's shard
+def check_item_kept(item_id):
+    if item_id in removed_items:
+        raise writer.Rejected('Item not found')
+
+# Insert a reservation if fewer than quantity reservations of the item overlap it, runs on the writer thread of the item's shard
+def insert_reservation(db_cur, user_id, item_id, start_time, end_time, quantity=1):
+    check_item_kept(item_id)
+    # Check for conflicts in the same transaction as the insert
+    if quantity == 1:
+        conflict = db_cur.execute('SELECT 1 FROM reservations WHERE item_id = ? AND start_time <= ? AND end_time >= ? LIMIT 1', (item_id, end_time, start_time)).fetchone() is not None
+        conflict = conflict or bool(select_occurrences(db_cur, item_id, start_time, end_time))
+    else:
+        conflict = intervals.peak(select_overlapping(db_cur, item_id, start_time, end_time)) >= quantity
+    if conflict:
+        raise writer.Rejected('Item is reserved')
+    # Insert reservation into database with an id that is unique across shards
+    reservation_id = shard_set.next_id(db_cur, item_id)
+    db_cur.execute('INSERT INTO reservations (id, user_id, item_id, start_time, end_time, status) VALUES (?, ?, ?, ?, ?, ?)', (reservation_id, user_id, item_id, start_time, end_time, 'pending'))
+    return reservation_id
+
+# Insert a recurring reservation if every occurrence leaves a unit of the item free, runs on the writer thread of the item's shard
+# Returns the id of the rule, the occurrences are never stored
+def insert_rule(db_cur, user_id, item_id, start_time, end_time, period, until, quantity=1):
+    check_item_kept(item_id)
+    rule = (start_time, end_time, period, until, None)
+    last = intervals.last_end(rule)
+    # Load everything that can overlap an occurrence once, then check each occurrence in memory
+    existing = intervals.ItemIntervals()
+    for row in db_cur.execute('SELECT id, start_time, end_time FROM reservations WHERE item_id = ? AND start_time <= ? AND end_time >= ?', (item_id, last, start_time)):
+        existing.add(*row)
+    for row in select_rules(db_cur, item_id, start_time, last):
+        existing.add_rule(row)
+    for occurrence in intervals.occurrences(rule, start_time, last):
+        if not existing.is_free(occurrence[0], occurrence[1], quantity):
+            raise writer.Rejected('Item is reserved on {}'.format(timestamp_to_readable(occurrence[0])))
+    # Insert rule with an id that is unique across shards
+    rule_id = shard_set.next_id(db_cur, item_id, 'recurring_reservations')
+    db_cur.execute('INSERT INTO recurring_reservations (id, user_id, item_id, start_time, end_time, period, until) VALUES (?, ?, ?, ?, ?, ?, ?)',
+        (rule_id, user_id, item_id, start_time, end_time, period, until))
+    return rule_id
+
+# Delete a recurring reservation of a user, runs on the writer thread
+def delete_rule(db_cur, rule_id, user_id):
+    db_cur.execute('DELETE FROM recurring_reservations WHERE id = ? AND user_id = ?', (rule_id, user_id))
+    if db_cur.rowcount == 0:
+        raise writer.Rejected('Recurring reservation not found')
+
+# Delete a pending reservation of a user, runs on the writer thread
+def delete_reservation(db_cur, reservation_id, user_id):
+    db_cur.execute('DELETE FROM reservations WHERE id = ? AND user_id = ? AND status = ?', (reservation_id, user_id, 'pending'))
+    if db_cur.rowcount == 0:
+        raise writer.Rejected('Reservation is not pending')
+
+# Change the status of a reservation if it still has the expected one, runs on the writer thread
+def update_reservation_status(db_cur, reservation_id, status, expected):
+    db_cur.execute('UPDATE reservations SET status = ? WHERE id = ? AND status = ?', (status, reservation_id, expected))
+    if db_cur.rowcount == 0:
+        raise writer.Rejected('Reservation is not {}'.format(expected))
+
+# Delete the current and recurring reservations of an item, runs on the writer thread of the item's shard
+# Archived reservations stay in the history
+def delete_item_reservations(db_cur, item_id):
+    db_cur.execute('DELETE FROM reservations WHERE item_id = ?', (item_id,))
+    db_cur.execute('DELETE FROM recurring_reservations WHERE item_id = ?', (item_id,))
 
 def user_exists(username):
     # Define db and db_cur
@@ -100,427 +635,1209 @@ def user_exists(username):
     db_cur = db.cursor()
     # Check if username exists
     user = db_cur.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
-    # Close db connection
-    db.close()
     # Return True if user exists
     return user is not None
 
-def item_exists(item_name):
+# Get the id of a user, or None if it doesn't exist
+def get_user_id(username):
     # Define db and db_cur
     db = connect_db()
     db_cur = db.cursor()
-    # Check if item exists
-    item = db_cur.execute('SELECT * FROM items WHERE name = ?', (item_name,)).fetchone()
-    # Close db connection
-    db.close()
+    # Get user id from database
+    user = db_cur.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone()
+    return user[0] if user is not None else None
+
+# Get the id of an item, or None if it doesn't exist
+def get_item_id(item_name):
+    # Define db and db_cur
+    db = connect_db()
+    db_cur = db.cursor()
+    # Get item id from database
+    item = db_cur.execute('SELECT id FROM items WHERE name = ?', (item_name,)).fetchone()
+    return item[0] if item is not None else None
+
+# Get (id, quantity) of an item, or None if it doesn't exist
+def get_item(item_name):
+    # Define db and db_cur
+    db = connect_db()
+    db_cur = db.cursor()
+    # Get item from database
+    return db_cur.execute('SELECT id, quantity FROM items WHERE name = ?', (item_name,)).fetchone()
+
+def item_exists(item_name):
     # Return True if item exists
-    return item is not None
+    return get_item_id(item_name) is not None
 
 ### USER FUNCTIONS ###
 
-# Authenticate users
-def authenticate(username, password):
+# Get (username, permissions, user_id) if the password is valid, else None
+def check_password(username, password):
     # Define db and db_cur
     db = connect_db()
     db_cur = db.cursor()
-    # Check if username exists
-    user = db_cur.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
-    if user is None:
-        # Close db connection
-        db.close()
-        return False
-    # Get hash and salt from database
-    hash_salt = db_cur.execute('SELECT hash, salt FROM users WHERE username = ?', (username,)).fetchone()
-    # Check if password is valid
-    if hash_salt[0] != get_hash(password, hash_salt[1]):
-        # Close db connection
-        db.close()
-        return False
-    # Return True if user is authenticated
-    db.close()
-    return True
+    # Get hash, salt, and permissions from database
+    user = db_cur.execute('SELECT hash, salt, permissions, id FROM users WHERE username = ?', (username,)).fetchone()
+    # Check if user exists and password is valid
+    if user is None or user[0] != get_hash(password, user[1]):
+        return None
+    # Count the request against the user, like requests with a token
+    charge_user(user[3])
+    return username, user[2], user[3]
+
+# Authenticate a request with a session token, or with username and password
+# Returns (username, permissions, user_id) or None
+def authenticate_request():
+    # Only check once per request
+    if 'request_user' not in g:
+        g.request_user = check_request_credentials()
+    return g.request_user
+
+def check_request_credentials():
+    fields = request_fields()
+    # Token can be sent as a bearer token or as a field
+    token = fields.get('token')
+    authorization = request.headers.get('Authorization', '')
+    if authorization.startswith('Bearer '):
+        token = authorization[len('Bearer '):]
+    if token:
+        return session_store.verify(token)
+    # Fall back to username and password
+    if 'username' not in fields or 'password' not in fields:
+        return None
+    return check_password(fields['username'], fields['password'])
+
+# Get metrics in the Prometheus text format
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+# Fields of a login
+login_fields = schemas.Schema(schemas.Text('username'), schemas.Text('password'))
 
 # Handle login request
 @app.route('/login', methods=['POST'])
-def login():
-    try:
-        # Define db and db_cur
-        db = connect_db()
-        db_cur = db.cursor()
-        # Get username and password from request
-        username = request.form['username']
-        password = request.form['password']
-        # Check if username exists
-        user = db_cur.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
-        if user is None:
-            return jsonify({'status': 'error', 'error': 'Authentication failed'})
-        # Authenticate user
-        if not authenticate(username, password):
-            return jsonify({'status': 'error', 'error': 'Authentication failed'})
-        # Close database connection
-        db.close()
-        # Return user info
-        return jsonify({'status': 'success', 'username': user[1], 'permissions': user[5]})
-    except Exception as e:
-        # Print error
-        print(e)
-        # Return error
-        return jsonify({'status': 'error', 'error': 'Internal server error'})
-
-# Get list of items without reservations between given times -- tested
+@parse_fields(login_fields)
+def login(fields):
+    # Authenticate user
+    user = check_password(fields.username, fields.password)
+    if user is None:
+        return jsonify({'status': 'error', 'error': 'Authentication failed'})
+    # Issue a session token for later requests
+    token, expiry = session_store.issue(user)
+    # Return user info
+    return jsonify({'status': 'success', 'username': user[0], 'permissions': user[1], 'token': token, 'expires': expiry})
+
+# Issue a session token (password is only hashed here)
+@app.route('/token', methods=['POST'])
+@parse_fields(login_fields)
+def issue_token(fields):
+    # Authenticate user
+    user = check_password(fields.username, fields.password)
+    if user is None:
+        return jsonify({'status': 'error', 'error': 'Authentication failed'})
+    # Create token
+    token, expiry = session_store.issue(user)
+    # Return token and its expiry
+    return jsonify({'status': 'success', 'token': token, 'expires': expiry})
+
+# Revoke a session token
+@app.route('/token/revoke', methods=['POST'])
+@parse_fields(schemas.Schema(schemas.Text('token')))
+def revoke_token(fields):
+    # Revoke token
+    if not session_store.revoke(fields.token):
+        return jsonify({'status': 'error', 'error': 'Token not found'})
+    return jsonify({'status': 'success'})
+
+# Get list of items with a free unit between given times, and how many units are free -- tested
 @app.route('/items', methods=['POST'])
-def get_items():
-    try:
-        # Define db and db_cur
-        db = connect_db()
-        db_cur = db.cursor()
-        # Get start and end times from request
-        start_time = request.form['start_time']
-        end_time = request.form['end_time']
-        # Run tests on start and end times
-        if not tests.check_time_valid(start_time) or not tests.check_time_valid(end_time):
-            return jsonify({'status': 'error', 'error': 'Invalid time'})
-        # Convert start and end times to timestamps
-        start_time = readable_to_timestamp(start_time)
-        end_time = readable_to_timestamp(end_time)
-        # Get list of items from database
-        items = db_cur.execute('SELECT * FROM items').fetchall()
-        # Close database connection
-        db.close()
-        # Check list of items for reservations between given times
-        for item in items:
-            # Define db and db_cur
-            db = connect_db()
-            db_cur = db.cursor()
-            # Get list of reservations for item where start time is before end time and end time is after start time
-            within_reservations = db_cur.execute('SELECT * FROM reservations WHERE item = ? AND start_time <= ? AND end_time >= ?', (item[1], end_time, start_time)).fetchall()
-            # Get list of reservations where start time is before start time and end time is after end time
-            encap_reservations = db_cur.execute('SELECT * FROM reservations WHERE item = ? AND start_time <= ? AND end_time >= ?', (item[1], start_time, start_time)).fetchall()
-            # Close database connection
-            db.close()
-            # If there are existing reservations, remove item from list
-            if len(within_reservations) > 0:
-                items.remove(item)
-            # If there are existing reservations, remove item from list
-            elif len(encap_reservations) > 0:
-                items.remove(item)
-        # Create field names for items
-        field_names = ['id', 'name', 'description', 'status']
-        # Create list of items with field names
-        items = [dict(zip(field_names, item)) for item in items]
-        # Return list of items
+@parse_fields(schemas.Schema(schemas.Time('start_time'), schemas.Time('end_time'), error='Invalid time'))
+@future_times
+@conditional('items', 'reservations')
+def get_items(fields):
+    start_time = fields.start_time
+    end_time = fields.end_time
+    # Return cached list of items if the same times were asked recently
+    items = availability_cache.get(start_time, end_time)
+    if items is not None:
         return jsonify(items)
-    except Exception as e:
-        # Debug print
-        print(e)
-        # Return error
-        return jsonify({'status': 'error', 'error': 'Internal server error'})
+    generation = availability_cache.generation
+    # Get list of items from database
+    items = db_cursor().execute('SELECT id, name, description, status, quantity FROM items').fetchall()
+    # Count how many units of each item are still free at the busiest moment of the given times
+    items = [item + (reservation_index.remaining(item[0], start_time, end_time, item[4]),) for item in items]
+    # Create field names for items
+    field_names = ['id', 'name', 'description', 'status', 'quantity', 'remaining']
+    # Create list of items with a free unit, with field names
+    items = [dict(zip(field_names, item)) for item in items if item[5] > 0]
+    # Remember result for the same times
+    availability_cache.put(start_time, end_time, items, generation)
+    # Return list of items
+    return jsonify(items)
+
+# Get free and busy intervals of items between given times
+# Takes start_time, end_time, optional items (list or comma separated names),
+# min_slot and granularity (seconds)
+@app.route('/items/timeline', methods=['POST'])
+@conditional('items', 'reservations')
+@parse_fields(schemas.Schema(schemas.Time('start_time'), schemas.Time('end_time'), schemas.Names('items'),
+    schemas.Integer('min_slot', required=False, default=0, minimum=0), schemas.Integer('granularity', required=False, default=0, minimum=0)))
+def get_timeline(fields):
+    start_time = fields.start_time
+    end_time = fields.end_time
+    if start_time > end_time:
+        return jsonify({'status': 'error', 'error': 'Start time is after end time'})
+    # Get requested items, or all items
+    items = db_cursor().execute('SELECT id, name, quantity FROM items').fetchall()
+    if fields.items:
+        names = set(fields.items)
+        items = [item for item in items if item[1] in names]
+    # Sweep each item's reservations once, an item is busy when all its units are reserved
+    timelines = {}
+    for item_id, name, quantity in items:
+        busy, free = intervals.timeline(reservation_index.overlapping(item_id, start_time, end_time), start_time, end_time, fields.min_slot, fields.granularity, quantity)
+        timelines[name] = {'busy': busy, 'free': free}
+    return jsonify({'status': 'success', 'start_time': start_time, 'end_time': end_time, 'items': timelines})
+
+# Fields of a reservation
+reservation_fields = schemas.Schema(schemas.Text('item'), schemas.Time('start_time'), schemas.Time('end_time'))
 
 # Handle reservation request
 @app.route('/reserve', methods=['POST'])
-def reserve():
-    error = None
+@parse_fields(reservation_fields)
+def reserve(fields):
+    ## Authentication ##
+    user = authenticate_request()
+    if user is None:
+        return jsonify({'status': 'error', 'error': 'Authentication failed'})
+    user_id = user[2]
+    item, start_time, end_time = fields
+    ## Error checking ##
+    item_id, quantity = get_item(item) or (None, 1)
+    if item_id is None:
+        return jsonify({'status': 'error', 'error': 'Item not found'})
+    error = check_reservation_times(start_time, end_time, time.time())
+    # If every unit of the item is reserved at some point of the given times, error
+    if error is None and not reservation_index.is_free(item_id, start_time, end_time, quantity):
+        error = 'Item is reserved'
+    if error is not None:
+        return jsonify({'status': 'error', 'error': error})
+    ## Create reservation ##
+    # Insert on the writer thread, then add reservation to index and feed once committed
+    def created(reservation_id):
+        reservation_index.add(reservation_id, item_id, start_time, end_time, 'pending')
+        publish_reservation('reservation.created', reservation_id, item, start_time, end_time)
     try:
-        ## Getting forms ##
-        username = request.form['username']
-        password = request.form['password']
-        start_time = request.form['start_time']
-        end_time = request.form['end_time']
-        item = request.form['item']
-        ## Authentication ##
-        if not authenticate(username, password):
-            error = 'Authentication failed'
-        ## Error checking ##
-        if not item_exists(item):
+        reservation_id = shard_set.writer(item_id).execute(
+            lambda db_cur: insert_reservation(db_cur, user_id, item_id, start_time, end_time, quantity),
+            created)
+    except writer.Rejected as e:
+        return jsonify({'status': 'error', 'error': str(e)})
+    # Return the reservation and how many units are left for the same times
+    return jsonify({'status': 'success', 'reservation_id': reservation_id, 'remaining': reservation_index.remaining(item_id, start_time, end_time, quantity)})
+
+# Handle many reservations at once, committed in one transaction per shard
+# Takes a JSON body with 'entries' (list of item, start_time, end_time) and optional 'atomic'
+# In atomic mode nothing is reserved unless every entry can be reserved
+@app.route('/reserve/batch', methods=['POST'])
+@parse_fields(schemas.Schema(schemas.List('entries'), schemas.Boolean('atomic')))
+def reserve_batch(fields):
+    ## Authentication ##
+    user = authenticate_request()
+    if user is None:
+        return jsonify({'status': 'error', 'error': 'Authentication failed'})
+    user_id = user[2]
+    atomic = fields.atomic
+    # Parse every entry once, as (fields, errors)
+    entries = [reservation_fields.parse(entry) for entry in fields.entries]
+    db_cur = db_cursor()
+    # Look up all requested items at once
+    names = list({entry.item for entry, errors in entries if entry is not None})
+    item_ids = {}
+    quantities = {}
+    for index in range(0, len(names), 500):
+        chunk = names[index:index + 500]
+        rows = db_cur.execute('SELECT name, id, quantity FROM items WHERE name IN ({})'.format(', '.join('?' * len(chunk))), chunk).fetchall()
+        item_ids.update((row[0], row[1]) for row in rows)
+        quantities.update((row[1], row[2]) for row in rows)
+    ## Error checking ##
+    now = datetime.datetime.now().timestamp()
+    # Entries accepted so far, to catch conflicts within the batch
+    accepted = {}
+    results = []
+    reservations = []
+    for entry, errors in entries:
+        if errors is not None:
+            results.append({'status': 'error', 'error': 'Invalid entry', 'errors': errors})
+            continue
+        item = item_ids.get(entry.item)
+        start_time = entry.start_time
+        end_time = entry.end_time
+        error = None
+        if item is None:
             error = 'Item not found'
-        if readable_to_timestamp(start_time) > readable_to_timestamp(end_time):
-            error = 'Start time is after end time'
-        if readable_to_timestamp(start_time) < datetime.datetime.now().timestamp():
-            error = 'Start time is before current time'
-        if readable_to_timestamp(end_time) < datetime.datetime.now().timestamp():
-            error = 'End time is before current time'
-        db = connect_db()
-        db_cur = db.cursor()
-        # Get reservations for item where start time is before end time and end time is after start time
-        reservations = db_cur.execute('SELECT * FROM reservations WHERE item = ? AND start_time <= ? AND end_time >= ?', (item, end_time, start_time)).fetchall()
-        # Get reservations where start time is before start time and end time is after end time
-        encap_reservations = db_cur.execute('SELECT * FROM reservations WHERE item = ? AND start_time <= ? AND end_time >= ?', (item, start_time, start_time)).fetchall()
-        db.close()
-        # If there are existing reservations, error
-        if len(reservations) > 0:
-            error = 'Item is reserved'
-        elif len(encap_reservations) > 0:
+        else:
+            error = check_reservation_times(start_time, end_time, now)
+        if error is None and not reservation_index.is_free(item, start_time, end_time, quantities[item]):
             error = 'Item is reserved'
-        if error is None:
-            ## Create reservation ##
-            db = connect_db()
-            db_cur = db.cursor()
-            # Insert reservation into database
-            db_cur.execute('INSERT INTO reservations (username, item, start_time, end_time, status) VALUES (?, ?, ?, ?, ?)', (username, item, readable_to_timestamp(start_time), readable_to_timestamp(end_time), 'pending'))
-            # Close database connection
-            db.commit()
-            db.close()
-            return jsonify({'status': 'success'})
+        # Earlier entries of the batch take units too
+        if error is None and item in accepted and intervals.peak(reservation_index.overlapping(item, start_time, end_time) + accepted[item].overlapping(start_time, end_time)) >= quantities[item]:
+            error = 'Conflicts with another entry'
+        if error is not None:
+            results.append({'status': 'error', 'error': error})
+            continue
+        # Remember entry for the following checks
+        if item not in accepted:
+            accepted[item] = intervals.ItemIntervals()
+        accepted[item].add(len(results), start_time, end_time)
+        results.append({'status': 'success'})
+        reservations.append((len(results) - 1, item, start_time, end_time))
+    # In atomic mode any error rejects the whole batch
+    if atomic and len(reservations) < len(entries):
+        for result in results:
+            if result['status'] == 'success':
+                result['status'] = 'aborted'
+        return jsonify({'status': 'error', 'error': 'Batch rejected', 'results': results})
+    ## Create reservations ##
+    # Insert the entries of each shard in one operation on the shard's writer thread
+    groups = {}
+    for reservation in reservations:
+        groups.setdefault(shard_set.shard_of(reservation[1]), []).append(reservation)
+    def insert_entries(group):
+        def apply(db_cur):
+            created = []
+            for index, item, start_time, end_time in group:
+                try:
+                    created.append((index, item, start_time, end_time, insert_reservation(db_cur, user_id, item, start_time, end_time, quantities[item])))
+                except writer.Rejected as e:
+                    # Item was reserved by another request after it was checked
+                    results[index] = {'status': 'error', 'error': str(e)}
+                    if atomic:
+                        raise writer.Rejected('Batch rejected')
+            return created
+        return apply
+    # Add reservations to index and feed once committed
+    item_names = {item_id: name for name, item_id in item_ids.items()}
+    def index_entries(created):
+        for index, item, start_time, end_time, reservation_id in created:
+            results[index]['reservation_id'] = reservation_id
+            reservation_index.add(reservation_id, item, start_time, end_time, 'pending')
+            publish_reservation('reservation.created', reservation_id, item_names[item], start_time, end_time)
+        # Count free units once the whole group is in the index
+        for index, item, start_time, end_time, reservation_id in created:
+            results[index]['remaining'] = reservation_index.remaining(item, start_time, end_time, quantities[item])
+    committed = []
+    try:
+        if not atomic or len(groups) <= 1:
+            for shard, group in groups.items():
+                committed.append((shard, shard_set.writers[shard].execute(insert_entries(group), index_entries)))
         else:
-            # Debug print
-            print(error)
-            return jsonify({'status': 'error', 'error': error})
-    except:
-        print('Error')
-        return jsonify({'status': 'error', 'error': 'Internal server error'})
+            # An atomic batch over several shards is only indexed once every shard committed its entries
+            for shard, group in groups.items():
+                committed.append((shard, shard_set.writers[shard].execute(insert_entries(group))))
+            for shard, created in committed:
+                index_entries(created)
+    except writer.Rejected as e:
+        # Undo the entries of shards that already committed them
+        for shard, created in committed:
+            ids = [entry[4] for entry in created]
+            shard_set.writers[shard].execute(lambda db_cur, ids=ids: db_cur.execute('DELETE FROM reservations WHERE id IN ({})'.format(', '.join('?' * len(ids))), ids))
+        for result in results:
+            if result['status'] == 'success':
+                result['status'] = 'aborted'
+                result.pop('reservation_id', None)
+        return jsonify({'status': 'error', 'error': str(e), 'results': results})
+    return jsonify({'status': 'success', 'reserved': sum(len(created) for shard, created in committed), 'results': results})
+
+# Fields naming a reservation
+reservation_id_fields = schemas.Schema(schemas.Integer('reservation_id'))
 
 # Cancel reservation
 @app.route('/cancel', methods=['POST'])
-def cancel():
-    # Get username, password, and reservation id from request
-    username = request.form['username']
-    password = request.form['password']
-    reservation_id = request.form['reservation_id']
+@parse_fields(reservation_id_fields)
+def cancel(fields):
     # Authenticate user
-    if not authenticate(username, password):
+    user = authenticate_request()
+    if user is None:
         return jsonify({'error': 'Authentication failed'})
+    username = user[0]
     # Check if reservation exists
-    reservation = get_reservation(reservation_id)
+    reservation = get_reservation(fields.reservation_id)
     if reservation is None:
         return jsonify({'error': 'Reservation not found'})
     # Check if username for reservation is correct
-    if reservation[0] != username:
+    if reservation[1] != username:
         return jsonify({'error': 'Username is incorrect'})
     # Check if reservation is pending
-    if reservation[4] != 'pending':
+    if reservation[5] != 'pending':
         return jsonify({'error': 'Reservation is not pending'})
-    # Cancel reservation
-    db = connect_db()
-    db_cur = db.cursor()
-    db_cur.execute('DELETE FROM reservations WHERE id = ?', (reservation_id,))
-    db.commit()
-    db.close()
+    # Cancel reservation on the writer thread, then remove it from index and publish it once committed
+    def cancelled(result):
+        reservation_index.remove(reservation[0])
+        publish_reservation('reservation.cancelled', reservation[0], reservation[4], reservation[2], reservation[3])
+    try:
+        shard_set.writer(reservation[6]).execute(
+            lambda db_cur: delete_reservation(db_cur, reservation[0], user[2]),
+            cancelled)
+    except writer.Rejected as e:
+        return jsonify({'error': str(e)})
     # Return reservation info
-    return jsonify({'username': username, 'item': reservation[2], 'start_time': reservation[3], 'end_time': reservation[4], 'status': 'cancelled'})
+    return jsonify({'username': username, 'item': reservation[4], 'start_time': reservation[2], 'end_time': reservation[3], 'status': 'cancelled'})
+
+# Publish a change of a recurring reservation on the change feed
+def publish_rule(type, rule_id, item, start_time, end_time, period, until):
+    change_feed.publish(type, {'id': rule_id, 'item': item, 'start_time': start_time, 'end_time': end_time, 'period': period, 'until': until})
+
+# Reserve an item for the same times every day, week or period seconds
+# Takes item, start_time and end_time of the first occurrence, every ('daily', 'weekly' or seconds) and until,
+# the last occurrence starts no later than until. Only the rule is stored, occurrences are expanded when they are checked.
+# Periods are exact numbers of seconds, so occurrences keep their UTC time across daylight saving changes.
+@app.route('/reserve/recurring', methods=['POST'])
+@parse_fields(schemas.Schema(schemas.Text('item'), schemas.Time('start_time'), schemas.Time('end_time'), schemas.Time('until'),
+    schemas.Integer('every', minimum=1, names=recurring_periods)))
+def reserve_recurring(fields):
+    # Authenticate user
+    user = authenticate_request()
+    if user is None:
+        return jsonify({'status': 'error', 'error': 'Authentication failed'})
+    item, start_time, end_time, until, period = fields
+    ## Error checking ##
+    item_id, quantity = get_item(item) or (None, 1)
+    if item_id is None:
+        return jsonify({'status': 'error', 'error': 'Item not found'})
+    error = check_reservation_times(start_time, end_time, datetime.datetime.now().timestamp())
+    if error is not None:
+        return jsonify({'status': 'error', 'error': error})
+    # Occurrences of one rule must not overlap each other
+    if period <= end_time - start_time:
+        return jsonify({'status': 'error', 'error': 'Period is shorter than the reservation'})
+    if until < start_time:
+        return jsonify({'status': 'error', 'error': 'Until is before start time'})
+    if (until - start_time) // period + 1 > recurring_max_occurrences:
+        return jsonify({'status': 'error', 'error': 'Too many occurrences'})
+    ## Create recurring reservation ##
+    # Insert on the writer thread, then add rule to index and feed once committed
+    def created(rule_id):
+        reservation_index.add_rule(rule_id, item_id, start_time, end_time, period, until)
+        table_versions.bump('reservations')
+        publish_rule('recurring.created', rule_id, item, start_time, end_time, period, until)
+    try:
+        rule_id = shard_set.writer(item_id).execute(
+            lambda db_cur: insert_rule(db_cur, user[2], item_id, start_time, end_time, period, until, quantity),
+            created)
+    except writer.Rejected as e:
+        return jsonify({'status': 'error', 'error': str(e)})
+    # Return the rule
+    return jsonify({'status': 'success', 'recurring_id': rule_id, 'item': item, 'start_time': start_time, 'end_time': end_time,
+        'period': period, 'until': until, 'occurrences': (until - start_time) // period + 1})
+
+# Get own recurring reservations with their next occurrence
+@app.route('/recurring', methods=['POST'])
+def list_recurring():
+    # Authenticate user
+    user = authenticate_request()
+    if user is None:
+        return jsonify({'status': 'error', 'error': 'Authentication failed'})
+    now = int(time.time())
+    rules = []
+    for pool in shard_set.pools:
+        with pool.connection() as db:
+            rules += db.execute('''SELECT recurring_reservations.id, items.name, recurring_reservations.start_time, recurring_reservations.end_time,
+                recurring_reservations.period, recurring_reservations.until
+                FROM recurring_reservations JOIN items ON items.id = recurring_reservations.item_id
+                WHERE recurring_reservations.user_id = ?''', (user[2],)).fetchall()
+    field_names = ['id', 'item', 'start_time', 'end_time', 'period', 'until']
+    result = []
+    for rule in sorted(rules):
+        rule = dict(zip(field_names, rule))
+        # First occurrence that hasn't ended yet, None once the rule is over
+        upcoming = intervals.occurrences((rule['start_time'], rule['end_time'], rule['period'], rule['until'], rule['id']), now, max(now, rule['start_time']) + rule['period'])
+        rule['next'] = [upcoming[0][0], upcoming[0][1]] if upcoming else None
+        result.append(rule)
+    return jsonify({'status': 'success', 'recurring': result})
+
+# Cancel a recurring reservation with all its occurrences
+@app.route('/recurring/cancel', methods=['POST'])
+@parse_fields(schemas.Schema(schemas.Integer('recurring_id')))
+def cancel_recurring(fields):
+    # Authenticate user
+    user = authenticate_request()
+    if user is None:
+        return jsonify({'error': 'Authentication failed'})
+    # Get rule from its shard, the index knows its item
+    rule_id = fields.recurring_id
+    item_id = reservation_index.get_rule_item(rule_id)
+    rule = None
+    if item_id is not None:
+        with shard_set.pool(item_id).connection() as db:
+            rule = db.execute('''SELECT recurring_reservations.id, items.name, recurring_reservations.start_time, recurring_reservations.end_time,
+                recurring_reservations.period, recurring_reservations.until, recurring_reservations.user_id
+                FROM recurring_reservations JOIN items ON items.id = recurring_reservations.item_id
+                WHERE recurring_reservations.id = ?''', (rule_id,)).fetchone()
+    if rule is None:
+        return jsonify({'error': 'Recurring reservation not found'})
+    # Check if the rule belongs to the user
+    if rule[6] != user[2]:
+        return jsonify({'error': 'Username is incorrect'})
+    # Delete on the writer thread, then remove rule from index and publish it once committed
+    def cancelled(result):
+        reservation_index.remove_rule(rule_id)
+        table_versions.bump('reservations')
+        publish_rule('recurring.cancelled', *rule[:6])
+    try:
+        shard_set.writer(item_id).execute(lambda db_cur: delete_rule(db_cur, rule_id, user[2]), cancelled)
+    except writer.Rejected as e:
+        return jsonify({'error': str(e)})
+    # Return rule info
+    return jsonify({'recurring_id': rule_id, 'item': rule[1], 'start_time': rule[2], 'end_time': rule[3], 'period': rule[4], 'until': rule[5], 'status': 'cancelled'})
+
+# Stream current and archived reservations, newest first, optionally of one user and one item
+def stream_history(fields, user_id, item_id):
+    limit, cursor, ndjson = listing_fields(fields)
+    query = history_select + ' WHERE 1'
+    params = []
+    if user_id is not None:
+        query += ' AND history.user_id = ?'
+        params.append(user_id)
+    if item_id is not None:
+        query += ' AND history.item_id = ?'
+        params.append(item_id)
+    if cursor is not None:
+        query += ' AND (history.start_time, history.id) < (?, ?)'
+        params += parse_time_cursor(cursor)
+    query += ' ORDER BY history.start_time DESC, history.id DESC'
+    # Merge the newest reservations of every shard
+    return stream_listing('reservations', query, params, lambda row: '{}:{}'.format(row[2], row[0]), list, limit, ndjson,
+        pools=shard_set.pools, order=lambda row: (row[2], row[0]), reverse=True)
+
+# Get own reservation history, including archived reservations
+# Supports 'item', 'limit', 'cursor', and 'format' (json or ndjson)
+@app.route('/history', methods=['POST'])
+@conditional('reservations', 'items', authenticate=authenticate_request)
+@parse_fields(schemas.Schema(schemas.Text('item', required=False), *paging_fields))
+def get_history(fields):
+    # Authenticate user
+    user = authenticate_request()
+    if user is None:
+        return jsonify({'error': 'Authentication failed'})
+    # Get optional item filter
+    item_id = None
+    if fields.item:
+        item_id = get_item_id(fields.item)
+        if item_id is None:
+            return jsonify({'error': 'Item not found'})
+    try:
+        return stream_history(fields, user[2], item_id)
+    except ValueError:
+        return jsonify({'error': 'Invalid paging fields'})
+
+# Get the sequence number to resume the change feed after, None to start from now
+# Ids from another server run give -1, which is answered with a reset
+def feed_sequence():
+    sequence = request.headers.get('Last-Event-ID') or request.args.get('since')
+    return change_feed.parse_id(sequence) if sequence else None
+
+# Get the item names to filter the change feed by, None for all
+def feed_items():
+    items = request.args.get('items')
+    return set(name.strip() for name in items.split(',')) if items else None
+
+# Check if an event concerns one of the given items
+def feed_matches(event, items):
+    return items is None or event[2].get('item', event[2].get('name')) in items
+
+# Stream reservation and item changes as server-sent events
+# Resumes after the 'Last-Event-ID' header or 'since' argument, sends a 'reset' event if that is too old
+# Supports 'items' (comma separated names) to only get changes of some items
+@app.route('/events', methods=['GET'])
+def stream_events():
+    try:
+        sequence = feed_sequence()
+    except ValueError:
+        return jsonify({'error': 'Invalid sequence number'})
+    items = feed_items()
+    def generate():
+        with change_feed.subscribe():
+            last = change_feed.sequence if sequence is None else sequence
+            # Tell the client where the feed is, so it can resume from there
+            yield 'retry: 3000\n: sequence {}\n\n'.format(change_feed.event_id(change_feed.sequence))
+            while True:
+                events = change_feed.wait(last, feed_keepalive)
+                if events is None:
+                    # Missed events are gone, the client has to reload its state
+                    last = change_feed.sequence
+                    yield 'id: {}\nevent: reset\ndata: {{}}\n\n'.format(change_feed.event_id(last))
+                    continue
+                if not events:
+                    # Comments keep proxies from closing the connection and detect closed clients
+                    yield ': keepalive\n\n'
+                    continue
+                last = events[-1][0]
+                yield ''.join(feed.to_sse(change_feed, event) for event in events if feed_matches(event, items))
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Long-poll reservation and item changes after the 'since' sequence number
+# Waits up to 'timeout' seconds for events, returns 'reset' if the sequence number is too old
+@app.route('/events/poll', methods=['GET'])
+def poll_events():
+    try:
+        sequence = feed_sequence()
+        timeout = feed.parse_timeout(request.args.get('timeout'), feed_max_wait)
+    except ValueError:
+        return jsonify({'error': 'Invalid sequence number or timeout'})
+    items = feed_items()
+    if sequence is None:
+        # Nothing to wait for, just tell the client where to start
+        return jsonify({'events': [], 'sequence': change_feed.event_id(change_feed.sequence)})
+    events = change_feed.wait(sequence, timeout)
+    if events is None:
+        return jsonify({'error': 'reset', 'sequence': change_feed.event_id(change_feed.sequence)})
+    return jsonify({'events': [feed.to_json(change_feed, event) for event in events if feed_matches(event, items)],
+        'sequence': change_feed.event_id(events[-1][0] if events else sequence)})
 
 ### END USER FUNCTIONS ###
 
 
 ### Admin functions ###
 
-# Authenticate and check if user is admin
-def authenticate_admin(username, password):
-    # Check if username exists
-    if not user_exists(username):
-        # Close database connection
-        db.close()
-        return False
-    # Get hash and salt from database
-    db = connect_db()
-    db_cur = db.cursor()
-    hash_and_salt = db_cur.execute('SELECT hash, salt FROM users WHERE username = ?', (username,)).fetchone()
-    # Close database connection
-    db.close()
-    # Check if password is correct
-    if hash_and_salt is not None:
-        if hash_and_salt[0] == get_hash(password, hash_and_salt[1]):
-            return True
-        else:
-            return False
-    else:
-        return False
+# Authenticate a request and check if user is admin
+# Returns (username, permissions, user_id) or None
+def authenticate_admin_request():
+    user = authenticate_request()
+    if user is None or user[1] != 'admin':
+        return None
+    return user
 
 # lend reservation (Only admin can lend)
 @app.route('/admin/lend', methods=['POST'])
-def lend():
-    # Get username, password, and reservation id from request
-    username = request.form['username']
-    password = request.form['password']
-    reservation_id = request.form['reservation_id']
+@parse_fields(reservation_id_fields)
+def lend(fields):
     # Authenticate admin
-    if not authenticate_admin(username, password):
+    if authenticate_admin_request() is None:
         return jsonify({'error': 'Authentication failed'})
     # Check if reservation exists
-    reservation = get_reservation(reservation_id)
+    reservation = get_reservation(fields.reservation_id)
     if reservation is None:
         return jsonify({'error': 'Reservation not found'})
-    # Check if username for reservation is correct
-    if reservation[0] != username:
-        return jsonify({'error': 'Username is incorrect'})
     # Check if reservation is pending
-    if reservation[4] != 'pending':
+    if reservation[5] != 'pending':
         return jsonify({'error': 'Reservation is not pending'})
-    # lend reservation
-    db = connect_db()
-    db_cur = db.cursor()
-    db_cur.execute('UPDATE reservations SET status = ? WHERE id = ?', ('lended', reservation_id))
-    db.commit()
-    db.close()
+    # lend reservation on its shard's writer thread, then update it in index and publish it once committed
+    def lent(result):
+        reservation_index.set_status(reservation[0], 'lent')
+        publish_reservation('reservation.lent', reservation[0], reservation[4], reservation[2], reservation[3])
+    try:
+        shard_set.writer(reservation[6]).execute(
+            lambda db_cur: update_reservation_status(db_cur, reservation[0], 'lent', 'pending'),
+            lent)
+    except writer.Rejected as e:
+        return jsonify({'error': str(e)})
     # Return reservation info
-    return jsonify({'username': username, 'item': reservation[2], 'start_time': reservation[3], 'end_time': reservation[4], 'status': 'lent'})
+    return jsonify({'username': reservation[1], 'item': reservation[4], 'start_time': reservation[2], 'end_time': reservation[3], 'status': 'lent'})
 
 # return reservation (Only admin can return)
 @app.route('/admin/return', methods=['POST'])
-def return_reservation():
-    # Get username, password, and reservation id from request
-    username = request.form['username']
-    password = request.form['password']
-    reservation_id = request.form['reservation_id']
-    # Authenticate user
-    if not authenticate_admin(username, password):
+@parse_fields(reservation_id_fields)
+def return_reservation(fields):
+    # Authenticate admin
+    if authenticate_admin_request() is None:
         return jsonify({'error': 'Authentication failed'})
     # Check if reservation exists
-    reservation = get_reservation(reservation_id)
+    reservation = get_reservation(fields.reservation_id)
     if reservation is None:
         return jsonify({'error': 'Reservation not found'})
-    # Check if username for reservation is correct
-    if reservation[0] != username:
-        return jsonify({'error': 'Username is incorrect'})
     # Check if reservation is lent
-    if reservation[4] != 'lent':
+    if reservation[5] != 'lent':
         return jsonify({'error': 'Reservation is not lent'})
-    # Return reservation
-    db = connect_db()
-    db_cur = db.cursor()
-    db_cur.execute('UPDATE reservations SET status = ? WHERE id = ?', ('returned', reservation_id))
-    db.commit()
-    db.close()
+    # Return reservation on its shard's writer thread, then update it in index and publish it once committed
+    def returned(result):
+        reservation_index.set_status(reservation[0], 'returned')
+        publish_reservation('reservation.returned', reservation[0], reservation[4], reservation[2], reservation[3])
+    try:
+        shard_set.writer(reservation[6]).execute(
+            lambda db_cur: update_reservation_status(db_cur, reservation[0], 'returned', 'lent'),
+            returned)
+    except writer.Rejected as e:
+        return jsonify({'error': str(e)})
     # Return reservation info
-    return jsonify({'username': username, 'item': reservation[2], 'start_time': reservation[3], 'end_time': reservation[4], 'status': 'returned'})
+    return jsonify({'username': reservation[1], 'item': reservation[4], 'start_time': reservation[2], 'end_time': reservation[3], 'status': 'returned'})
+
+# Split a 'time:id' cursor into integers
+def parse_time_cursor(cursor):
+    time_value, row_id = cursor.split(':')
+    return int(time_value), int(row_id)
+
+# Stream a listing as JSON or NDJSON
+# batches(db) yields lists of JSON values and runs with a connection borrowed for the response
+def stream_batches(name, batches, next_cursor, ndjson):
+    def generate():
+        with db_pool.connection() as db:
+            if not ndjson:
+                yield '{"%s": [' % name
+            first = True
+            for batch in batches(db):
+                if not batch:
+                    continue
+                if ndjson:
+                    yield ''.join(json.dumps(value) + '\n' for value in batch)
+                else:
+                    yield ('' if first else ', ') + ', '.join(json.dumps(value) for value in batch)
+                first = False
+            if not ndjson:
+                yield '], "next_cursor": %s}' % json.dumps(next_cursor)
+    headers = {'X-Next-Cursor': next_cursor} if next_cursor is not None else {}
+    return Response(generate(), mimetype='application/x-ndjson' if ndjson else 'application/json', headers=headers)
+
+# Stream the rows of a listing
+# key(row) gives the cursor of a row and convert(row) its JSON value.
+# With several pools the query runs on each of them and the sorted results are merged by order(row)
+def stream_listing(name, query, params, key, convert, limit, ndjson, pools=None, order=None, reverse=False):
+    pools = pools or [db_pool]
+    def merge(cursors):
+        return cursors[0] if len(cursors) == 1 else heapq.merge(*cursors, key=order, reverse=reverse)
+    if limit is not None:
+        # A page is bounded by limit, so fetch it first to know the next cursor
+        pages = []
+        for pool in pools:
+            with pool.connection() as db:
+                pages.append(db.execute(query + ' LIMIT ?', params + [limit]).fetchall())
+        rows = list(itertools.islice(merge(pages), limit))
+        next_cursor = key(rows[-1]) if len(rows) == limit else None
+    else:
+        rows = None
+        next_cursor = None
+    def batches(db):
+        with contextlib.ExitStack() as stack:
+            if rows is not None:
+                cursor = iter(rows)
+            else:
+                # Read rows lazily when not paging, holding a connection of each pool
+                cursor = merge([(db if pool is db_pool else stack.enter_context(pool.connection())).execute(query, params) for pool in pools])
+            while True:
+                batch = [convert(row) for row in itertools.islice(cursor, 500)]
+                if not batch:
+                    break
+                yield batch
+    return stream_batches(name, batches, next_cursor, ndjson)
+
+# Stream reservations from a (time, reservation_id) page of the deadline tracker
+def stream_tracked(name, entries, limit, ndjson):
+    next_cursor = '{}:{}'.format(*entries[-1]) if limit is not None and len(entries) == limit else None
+    def batches(db):
+        for index in range(0, len(entries), 500):
+            chunk = [entry[1] for entry in entries[index:index + 500]]
+            rows = fetch_reservations(chunk)
+            # Keep the tracker's order, skipping reservations removed since the page was taken
+            yield [list(rows[reservation_id][:6]) for reservation_id in chunk if reservation_id in rows]
+    return stream_batches(name, batches, next_cursor, ndjson)
 
 # Get overdue reservations (Only admin can get overdue reservations)
+# Supports 'limit', 'cursor', and 'format' (json or ndjson)
 @app.route('/admin/overdue', methods=['POST'])
-def get_overdue_reservations():
-    # Get username and password from request
-    username = request.form['username']
-    password = request.form['password']
-    # Authenticate user
-    if not authenticate_admin(username, password):
+@conditional('reservations', 'users', 'items', authenticate=authenticate_admin_request, extra=lambda: deadline_tracker.stats())
+@parse_fields(paging_schema)
+def get_overdue_reservations(fields):
+    # Authenticate admin
+    if authenticate_admin_request() is None:
         return jsonify({'error': 'Authentication failed'})
-    # Get overdue reservations
-    db = connect_db()
-    db_cur = db.cursor()
-    reservations = db_cur.execute('SELECT * FROM reservations WHERE status = ?', ('lended',)).fetchall()
-    db.close()
-    # Check current time
-    current_time = datetime.now()
-    # Check if reservation is overdue
-    overdue_reservations = []
-    for reservation in reservations:
-        if reservation[3] < current_time:
-            overdue_reservations.append(reservation)
+    limit, cursor, ndjson = listing_fields(fields)
+    try:
+        # Get lent reservations past their end time, oldest first
+        entries = deadline_tracker.get_overdue(parse_time_cursor(cursor) if cursor is not None else None, limit)
+    except ValueError:
+        return jsonify({'error': 'Invalid paging fields'})
     # Return overdue reservations
-    return jsonify({'overdue_reservations': overdue_reservations})
+    return stream_tracked('overdue_reservations', entries, limit, ndjson)
 
 # Get pending reservations beyond start time (Only admin can get pending reservations)
+# Supports 'limit', 'cursor', and 'format' (json or ndjson)
 @app.route('/admin/pending', methods=['POST'])
-def get_pending_reservations():
-    # Get username and password from request
-    username = request.form['username']
-    password = request.form['password']
-    # Authenticate user
-    if not authenticate_admin(username, password):
+@conditional('reservations', 'users', 'items', authenticate=authenticate_admin_request, extra=lambda: deadline_tracker.stats())
+@parse_fields(paging_schema)
+def get_pending_reservations(fields):
+    # Authenticate admin
+    if authenticate_admin_request() is None:
         return jsonify({'error': 'Authentication failed'})
-    # Get pending reservations
-    db = connect_db()
-    db_cur = db.cursor()
-    reservations = db_cur.execute('SELECT * FROM reservations WHERE status = ?', ('pending',)).fetchall()
-    db.close()
-    # Check current time
-    current_time = datetime.now()
-    # Check if reservation is pending
-    pending_reservations = []
-    for reservation in reservations:
-        if reservation[3] > current_time:
-            pending_reservations.append(reservation)
+    limit, cursor, ndjson = listing_fields(fields)
+    try:
+        # Get pending reservations past their start time, oldest first
+        entries = deadline_tracker.get_late(parse_time_cursor(cursor) if cursor is not None else None, limit)
+    except ValueError:
+        return jsonify({'error': 'Invalid paging fields'})
     # Return pending reservations
-    return jsonify({'pending_reservations': pending_reservations})
+    return stream_tracked('pending_reservations', entries, limit, ndjson)
 
 # List all users (Only admin can list users)
+# Supports 'limit', 'cursor', and 'format' (json or ndjson)
 @app.route('/admin/users', methods=['POST'])
-def list_users():
-    # Get username and password from request
-    username = request.form['username']
-    password = request.form['password']
-    # Authenticate user
-    if not authenticate_admin(username, password):
+@conditional('users', authenticate=authenticate_admin_request)
+@parse_fields(paging_schema)
+def list_users(fields):
+    # Authenticate admin
+    if authenticate_admin_request() is None:
         return jsonify({'error': 'Authentication failed'})
-    # Get all users
-    db = connect_db()
-    db_cur = db.cursor()
-    users = db_cur.execute('SELECT * FROM users').fetchall()
-    db.close()
-    # Convert users to list of dictionaries
-    users_list = []
-    for user in users:
-        users_list.append({'username': user[1], 'permissions': user[5]})
-    db.close()
+    limit, cursor, ndjson = listing_fields(fields)
+    try:
+        # Get users in id order
+        query = 'SELECT id, username, permissions FROM users'
+        params = []
+        if cursor is not None:
+            query += ' WHERE id > ?'
+            params.append(int(cursor))
+        query += ' ORDER BY id'
+    except ValueError:
+        return jsonify({'error': 'Invalid paging fields'})
     # Return all users and their details
-    return jsonify({'users': users_list})
+    return stream_listing('users', query, params, lambda row: str(row[0]), lambda row: {'username': row[1], 'permissions': row[2]}, limit, ndjson)
 
 # Handle register request (Only for admin)
 @app.route('/admin/register', methods=['POST'])
-def register():
+@parse_fields(schemas.Schema(schemas.Text('new_username'), schemas.Text('new_password'), schemas.Text('new_email', required=False, default=''),
+    schemas.Text('new_permissions', choices=('user', 'admin'))))
+def register(fields):
     # Authenticate admin
-    if not authenticate_admin(request.form['username'], request.form['password']):
+    if authenticate_admin_request() is None:
         return jsonify({'error': 'Authentication failed'})
-    # Get new username, password, email, and permissions from request
-    new_username = request.form['new_username']
-    new_password = request.form['new_password']
-    new_email = request.form['new_email']
-    new_permissions = request.form['new_permissions']
+    new_username, new_password, new_email, new_permissions = fields
+    # Check if user already exists before paying for the hash
+    if user_exists(new_username):
+        return jsonify({'error': 'User already exists'})
     # Generate salt in bytes
     new_salt = os.urandom(16)
     # Generate hash from password and salt
     new_hash = get_hash(new_password, new_salt)
-    # Check if user already exists
-    if user_exists(new_username):
-        return jsonify({'error': 'User already exists'})
-    # Insert new user into database
+    # Insert new user into database, unless it was registered while hashing
     db = connect_db()
     db_cur = db.cursor()
-    db_cur.execute('INSERT INTO users (username, hash, salt, email, permissions) VALUES (?, ?, ?, ?, ?)', (new_username, new_hash, new_salt, new_email, new_permissions))
+    db_cur.execute('INSERT OR IGNORE INTO users (username, hash, salt, email, permissions) VALUES (?, ?, ?, ?, ?)', (new_username, new_hash, new_salt, new_email, new_permissions))
     db.commit()
-    db.close()
+    if db_cur.rowcount == 0:
+        return jsonify({'error': 'User already exists'})
+    table_versions.bump('users')
     # Return new user info
     return jsonify({'username': new_username, 'permissions': new_permissions})
 
 # Add new item (Only admin can add new item)
+# Number of identical units is one if not given
 @app.route('/admin/add_item', methods=['POST'])
-def add_item():
+@parse_fields(schemas.Schema(schemas.Text('new_item_name'), schemas.Text('new_item_description', required=False, default=''),
+    schemas.Integer('new_item_quantity', required=False, default=1, minimum=1)))
+def add_item(fields):
     # Authenticate admin
-    if not authenticate_admin(request.form['username'], request.form['password']):
+    if authenticate_admin_request() is None:
         return jsonify({'error': 'Authentication failed'})
-    # Get new item name and description from request
-    new_item_name = request.form['new_item_name']
-    new_item_description = request.form['new_item_description']
+    new_item_name, new_item_description, new_item_quantity = fields
     # Check if item name already used
     if item_exists(new_item_name):
         return jsonify({'error': 'item already exists'})
     # Insert new item into database with status 'available'
     db = connect_db()
     db_cur = db.cursor()
-    db_cur.execute('INSERT INTO items (name, description, status) VALUES (?, ?, ?)', (new_item_name, new_item_description, 'available'))
+    db_cur.execute('INSERT INTO items (name, description, status, quantity) VALUES (?, ?, ?, ?)', (new_item_name, new_item_description, 'available', new_item_quantity))
     db.commit()
-    db.close()
+    table_versions.bump('items')
+    # New item is free in every cached window
+    availability_cache.clear()
+    change_feed.publish('item.added', {'name': new_item_name, 'description': new_item_description, 'status': 'available', 'quantity': new_item_quantity})
     # Return new item info
-    return jsonify({'item_name': new_item_name, 'item_description': new_item_description, 'item_status': 'available'})
+    return jsonify({'item_name': new_item_name, 'item_description': new_item_description, 'item_status': 'available', 'item_quantity': new_item_quantity})
 
 # Remove item (Only admin can remove item)
 @app.route('/admin/remove_item', methods=['POST'])
-def remove_item():
+@parse_fields(schemas.Schema(schemas.Text('item_name')))
+def remove_item(fields):
     # Authenticate admin
-    if not authenticate_admin(request.form['username'], request.form['password']):
+    if authenticate_admin_request() is None:
         return jsonify({'error': 'Authentication failed'})
-    # Get item name from request
-    item_name = request.form['item_name']
+    item_name = fields.item_name
     # Check if item exists
-    if not item_exists(item_name):
+    item_id = get_item_id(item_name)
+    if item_id is None:
         return jsonify({'error': 'item does not exist'})
-    # Remove item from database
-    db = connect_db()
-    db_cur = db.cursor()
-    db_cur.execute('DELETE FROM items WHERE name = ?', (item_name,))
-    db.commit()
-    db.close()
+    # Remove the item on the main writer thread first, so new reservations of it fail,
+    # then its reservations on its shard's writer thread, which rejects any of them still on the way
+    def removed(result):
+        removed_items.add(item_id)
+        table_versions.bump('items')
+    write_queue.execute(
+        lambda db_cur: db_cur.execute('DELETE FROM items WHERE id = ?', (item_id,)),
+        removed)
+    shard_set.writer(item_id).execute(lambda db_cur: delete_item_reservations(db_cur, item_id),
+        lambda result: reservation_index.remove_item(item_id))
+    # Drop cached windows that listed the item
+    availability_cache.invalidate_item(item_name)
+    change_feed.publish('item.removed', {'name': item_name})
     # Return item info
     return jsonify({'item_name': item_name})
 
+# Get reservation history of all users, including archived reservations (Only admin can get history)
+# Supports 'username', 'item', 'limit', 'cursor', and 'format' (json or ndjson)
+@app.route('/admin/history', methods=['POST'])
+@conditional('reservations', 'users', 'items', authenticate=authenticate_admin_request)
+@parse_fields(schemas.Schema(schemas.Text('username', required=False), schemas.Text('item', required=False), *paging_fields))
+def get_all_history(fields):
+    # Authenticate admin
+    if authenticate_admin_request() is None:
+        return jsonify({'error': 'Authentication failed'})
+    # Get optional user and item filters
+    user_id = None
+    if fields.username:
+        user_id = get_user_id(fields.username)
+        if user_id is None:
+            return jsonify({'error': 'User not found'})
+    item_id = None
+    if fields.item:
+        item_id = get_item_id(fields.item)
+        if item_id is None:
+            return jsonify({'error': 'Item not found'})
+    try:
+        return stream_history(fields, user_id, item_id)
+    except ValueError:
+        return jsonify({'error': 'Invalid paging fields'})
+
+# Get utilization of items between given times, including archived reservations (Only admin can get utilization)
+# Takes start_time, end_time, optional bucket (seconds, default one day) and items (list or comma separated names)
+# Returns occupancy per item and bucket, utilization and no-show rate per item, and a weekday by hour heatmap
+@app.route('/admin/utilization', methods=['POST'])
+@parse_fields(schemas.Schema(schemas.Time('start_time'), schemas.Time('end_time'), schemas.Integer('bucket', required=False, default=86400, minimum=1),
+    schemas.Names('items')))
+def get_utilization(fields):
+    # Authenticate admin
+    if authenticate_admin_request() is None:
+        return jsonify({'error': 'Authentication failed'})
+    # Analytics need NumPy
+    if analytics.numpy is None:
+        return jsonify({'error': 'NumPy is not installed'})
+    start_time, end_time, bucket = fields.start_time, fields.end_time, fields.bucket
+    if start_time > end_time:
+        return jsonify({'error': 'Start time is after end time'})
+    # Get requested items, or all items
+    items = db_cursor().execute('SELECT id, name, quantity FROM items').fetchall()
+    if fields.items:
+        names = set(fields.items)
+        items = [item for item in items if item[1] in names]
+    # Limit the size of the result
+    if len(items) * ((end_time - start_time) // bucket + 1) > analytics.max_cells or (end_time - start_time) // 3600 > analytics.max_hours:
+        return jsonify({'error': 'Too many buckets'})
+    # Load overlapping reservations of every shard as (item_id, start_time, end_time, shown) rows
+    query = '''SELECT item_id, start_time, end_time, status IN ('lent', 'returned') FROM reservations WHERE start_time <= ? AND end_time >= ?
+        UNION ALL SELECT item_id, start_time, end_time, status IN ('lent', 'returned') FROM reservations_archive WHERE start_time <= ? AND end_time >= ?'''
+    # Occurrences of recurring reservations are added as rows too, they have no status so shown is -1.
+    # The item id takes the place of the rule id, so each occurrence carries its item.
+    rule_query = 'SELECT start_time, end_time, period, until, item_id FROM recurring_reservations WHERE start_time <= ? AND until + (end_time - start_time) >= ?'
+    arrays = []
+    for pool in shard_set.pools:
+        db = pool.acquire()
+        try:
+            rows = db.execute(query, (end_time, start_time, end_time, start_time)).fetchall()
+            rules = db.execute(rule_query, (end_time, start_time)).fetchall()
+        finally:
+            pool.release(db)
+        for rule in rules:
+            rows += [(occurrence[2], occurrence[0], occurrence[1], -1) for occurrence in intervals.occurrences(rule, start_time, end_time)]
+        arrays.append(analytics.numpy.array(rows, dtype=analytics.numpy.int64).reshape(-1, 4))
+    result = analytics.utilization(items, analytics.numpy.concatenate(arrays), start_time, end_time, bucket)
+    result['status'] = 'success'
+    return jsonify(result)
+
+# Archive finished reservations now instead of waiting for the archiver (Only admin can archive)
+@app.route('/admin/archive', methods=['POST'])
+def archive_reservations():
+    # Authenticate admin
+    if authenticate_admin_request() is None:
+        return jsonify({'error': 'Authentication failed'})
+    # Return number of reservations archived
+    return jsonify({'archived': sum(archiver.archive() for archiver in archivers)})
+
+# Get availability cache counters (Only admin can get cache counters)
+@app.route('/admin/cache', methods=['POST'])
+def get_cache_stats():
+    # Authenticate admin
+    if authenticate_admin_request() is None:
+        return jsonify({'error': 'Authentication failed'})
+    # Return cache counters
+    return jsonify(availability_cache.stats())
+
+## Bulk import and export ##
+
+# Get the names out of a list that are already used in a table column
+def taken_names(db_cur, table, column, names):
+    taken = set()
+    for index in range(0, len(names), 500):
+        chunk = names[index:index + 500]
+        taken.update(row[0] for row in db_cur.execute('SELECT {1} FROM {0} WHERE {1} IN ({2})'.format(table, column, ', '.join('?' * len(chunk))), chunk))
+    return taken
+
+# Insert a chunk of (line, (name, description, quantity)) items on the main writer thread
+# Returns (number imported, [(line, error)])
+def import_items(rows):
+    def apply(db_cur):
+        taken = taken_names(db_cur, 'items', 'name', [values[0] for line, values in rows])
+        inserted = []
+        errors = []
+        for line, values in rows:
+            if values[0] in taken:
+                errors.append((line, 'item already exists'))
+                continue
+            taken.add(values[0])
+            inserted.append(values)
+        db_cur.executemany('INSERT INTO items (name, description, status, quantity) VALUES (?, ?, ?, ?)',
+            [(name, description, 'available', quantity) for name, description, quantity in inserted])
+        return inserted, errors
+    inserted, errors = write_queue.execute(apply)
+    # New items are free in every cached window
+    if inserted:
+        table_versions.bump('items')
+        availability_cache.clear()
+    for name, description, quantity in inserted:
+        change_feed.publish('item.added', {'name': name, 'description': description, 'status': 'available', 'quantity': quantity})
+    return len(inserted), errors
+
+# Insert a chunk of (line, (username, email, permissions, password, hash, salt)) users on the main writer thread
+# Returns (number imported, [(line, error)])
+def import_users(rows):
+    # Skip users that exist before paying for their password hashes
+    taken = taken_names(db_cursor(), 'users', 'username', [values[0] for line, values in rows])
+    errors = [(line, 'User already exists') for line, values in rows if values[0] in taken]
+    rows = [(line, values) for line, values in rows if values[0] not in taken]
+    # Hash all passwords of the chunk at once, on the hashing processes when serve.py started them
+    hashed = [(line, values) for line, values in rows if values[3] is not None]
+    salts = [os.urandom(16) for line, values in hashed]
+    started = time.perf_counter()
+    hashes = hashing.hash_passwords([values[3] for line, values in hashed], salts)
+    if 'request_hash_seconds' in g:
+        g.request_hash_seconds += time.perf_counter() - started
+    credentials = {line: (hash, salt) for (line, values), hash, salt in zip(hashed, hashes, salts)}
+    def apply(db_cur):
+        taken = taken_names(db_cur, 'users', 'username', [values[0] for line, values in rows])
+        inserted = []
+        rejected = []
+        for line, (username, email, permissions, password, hash, salt) in rows:
+            if username in taken:
+                rejected.append((line, 'User already exists'))
+                continue
+            taken.add(username)
+            hash, salt = credentials.get(line, (hash, salt))
+            inserted.append((username, hash, salt, email, permissions))
+        db_cur.executemany('INSERT INTO users (username, hash, salt, email, permissions) VALUES (?, ?, ?, ?, ?)', inserted)
+        return len(inserted), rejected
+    imported, rejected = write_queue.execute(apply, lambda result: table_versions.bump('users'))
+    return imported, errors + rejected
+
+# Look up the users and items of a chunk of (line, (username, item, ...)) rows at once and group the rows by shard
+# Returns ({shard: [(line, user_id, item_id, quantity, item, ...)]}, [(line, error)])
+def group_by_shard(rows):
+    db_cur = db_cursor()
+    usernames = list({values[0] for line, values in rows})
+    names = list({values[1] for line, values in rows})
+    user_ids = {}
+    items = {}
+    for index in range(0, len(usernames), 500):
+        chunk = usernames[index:index + 500]
+        user_ids.update(db_cur.execute('SELECT username, id FROM users WHERE username IN ({})'.format(', '.join('?' * len(chunk))), chunk).fetchall())
+    for index in range(0, len(names), 500):
+        chunk = names[index:index + 500]
+        items.update((row[0], (row[1], row[2])) for row in db_cur.execute('SELECT name, id, quantity FROM items WHERE name IN ({})'.format(', '.join('?' * len(chunk))), chunk))
+    errors = []
+    groups = {}
+    for line, values in rows:
+        if values[0] not in user_ids:
+            errors.append((line, 'User not found'))
+        elif values[1] not in items:
+            errors.append((line, 'Item not found'))
+        else:
+            item, quantity = items[values[1]]
+            groups.setdefault(shard_set.shard_of(item), []).append((line, user_ids[values[0]], item, quantity) + values[1:])
+    return groups, errors
+
+# Insert a chunk of (line, (username, item, start_time, end_time, status)) reservations on their shards' writer threads
+# Reservations are checked for conflicts like /reserve/batch, but may lie in the past
+# Returns (number imported, [(line, error)])
+def import_reservations(rows):
+    groups, errors = group_by_shard(rows)
+    # Insert the reservations of each shard in one operation on the shard's writer thread
+    def insert_entries(group):
+        def apply(db_cur):
+            # Entries accepted so far, to catch conflicts within the chunk
+            accepted = {}
+            inserted = []
+            rejected = []
+            for entry in group:
+                line, user_id, item, quantity, item_name, start_time, end_time, status = entry
+                if item in removed_items:
+                    rejected.append((line, 'Item not found'))
+                    continue
+                overlapping = select_overlapping(db_cur, item, start_time, end_time)
+                if item in accepted:
+                    overlapping += accepted[item].overlapping(start_time, end_time)
+                if intervals.peak(overlapping) >= quantity:
+                    rejected.append((line, 'Item is reserved'))
+                    continue
+                if item not in accepted:
+                    accepted[item] = intervals.ItemIntervals()
+                accepted[item].add(line, start_time, end_time)
+                inserted.append(entry)
+            if not inserted:
+                return [], rejected
+            # Ids of a shard step by the number of shards
+            first_id = shard_set.next_id(db_cur, inserted[0][2])
+            created = [(first_id + index * shard_set.count,) + entry for index, entry in enumerate(inserted)]
+            db_cur.executemany('INSERT INTO reservations (id, user_id, item_id, start_time, end_time, status) VALUES (?, ?, ?, ?, ?, ?)',
+                [(reservation_id, user_id, item, start_time, end_time, status) for reservation_id, line, user_id, item, quantity, item_name, start_time, end_time, status in created])
+            return created, rejected
+        return apply
+    # Add reservations to index and feed once committed
+    def index_entries(result):
+        for reservation_id, line, user_id, item, quantity, item_name, start_time, end_time, status in result[0]:
+            reservation_index.add(reservation_id, item, start_time, end_time, status)
+            publish_reservation('reservation.created', reservation_id, item_name, start_time, end_time)
+    imported = 0
+    for shard, group in groups.items():
+        created, rejected = shard_set.writers[shard].execute(insert_entries(group), index_entries)
+        imported += len(created)
+        errors += rejected
+    return imported, errors
+
+# Insert a chunk of (line, (username, item, start_time, end_time, period, until)) recurring reservations on their shards' writer threads
+# Every occurrence is checked for conflicts like /reserve/recurring, but rules may start in the past
+# Returns (number imported, [(line, error)])
+def import_recurring(rows):
+    groups, errors = group_by_shard(rows)
+    # Insert the rules of each shard in one operation, each rule sees the ones inserted before it
+    def insert_entries(group):
+        def apply(db_cur):
+            inserted = []
+            rejected = []
+            for entry in group:
+                line, user_id, item, quantity, item_name, start_time, end_time, period, until = entry
+                if (until - start_time) // period + 1 > recurring_max_occurrences:
+                    rejected.append((line, 'Too many occurrences'))
+                    continue
+                try:
+                    inserted.append((insert_rule(db_cur, user_id, item, start_time, end_time, period, until, quantity),) + entry)
+                except writer.Rejected as e:
+                    rejected.append((line, str(e)))
+            return inserted, rejected
+        return apply
+    # Add rules to index and feed once committed
+    def index_entries(result):
+        for rule_id, line, user_id, item, quantity, item_name, start_time, end_time, period, until in result[0]:
+            reservation_index.add_rule(rule_id, item, start_time, end_time, period, until)
+            publish_rule('recurring.created', rule_id, item_name, start_time, end_time, period, until)
+        if result[0]:
+            table_versions.bump('reservations')
+    imported = 0
+    for shard, group in groups.items():
+        created, rejected = shard_set.writers[shard].execute(insert_entries(group), index_entries)
+        imported += len(created)
+        errors += rejected
+    return imported, errors
+
+# Import function of each kind of row
+importers = {'items': import_items, 'users': import_users, 'reservations': import_reservations, 'recurring': import_recurring}
+
+# Import items, users, reservations or recurring reservations from CSV or NDJSON (Only admin can import)
+# Takes the rows as the request body, with the token as a bearer token, or as a 'file' upload
+# The format comes from 'format' (csv or ndjson), the content type or the file name, CSV if none is given
+# Rows are validated and inserted in batches, each batch in its own transaction, so valid rows are kept when others fail
+# Returns the number of rows imported and rejected, and the errors of rejected rows by line
+@app.route('/admin/import/<kind>', methods=['POST'])
+def bulk_import(kind):
+    # Authenticate admin
+    if authenticate_admin_request() is None:
+        return jsonify({'error': 'Authentication failed'})
+    if kind not in importers:
+        return jsonify({'error': 'Unknown kind'})
+    # Read rows from an uploaded file or the request body
+    upload = request.files.get('file')
+    if upload is not None:
+        stream = upload.stream
+        format = request.args.get('format') or request.form.get('format') or upload.filename
+    else:
+        stream = request.stream
+        format = request.args.get('format') or request.mimetype
+    format = bulk.detect_format(format) if format else 'csv'
+    if format is None:
+        return jsonify({'error': 'Unknown format'})
+    lines = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    validate = bulk.validators[kind]
+    imported = 0
+    errors = []
+    rejected = 0
+    result = {'status': 'success'}
+    try:
+        for chunk in bulk.chunked(bulk.read_rows(lines, format), bulk_batch_size):
+            # Validate the chunk, then insert the valid rows in one transaction
+            valid = []
+            chunk_errors = []
+            for line, row, error in chunk:
+                if error is None:
+                    try:
+                        valid.append((line, validate(row)))
+                    except ValueError as e:
+                        error = str(e)
+                if error is not None:
+                    chunk_errors.append((line, error))
+            if valid:
+                count, insert_errors = importers[kind](valid)
+                imported += count
+                chunk_errors += insert_errors
+            rejected += len(chunk_errors)
+            errors += sorted(chunk_errors)[:max(0, bulk_max_errors - len(errors))]
+    except (UnicodeDecodeError, csv.Error):
+        # Rows before the unreadable part stay imported
+        result = {'status': 'error', 'error': 'Unreadable input'}
+    result.update({'kind': kind, 'imported': imported, 'rejected': rejected,
+        'errors': [{'line': line, 'error': error} for line, error in errors]})
+    return jsonify(result)
+
+# Export items, users, reservations or recurring reservations as CSV or NDJSON (Only admin can export)
+# Supports 'format' (csv or ndjson), and 'credentials' to include password hashes and salts of users,
+# which lets an export be imported on another server with the same passwords
+# Reservations include archived ones, times of reservations and recurring reservations are readable
+@app.route('/admin/export/<kind>', methods=['POST'])
+@parse_fields(schemas.Schema(schemas.Text('format', required=False, default='csv'), schemas.Boolean('credentials')))
+def bulk_export(fields, kind):
+    # Authenticate admin
+    if authenticate_admin_request() is None:
+        return jsonify({'error': 'Authentication failed'})
+    format = bulk.detect_format(fields.format)
+    if format is None:
+        return jsonify({'error': 'Unknown format'})
+    pools = [db_pool]
+    if kind == 'items':
+        columns = bulk.columns['items']
+        query = 'SELECT name, description, status, quantity FROM items ORDER BY id'
+        convert = tuple
+    elif kind == 'users':
+        columns = bulk.columns['users']
+        query = 'SELECT username, email, permissions FROM users ORDER BY id'
+        convert = tuple
+        if fields.credentials:
+            columns += bulk.credential_columns
+            query = 'SELECT username, email, permissions, hash, salt FROM users ORDER BY id'
+            convert = lambda row: row[:4] + (row[4].hex() if isinstance(row[4], bytes) else row[4],)
+    elif kind == 'reservations':
+        columns = bulk.columns['reservations']
+        query = history_select + ' ORDER BY history.id'
+        convert = lambda row: (row[0], row[1], row[4], bulk.readable_time(row[2]), bulk.readable_time(row[3]), row[5])
+        pools = shard_set.pools
+    elif kind == 'recurring':
+        columns = bulk.columns['recurring']
+        query = recurring_select + ' ORDER BY recurring_reservations.id'
+        convert = lambda row: (row[0], row[1], row[2], bulk.readable_time(row[3]), bulk.readable_time(row[4]), row[5], bulk.readable_time(row[6]))
+        pools = shard_set.pools
+    else:
+        return jsonify({'error': 'Unknown kind'})
+    # Read rows lazily, holding a connection of each pool while the response is sent
+    def generate():
+        with contextlib.ExitStack() as stack:
+            cursors = [stack.enter_context(pool.connection()).execute(query) for pool in pools]
+            rows = cursors[0] if len(cursors) == 1 else heapq.merge(*cursors, key=lambda row: row[0])
+            yield from bulk.write_rows(columns, map(convert, rows), format)
+    return Response(generate(), mimetype=bulk.content_types[format],
+        headers={'Content-Disposition': 'attachment; filename={}.{}'.format(kind, format)})
+
 ### END ADMIN FUNCTIONS ###
 
 
@@ -530,17 +1847,18 @@ def remove_item():
 if os.path.exists(database_path):
     os.remove(database_path)
 '''
-# Create new database if it doesn't exist
-if not os.path.exists(database_path):
-    initialize_db()
-    ## Add admin details to database
-    # Create database connection
-    db = connect_db()
-    db_cur = db.cursor()
-    # Get admin username and password from config file
-    with open(config_path, 'r') as config_file:
-        config = json.load(config_file)
-        # Get admin details (username, password, email)
+# Set up the database within an app context so it can borrow a pooled connection
+with app.app_context():
+    # Create new database if it doesn't exist
+    new_database = not os.path.exists(database_path)
+    # Create or upgrade the schema
+    migrate_db()
+    if new_database:
+        ## Add admin details to database
+        # Get database connection
+        db = connect_db()
+        db_cur = db.cursor()
+        # Get admin details (username, password, email) from config file
         admin_username = config['admin']['username']
         admin_password = config['admin']['password']
         admin_email = config['admin']['email']
@@ -549,10 +1867,20 @@ if not os.path.exists(database_path):
         hash = get_hash(admin_password, salt)
         # Insert admin into user table using cursor
         db_cur.execute('INSERT INTO users (username, hash, salt, email, permissions) VALUES (?, ?, ?, ?, ?)', (admin_username, hash, salt, admin_email, 'admin'))
-    # Commit changes to database
-    db.commit()
-    db.close()
+        # Commit changes to database
+        db.commit()
+    # Move reservations to their shards if the number of shards changed
+    shard_set.rebalance()
+    # Load reservations into the index
+    load_index()
+# Start applying queued writes of every shard
+shard_set.start()
+# Start archiving finished reservations
+for archiver in archivers:
+    archiver.start()
+# Start expiring late reservations, if enabled
+deadline_tracker.start()
 
-# Run flask server
+# Run flask server in development mode (use serve.py in production)
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=6969, debug=True)
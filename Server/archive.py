@@ -0,0 +1,95 @@
+# This is meant to be imported and used as a module.
+# It is not meant to be run directly.
+
+### Imports for archive ###
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+### Archiver ###
+# Moves finished reservations from the reservations table to reservations_archive on a schedule,
+# so conflict checks and admin listings only scan current and future bookings.
+# Returned reservations and no-shows (still pending) are archived once they ended more than
+# retention seconds ago. Lent reservations stay until they are returned, so overdue items remain listed.
+class Archiver:
+    def __init__(self, write_queue, retention=86400, interval=3600, batch_size=1000, on_archive=None):
+        # Writer the moves are applied through
+        self.write_queue = write_queue
+        # Seconds a finished reservation stays in the reservations table after its end time
+        self.retention = retention
+        # Seconds between runs, 0 to only archive when asked
+        self.interval = interval
+        # Most reservations moved in one write operation
+        self.batch_size = batch_size
+        # Function called with the ids of archived reservations once they are committed
+        self.on_archive = on_archive
+        # Number of reservations archived so far
+        self.archived = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    # Move reservations to the archive, keeping their status unless a new one is given
+    def move(self, db_cur, ids, now, status=None):
+        if not ids:
+            return ids
+        placeholders = ', '.join('?' * len(ids))
+        db_cur.execute('''INSERT INTO reservations_archive (id, user_id, item_id, start_time, end_time, status, archived_at)
+            SELECT id, user_id, item_id, start_time, end_time, coalesce(?, status), ? FROM reservations WHERE id IN ({})'''.format(placeholders), [status, now] + ids)
+        db_cur.execute('DELETE FROM reservations WHERE id IN ({})'.format(placeholders), ids)
+        return ids
+
+    # Move one batch of reservations that ended before cutoff, returns their ids
+    def archive_batch(self, cutoff, now):
+        def apply(db_cur):
+            rows = db_cur.execute("SELECT id FROM reservations WHERE status IN ('returned', 'pending') AND end_time < ? ORDER BY end_time LIMIT ?",
+                (cutoff, self.batch_size)).fetchall()
+            return self.move(db_cur, [row[0] for row in rows], now)
+        return self.write_queue.execute(apply, self.committed)
+
+    # Archive reservations that are still pending as 'expired', freeing their items
+    # Returns the ids that were expired
+    def expire(self, ids):
+        now = int(time.time())
+        def apply(db_cur):
+            rows = db_cur.execute("SELECT id FROM reservations WHERE status = 'pending' AND id IN ({})".format(', '.join('?' * len(ids))), ids).fetchall()
+            return self.move(db_cur, [row[0] for row in rows], now, 'expired')
+        return self.write_queue.execute(apply, self.committed)
+
+    # Count archived reservations and pass them on
+    def committed(self, ids):
+        self.archived += len(ids)
+        if ids and self.on_archive is not None:
+            self.on_archive(ids)
+
+    # Archive everything that is due, one batch per write operation so other writes can interleave
+    # Returns the number of reservations archived
+    def archive(self):
+        now = int(time.time())
+        cutoff = now - self.retention
+        total = 0
+        while True:
+            ids = self.archive_batch(cutoff, now)
+            total += len(ids)
+            if len(ids) < self.batch_size:
+                return total
+
+    # Start archiving in the background every interval seconds
+    def start(self):
+        if self.interval > 0 and self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='archiver', daemon=True)
+            self.thread.start()
+
+    # Stop the background thread after its current run
+    def stop(self):
+        self.stopped.set()
+
+    # Archiver thread loop
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.archive()
+            except Exception:
+                logger.exception('Archiving reservations failed')
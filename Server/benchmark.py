@@ -0,0 +1,220 @@
+# Load test and benchmark for the reservation API
+# Builds a synthetic database in a temporary directory, then drives the endpoints
+# through Flask's test client at the given concurrency levels.
+# Results are written as JSON and can be compared with a previous run.
+# Run with: python benchmark.py [--users N] [--items N] [--reservations N] [--shards N] [--concurrency 1,8,32]
+#                               [--requests N] [--endpoints items,reserve] [--output FILE] [--compare FILE]
+import argparse
+import concurrent.futures
+import datetime
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+# Password of every synthetic user
+user_password = 'password'
+# Format of readable times
+time_format = '%Y-%m-%d %H:%M:%S'
+
+
+### Synthetic data ###
+
+# Create a working directory with a config file and import the app inside it
+def load_app(directory, shards):
+    os.makedirs(os.path.join(directory, 'Data'))
+    with open(os.path.join(directory, 'Data', 'configs.json'), 'w') as config_file:
+        json.dump({'admin': {'username': 'admin', 'password': 'admin', 'email': 'admin@example.com'},
+            'database': {'shards': shards},
+            # Measure the server rather than the rate limiters, logins queue for a hashing slot instead of being shed
+            'admission': {'ip_rate': 0, 'user_rate': 0, 'hash_wait': 60}}, config_file)
+    # The app uses paths relative to the working directory
+    os.chdir(directory)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app
+    return app
+
+# Fill the database with users, items and reservations
+def populate(app, users, items, reservations, seed):
+    rng = random.Random(seed)
+    now = int(time.time())
+    db = sqlite3.connect(app.database_path)
+    # Every user shares one salt and hash so populating stays fast
+    salt = os.urandom(16)
+    hash = app.get_hash(user_password, salt)
+    db.executemany('INSERT INTO users (username, hash, salt, email, permissions) VALUES (?, ?, ?, ?, ?)',
+        (('user{}'.format(index), hash, salt, 'user{}@example.com'.format(index), 'user') for index in range(users)))
+    db.executemany('INSERT INTO items (name, description, status) VALUES (?, ?, ?)',
+        (('item{}'.format(index), 'Synthetic item', 'available') for index in range(items)))
+    # Reservations reference users and items by id
+    user_ids = [row[0] for row in db.execute("SELECT id FROM users WHERE username LIKE 'user%' ORDER BY id")]
+    item_ids = [row[0] for row in db.execute('SELECT id FROM items ORDER BY id')]
+    # Reservations spread over the past and next 90 days with mixed statuses
+    rows = []
+    for index in range(reservations):
+        start_time = now + rng.randint(-90, 90) * 86400 + rng.randint(0, 23) * 3600
+        end_time = start_time + rng.randint(1, 4) * 3600
+        status = 'pending' if start_time > now else rng.choice(['pending', 'lent', 'returned'])
+        rows.append((rng.choice(user_ids), start_time, end_time, rng.choice(item_ids), status))
+    db.executemany('INSERT INTO reservations (user_id, start_time, end_time, item_id, status) VALUES (?, ?, ?, ?, ?)', rows)
+    db.commit()
+    db.close()
+    # Move the new reservations to their shards and load them into the app's index
+    app.shard_set.rebalance()
+    app.load_index()
+
+
+### Scenarios ###
+
+# Get a readable time some hours from now
+def readable(hours):
+    return (datetime.datetime.now() + datetime.timedelta(hours=hours)).replace(minute=0, second=0, microsecond=0).strftime(time_format)
+
+# Build the request for each endpoint
+# Each scenario takes (rng, state) and returns (path, form)
+def build_scenarios(app, users, items):
+    client = app.app.test_client()
+    # Tokens are issued once so only /login pays for password hashing
+    admin_token = client.post('/token', data={'username': 'admin', 'password': 'admin'}).get_json()['token']
+    user_tokens = [client.post('/token', data={'username': 'user{}'.format(index), 'password': user_password}).get_json()['token'] for index in range(min(users, 50))]
+
+    def login(rng, state):
+        return '/login', {'username': 'user{}'.format(rng.randrange(users)), 'password': user_password}
+
+    def get_items(rng, state):
+        start = rng.randint(24, 24 * 60)
+        return '/items', {'start_time': readable(start), 'end_time': readable(start + rng.randint(1, 8))}
+
+    def reserve(rng, state):
+        # Far in the future so most requests succeed
+        start = rng.randint(24 * 365, 24 * 730)
+        return '/reserve', {'token': rng.choice(user_tokens), 'item': 'item{}'.format(rng.randrange(items)),
+            'start_time': readable(start), 'end_time': readable(start + 1)}
+
+    def cancel(rng, state):
+        # Cancel reservations created by the reserve scenario
+        reservation_id, token = state['reserved'].pop() if state['reserved'] else (0, admin_token)
+        return '/cancel', {'token': token, 'reservation_id': reservation_id}
+
+    def admin(path):
+        return lambda rng, state: (path, {'token': admin_token, 'limit': 100})
+
+    return {
+        'login': login,
+        'items': get_items,
+        'reserve': reserve,
+        'cancel': cancel,
+        'admin_users': admin('/admin/users'),
+        'admin_pending': admin('/admin/pending'),
+        'admin_overdue': admin('/admin/overdue'),
+    }
+
+
+### Running ###
+
+# Get the value at a percentile of sorted values
+def percentile(values, fraction):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+# Send requests for one scenario at one concurrency level
+def run_scenario(app, name, scenario, concurrency, requests, seed, state):
+    rng = random.Random(seed)
+    # Build all requests up front so only the requests themselves are timed
+    forms = [scenario(rng, state) for index in range(requests)]
+
+    def send(form):
+        client = app.app.test_client()
+        started = time.perf_counter()
+        response = client.post(form[0], data=form[1])
+        latency = time.perf_counter() - started
+        body = response.get_json(silent=True)
+        failed = response.status_code != 200 or (isinstance(body, dict) and 'error' in body)
+        # Remember new reservations for the cancel scenario
+        if name == 'reserve' and not failed:
+            state['reserved'].append((body['reservation_id'], form[1]['token']))
+        return latency, failed
+
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        outcomes = list(executor.map(send, forms))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(outcome[0] for outcome in outcomes)
+    return {
+        'endpoint': name,
+        'concurrency': concurrency,
+        'requests': requests,
+        'errors': sum(1 for outcome in outcomes if outcome[1]),
+        'throughput': requests / elapsed if elapsed > 0 else None,
+        'mean_ms': 1000 * sum(latencies) / len(latencies) if latencies else None,
+        'p50_ms': 1000 * percentile(latencies, 0.50) if latencies else None,
+        'p95_ms': 1000 * percentile(latencies, 0.95) if latencies else None,
+        'p99_ms': 1000 * percentile(latencies, 0.99) if latencies else None,
+    }
+
+# Print how each result changed from a previous run
+def compare(results, previous):
+    previous = {(result['endpoint'], result['concurrency']): result for result in previous['results']}
+    for result in results:
+        old = previous.get((result['endpoint'], result['concurrency']))
+        if old is None or not old['throughput'] or not old['p99_ms']:
+            continue
+        print('{:>14} x{:<4} throughput {:+7.1f}%  p99 {:+7.1f}%'.format(result['endpoint'], result['concurrency'],
+            100 * (result['throughput'] / old['throughput'] - 1), 100 * (result['p99_ms'] / old['p99_ms'] - 1)), file=sys.stderr)
+
+
+def main():
+    # Get command line arguments
+    parser = argparse.ArgumentParser(description='Benchmark the reservation API')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--items', type=int, default=500)
+    parser.add_argument('--reservations', type=int, default=50000)
+    parser.add_argument('--shards', type=int, default=1, help='Number of database files reservations are split across')
+    parser.add_argument('--concurrency', default='1,8,32', help='Comma separated concurrency levels')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint and concurrency level')
+    parser.add_argument('--endpoints', default='login,items,reserve,cancel,admin_users,admin_pending,admin_overdue')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='File to write JSON results to, stdout if not given')
+    parser.add_argument('--compare', help='Previous JSON results to compare with')
+    args = parser.parse_args()
+    # Resolve paths before the app changes the working directory
+    output = os.path.abspath(args.output) if args.output else None
+    previous = None
+    if args.compare:
+        with open(args.compare) as compare_file:
+            previous = json.load(compare_file)
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = load_app(directory, args.shards)
+        populate(app, args.users, args.items, args.reservations, args.seed)
+        scenarios = build_scenarios(app, args.users, args.items)
+        state = {'reserved': []}
+        results = []
+        for concurrency in [int(level) for level in args.concurrency.split(',')]:
+            for name in args.endpoints.split(','):
+                result = run_scenario(app, name, scenarios[name], concurrency, args.requests, args.seed, state)
+                results.append(result)
+                print('{:>14} x{:<4} {:8.1f} req/s  p50 {:8.2f} ms  p95 {:8.2f} ms  p99 {:8.2f} ms  errors {}'.format(
+                    name, concurrency, result['throughput'], result['p50_ms'], result['p95_ms'], result['p99_ms'], result['errors']), file=sys.stderr)
+
+    report = {
+        'config': {'users': args.users, 'items': args.items, 'reservations': args.reservations, 'shards': args.shards,
+            'requests': args.requests, 'seed': args.seed, 'python': sys.version.split()[0]},
+        'results': results,
+    }
+    if previous is not None:
+        compare(results, previous)
+    # Write machine readable results
+    if output:
+        with open(output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
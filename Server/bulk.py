@@ -0,0 +1,203 @@
+# This is meant to be imported and used as a module.
+# It is not meant to be run directly.
+
+# Reading, validating and writing rows for bulk import and export.
+# Rows travel as CSV with a header line or as newline delimited JSON objects,
+# and are read and written lazily so whole tables never have to fit in memory.
+
+### Imports for bulk ###
+import csv
+import datetime
+import io
+import itertools
+import json
+# Import schemas.py
+import schemas
+
+# Supported formats
+formats = ('csv', 'ndjson')
+# Content type of each format
+content_types = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+# Columns of each kind of row, in export order
+columns = {
+    'items': ('name', 'description', 'status', 'quantity'),
+    'users': ('username', 'email', 'permissions'),
+    'reservations': ('id', 'username', 'item', 'start_time', 'end_time', 'status'),
+    'recurring': ('id', 'username', 'item', 'start_time', 'end_time', 'period', 'until'),
+}
+# Extra user columns exported when credentials are asked for
+credential_columns = ('hash', 'salt')
+# Statuses an imported reservation can have
+reservation_statuses = ('pending', 'lent', 'returned')
+# Format of readable times
+time_format = '%Y-%m-%d %H:%M:%S'
+
+
+### Formats ###
+
+# Get the format named by a format field, content type or file name, or None if it is unknown
+def detect_format(value):
+    if not value:
+        return None
+    value = value.lower()
+    for format in formats:
+        if value == format or value.endswith('.' + format) or value.startswith(content_types[format]):
+            return format
+    if value.endswith('.jsonl') or value.startswith('application/jsonl'):
+        return 'ndjson'
+    return None
+
+# Read rows from lines of text
+# Yields (line, row, error) where row is a dictionary, or None with an error if the line can't be read
+def read_rows(lines, format):
+    if format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            # Extra values are collected under the None key by DictReader
+            if None in row:
+                yield reader.line_num, None, 'Too many values'
+            else:
+                yield reader.line_num, row, None
+    else:
+        for line, text in enumerate(lines, 1):
+            if not text.strip():
+                continue
+            try:
+                row = json.loads(text)
+            except ValueError:
+                yield line, None, 'Invalid JSON'
+                continue
+            if not isinstance(row, dict):
+                yield line, None, 'Row is not an object'
+            else:
+                yield line, row, None
+
+# Write rows as text, yields one chunk per batch of rows
+def write_rows(fields, rows, format, batch_size=500):
+    if format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(fields)
+        for batch in chunked(rows, batch_size):
+            writer.writerows(batch)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    else:
+        for batch in chunked(rows, batch_size):
+            yield ''.join(json.dumps(dict(zip(fields, row))) + '\n' for row in batch)
+
+# Split an iterable into lists of up to size values
+def chunked(values, size):
+    values = iter(values)
+    while True:
+        chunk = list(itertools.islice(values, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+### Validation ###
+# Each function takes a row read from a file and returns the values to insert,
+# or raises ValueError with the reason the row is rejected.
+
+# Get a required text field
+def text_field(row, name):
+    value = row.get(name)
+    if value is None or not str(value).strip():
+        raise ValueError('Missing {}'.format(name))
+    return str(value).strip()
+
+# Get an integer field, default if it is missing
+def integer_field(row, name, default):
+    value = row.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid {}'.format(name))
+
+# Get a time field given as a timestamp or a readable local time
+def time_field(row, name):
+    value = row.get(name)
+    if isinstance(value, int):
+        return value
+    value = text_field(row, name)
+    if value.isdigit():
+        return int(value)
+    try:
+        return schemas.parse_time(value)
+    except ValueError:
+        raise ValueError('Invalid {}'.format(name))
+
+# Get (name, description, quantity) of an item
+def item_row(row):
+    name = text_field(row, 'name')
+    description = str(row.get('description') or '')
+    quantity = integer_field(row, 'quantity', 1)
+    if quantity <= 0:
+        raise ValueError('quantity must be a positive integer')
+    return name, description, quantity
+
+# Get (username, email, permissions, password, hash, salt) of a user
+# A user is imported either with a password, which is hashed, or with the hash and salt of an export
+def user_row(row):
+    username = text_field(row, 'username')
+    email = str(row.get('email') or '')
+    permissions = str(row.get('permissions') or 'user')
+    if permissions not in ('user', 'admin'):
+        raise ValueError('Invalid permissions')
+    password = row.get('password') or None
+    hash = row.get('hash') or None
+    salt = row.get('salt') or None
+    if password is None and (hash is None or salt is None):
+        raise ValueError('Missing password')
+    if password is None:
+        try:
+            salt = bytes.fromhex(salt)
+        except (TypeError, ValueError):
+            raise ValueError('Invalid salt')
+    return username, email, permissions, password, hash, salt
+
+# Get (username, item, start_time, end_time, status) of a reservation
+def reservation_row(row):
+    username = text_field(row, 'username')
+    item = text_field(row, 'item')
+    start_time = time_field(row, 'start_time')
+    end_time = time_field(row, 'end_time')
+    if start_time > end_time:
+        raise ValueError('Start time is after end time')
+    status = str(row.get('status') or 'pending')
+    if status not in reservation_statuses:
+        raise ValueError('Invalid status')
+    return username, item, start_time, end_time, status
+
+# Get (username, item, start_time, end_time, period, until) of a recurring reservation
+# start_time and end_time are those of the first occurrence, period is in seconds
+def recurring_row(row):
+    username = text_field(row, 'username')
+    item = text_field(row, 'item')
+    start_time = time_field(row, 'start_time')
+    end_time = time_field(row, 'end_time')
+    if start_time > end_time:
+        raise ValueError('Start time is after end time')
+    period = integer_field(row, 'period', None)
+    if period is None:
+        raise ValueError('Missing period')
+    # Occurrences of one rule must not overlap each other
+    if period <= end_time - start_time:
+        raise ValueError('Period is shorter than the reservation')
+    until = time_field(row, 'until')
+    if until < start_time:
+        raise ValueError('Until is before start time')
+    return username, item, start_time, end_time, period, until
+
+# Validation function of each kind of row
+validators = {'items': item_row, 'users': user_row, 'reservations': reservation_row, 'recurring': recurring_row}
+
+# Format a timestamp as a readable local time
+def readable_time(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp).strftime(time_format)
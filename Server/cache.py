@@ -0,0 +1,80 @@
+# This is meant to be imported and used as a module.
+# It is not meant to be run directly.
+
+### Imports for cache ###
+import collections
+import threading
+import time
+
+
+### Availability cache ###
+# Bounded LRU cache of /items results keyed by (start_time, end_time) timestamps.
+# Entries expire after ttl seconds and are dropped as soon as a reservation overlapping their window changes.
+class AvailabilityCache:
+    def __init__(self, max_entries=1024, ttl=60):
+        # Most entries kept before the least recently used is evicted
+        self.max_entries = max_entries
+        # Seconds an entry stays valid
+        self.ttl = ttl
+        # (start_time, end_time) -> (expiry, value), least recently used first
+        self.entries = collections.OrderedDict()
+        # Bumped on every invalidation, so results computed before it are not stored
+        self.generation = 0
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    # Get a cached value, or None
+    def get(self, start_time, end_time):
+        key = (start_time, end_time)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    # Store a value computed while the cache was at the given generation
+    def put(self, start_time, end_time, value, generation):
+        with self.lock:
+            # Something changed while the value was computed
+            if generation != self.generation:
+                return
+            self.entries[(start_time, end_time)] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end((start_time, end_time))
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    # Drop entries whose window overlaps the given times
+    def invalidate(self, start_time, end_time):
+        with self.lock:
+            self.generation += 1
+            for key in [key for key in self.entries if key[0] <= end_time and key[1] >= start_time]:
+                del self.entries[key]
+                self.invalidations += 1
+
+    # Drop entries whose result lists the given item
+    def invalidate_item(self, name):
+        with self.lock:
+            self.generation += 1
+            for key in [key for key, entry in self.entries.items() if any(item['name'] == name for item in entry[1])]:
+                del self.entries[key]
+                self.invalidations += 1
+
+    # Drop all entries
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+
+    # Get counters
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses, 'invalidations': self.invalidations}
@@ -0,0 +1,125 @@
+# This is meant to be imported and used as a module.
+# It is not meant to be run directly.
+
+### Imports for database ###
+import contextlib
+import queue
+import sqlite3
+import threading
+import time
+
+
+### Timed connections ###
+# Cursor that reports how long each statement took to execute
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.connection.report(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            self.connection.report(sql, time.perf_counter() - started)
+
+# Connection whose statements all go through TimedCursor
+class TimedConnection(sqlite3.Connection):
+    # Function called with (sql, seconds) after each statement
+    on_query = None
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, parameters):
+        return self.cursor().executemany(sql, parameters)
+
+    def report(self, sql, seconds):
+        if self.on_query is not None:
+            self.on_query(sql, seconds)
+
+
+### Connection pool ###
+# Hands out long-lived SQLite connections so requests don't pay for connection setup.
+# Connections use WAL journaling so readers don't block on the writer.
+class ConnectionPool:
+    def __init__(self, path, size=8, synchronous='NORMAL', cache_size=-16000, cached_statements=256, on_query=None, on_open=None, attach=None):
+        # Path to the database file
+        self.path = path
+        # Number of idle connections kept open
+        self.size = size
+        # PRAGMA synchronous level, NORMAL is durable enough with WAL
+        self.synchronous = synchronous
+        # PRAGMA cache_size, negative values are in KiB
+        self.cache_size = cache_size
+        # Prepared statements cached per connection
+        self.cached_statements = cached_statements
+        # Function called with (sql, seconds) after each statement
+        self.on_query = on_query
+        # Function called whenever a connection is opened
+        self.on_open = on_open
+        # Schema name -> path of other databases attached to each connection
+        self.attach = attach or {}
+        # Idle connections, most recently used first
+        self.idle = queue.LifoQueue()
+        # Number of connections opened so far
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    # Open and configure a new connection, without attaching other databases if attached is False
+    def open(self, attached=True):
+        db = sqlite3.connect(self.path, timeout=30, check_same_thread=False, cached_statements=self.cached_statements, factory=TimedConnection)
+        db.execute('PRAGMA journal_mode = WAL')
+        db.execute('PRAGMA synchronous = {}'.format(self.synchronous))
+        db.execute('PRAGMA cache_size = {}'.format(int(self.cache_size)))
+        db.execute('PRAGMA foreign_keys = ON')
+        if attached:
+            for name, path in self.attach.items():
+                db.execute('ATTACH DATABASE ? AS {}'.format(name), (path,))
+        with self.lock:
+            self.opened += 1
+        if self.on_open is not None:
+            self.on_open()
+        # Report statements once the connection is set up
+        db.on_query = self.on_query
+        return db
+
+    # Get an idle connection, or open a new one if none are idle
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            return self.open()
+
+    # Give a connection back to the pool
+    def release(self, db):
+        # Discard anything the borrower did not commit
+        if db.in_transaction:
+            db.rollback()
+        if self.idle.qsize() < self.size:
+            self.idle.put(db)
+        else:
+            db.close()
+
+    # Borrow a connection for the duration of a with block
+    @contextlib.contextmanager
+    def connection(self):
+        db = self.acquire()
+        try:
+            yield db
+        finally:
+            self.release(db)
+
+    # Close all idle connections
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
@@ -0,0 +1,186 @@
+# This is meant to be imported and used as a module.
+# It is not meant to be run directly.
+
+### Imports for deadlines ###
+import bisect
+import heapq
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+### Deadline tracker ###
+# Keeps the overdue and late sets of the admin listings up to date without scanning reservations.
+# Lent reservations wait in a heap ordered by end time and move to the overdue set once it passes,
+# pending reservations wait in a heap ordered by start time and move to the late set once it passes.
+# Both sets are sorted lists of (time, reservation_id), so a page of k entries costs O(log n + k).
+# It is fed by IntervalIndex as a watcher, so every lend, return, cancel and archive is seen.
+class DeadlineTracker:
+    def __init__(self, expire_after=None, on_expire=None, clock=time.time):
+        # Seconds after their start time late reservations are expired, None to keep them
+        self.expire_after = expire_after
+        # Function called with the ids of late reservations to expire
+        self.on_expire = on_expire
+        # Function returning the current time
+        self.clock = clock
+        # Reservation id -> (status, deadline) of tracked reservations
+        self.deadlines = {}
+        # (deadline, reservation_id) heaps of reservations whose deadline is still ahead,
+        # entries that no longer match self.deadlines are skipped when popped
+        self.lent_heap = []
+        self.pending_heap = []
+        # Sorted (end_time, reservation_id) of lent reservations past their end time
+        self.overdue = []
+        # Sorted (start_time, reservation_id) of pending reservations past their start time
+        self.late = []
+        self.lock = threading.Lock()
+        # Set when the expiry thread should look at the late set again
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    ## Watcher interface ##
+
+    # Replace everything with (reservation_id, item, start_time, end_time, status) rows
+    def load(self, rows):
+        now = self.clock()
+        with self.lock:
+            self.deadlines = {}
+            self.lent_heap = []
+            self.pending_heap = []
+            self.overdue = []
+            self.late = []
+            for reservation_id, item, start_time, end_time, status in rows:
+                self._track(reservation_id, start_time, end_time, status, now)
+            self.overdue.sort()
+            self.late.sort()
+        self.wakeup.set()
+
+    # A reservation was added or changed status
+    def update(self, reservation_id, start_time, end_time, status):
+        now = self.clock()
+        with self.lock:
+            self._untrack(reservation_id)
+            self._track(reservation_id, start_time, end_time, status, now, insort=True)
+        self.wakeup.set()
+
+    # A reservation was removed
+    def discard(self, reservation_id):
+        with self.lock:
+            self._untrack(reservation_id)
+
+    def _track(self, reservation_id, start_time, end_time, status, now, insort=False):
+        if status == 'lent':
+            deadline, heap, passed = end_time, self.lent_heap, self.overdue
+        elif status == 'pending':
+            deadline, heap, passed = start_time, self.pending_heap, self.late
+        else:
+            return
+        self.deadlines[reservation_id] = (status, deadline)
+        if deadline < now:
+            # Sorted once by load, kept sorted by update
+            if insort:
+                bisect.insort(passed, (deadline, reservation_id))
+            else:
+                passed.append((deadline, reservation_id))
+        else:
+            heapq.heappush(heap, (deadline, reservation_id))
+            self._compact(heap)
+
+    def _untrack(self, reservation_id):
+        tracked = self.deadlines.pop(reservation_id, None)
+        if tracked is None:
+            return
+        status, deadline = tracked
+        passed = self.overdue if status == 'lent' else self.late
+        # Heap entries are left behind and skipped later
+        index = bisect.bisect_left(passed, (deadline, reservation_id))
+        if index < len(passed) and passed[index] == (deadline, reservation_id):
+            del passed[index]
+
+    # Rebuild a heap once most of its entries are stale
+    def _compact(self, heap):
+        if len(heap) > 2 * len(self.deadlines) + 64:
+            status = 'lent' if heap is self.lent_heap else 'pending'
+            heap[:] = [entry for entry in heap if self.deadlines.get(entry[1]) == (status, entry[0])]
+            heapq.heapify(heap)
+
+    ## Reading ##
+
+    # Move reservations whose deadline has passed from the heaps to the sets
+    def _advance(self, now):
+        for status, heap, passed in (('lent', self.lent_heap, self.overdue), ('pending', self.pending_heap, self.late)):
+            while heap and heap[0][0] < now:
+                deadline, reservation_id = heapq.heappop(heap)
+                if self.deadlines.get(reservation_id) == (status, deadline):
+                    bisect.insort(passed, (deadline, reservation_id))
+
+    # Get up to limit (time, reservation_id) entries after the cursor from a set
+    def _page(self, passed, cursor, limit):
+        with self.lock:
+            self._advance(self.clock())
+            start = bisect.bisect_right(passed, cursor) if cursor is not None else 0
+            return passed[start:start + limit] if limit is not None else passed[start:]
+
+    # Get lent reservations past their end time as (end_time, reservation_id), oldest first
+    def get_overdue(self, cursor=None, limit=None):
+        return self._page(self.overdue, cursor, limit)
+
+    # Get pending reservations past their start time as (start_time, reservation_id), oldest first
+    def get_late(self, cursor=None, limit=None):
+        return self._page(self.late, cursor, limit)
+
+    # Get counters
+    def stats(self):
+        with self.lock:
+            self._advance(self.clock())
+            return {'overdue': len(self.overdue), 'late': len(self.late), 'tracked': len(self.deadlines)}
+
+    ## Expiry ##
+
+    # Get ids of late reservations due for expiry, at most limit
+    def due_for_expiry(self, limit=500):
+        now = self.clock()
+        with self.lock:
+            self._advance(now)
+            due = []
+            for start_time, reservation_id in self.late:
+                if start_time + self.expire_after > now or len(due) == limit:
+                    break
+                due.append(reservation_id)
+            return due
+
+    # Seconds until the next late reservation is due, or None if none is known
+    def next_expiry(self):
+        now = self.clock()
+        with self.lock:
+            self._advance(now)
+            deadlines = []
+            if self.late:
+                deadlines.append(self.late[0][0])
+            if self.pending_heap:
+                deadlines.append(self.pending_heap[0][0])
+            if not deadlines:
+                return None
+            return min(deadlines) + self.expire_after - now
+
+    # Start expiring late reservations in the background, if enabled
+    def start(self):
+        if self.expire_after is not None and self.on_expire is not None and self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='deadlines', daemon=True)
+            self.thread.start()
+
+    # Expiry thread loop
+    def run(self):
+        while True:
+            # Sleep until the next reservation is due, checking at least once a minute
+            timeout = self.next_expiry()
+            self.wakeup.wait(min(max(timeout, 1), 60) if timeout is not None else 60)
+            self.wakeup.clear()
+            due = self.due_for_expiry()
+            if due:
+                try:
+                    self.on_expire(due)
+                except Exception:
+                    logger.exception('Expiring reservations failed')
@@ -0,0 +1,102 @@
+# This is meant to be imported and used as a module.
+# It is not meant to be run directly.
+
+### Imports for feed ###
+import collections
+import contextlib
+import itertools
+import json
+import math
+import secrets
+import threading
+
+
+### Change feed ###
+# Numbered log of the most recent reservation and item changes.
+# Readers remember the last sequence number they saw and ask for everything after it,
+# so a client that reconnects resumes where it stopped as long as the events are still kept.
+# Event ids handed to clients are 'epoch:sequence', so an id from another server run is never mistaken for one of this run.
+class ChangeFeed:
+    def __init__(self, capacity=10000):
+        # (sequence, type, data) of the most recent events, oldest first
+        self.events = collections.deque(maxlen=capacity)
+        # Sequence number of the last event, numbering restarts with the server
+        self.sequence = 0
+        # Differs between server runs, so ids handed out before a restart get a reset
+        self.epoch = secrets.token_hex(4)
+        # Number of clients currently streaming
+        self.subscribers = 0
+        self.condition = threading.Condition()
+
+    # Add an event and wake up waiting readers, returns its sequence number
+    def publish(self, type, data):
+        with self.condition:
+            self.sequence += 1
+            self.events.append((self.sequence, type, data))
+            self.condition.notify_all()
+            return self.sequence
+
+    # Get the id of a sequence number as handed to clients
+    def event_id(self, sequence):
+        return '{}:{}'.format(self.epoch, sequence)
+
+    # Get the sequence number of an id handed to a client, -1 if it is from another server run
+    # Raises ValueError if it is not an id
+    def parse_id(self, value):
+        epoch, sep, sequence = value.partition(':')
+        sequence = int(sequence if sep else epoch)
+        if sequence < 0:
+            raise ValueError('Invalid event id')
+        return sequence if sep and epoch == self.epoch else -1
+
+    # Get events after a sequence number, or None if some of them are no longer kept
+    # (or the number is -1, from before a restart) and the client has to reload its state
+    def since(self, sequence):
+        with self.condition:
+            if sequence > self.sequence:
+                return None
+            first = self.events[0][0] if self.events else self.sequence + 1
+            if sequence < first - 1:
+                return None
+            return list(itertools.islice(self.events, sequence - first + 1, None))
+
+    # Wait up to timeout seconds for events after a sequence number, then return them like since()
+    def wait(self, sequence, timeout):
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence != sequence, timeout)
+            return self.since(sequence)
+
+    # Count a streaming client for the duration of a with block
+    @contextlib.contextmanager
+    def subscribe(self):
+        with self.condition:
+            self.subscribers += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.subscribers -= 1
+
+
+### Requests ###
+
+# Get the seconds a long-poll may wait from its timeout argument, at most max_wait
+# Raises ValueError for anything but a finite number of seconds that is not negative, as NaN would wait forever
+def parse_timeout(value, max_wait):
+    if value is None:
+        return max_wait
+    timeout = float(value)
+    if not math.isfinite(timeout) or timeout < 0:
+        raise ValueError('Invalid timeout')
+    return min(timeout, max_wait)
+
+
+### Formatting ###
+
+# Convert an event of a feed to its JSON value
+def to_json(change_feed, event):
+    return {'id': change_feed.event_id(event[0]), 'type': event[1], 'data': event[2]}
+
+# Format an event of a feed as a server-sent event
+def to_sse(change_feed, event):
+    return 'id: {}\nevent: {}\ndata: {}\n\n'.format(change_feed.event_id(event[0]), event[1], json.dumps(event[2]))
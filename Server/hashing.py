@@ -0,0 +1,41 @@
+# This is meant to be imported and used as a module.
+# It is not meant to be run directly.
+
+### Imports for hashing ###
+import concurrent.futures
+import hashlib
+import multiprocessing
+
+# Process pool for password hashing, passwords are hashed on the calling thread while None
+pool = None
+
+
+# Hash a password and salt with PBKDF2-SHA256
+def pbkdf2(password, salt):
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, 100000).hex()
+
+# Start hashing passwords on worker processes (one per CPU if workers is 0)
+def start_pool(workers=0):
+    global pool
+    if pool is None:
+        # Spawned workers only import this module, not the server
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers or None, mp_context=multiprocessing.get_context('spawn'))
+
+# Stop the worker processes
+def stop_pool():
+    global pool
+    if pool is not None:
+        pool.shutdown()
+        pool = None
+
+# Hash a password, on the pool if it is running
+def hash_password(password, salt):
+    if pool is None:
+        return pbkdf2(password, salt)
+    return pool.submit(pbkdf2, password, salt).result()
+
+# Hash many passwords with their salts, spread over the pool if it is running
+def hash_passwords(passwords, salts):
+    if pool is None:
+        return [pbkdf2(password, salt) for password, salt in zip(passwords, salts)]
+    return list(pool.map(pbkdf2, passwords, salts, chunksize=8))
@@ -0,0 +1,338 @@
+# This is meant to be imported and used as a module.
+# It is not meant to be run directly.
+
+### Imports for intervals ###
+import bisect
+import heapq
+import threading
+
+
+### Recurrence ###
+# A recurring reservation is a rule (start_time, end_time, period, until, rule_id):
+# [start_time, end_time] repeats every period seconds for as long as the occurrence starts no later than until.
+
+# Get the (start_time, end_time, rule_id) occurrences of a rule overlapping the given times
+# Only occurrences inside the window are computed, so the cost doesn't grow with the length of the rule
+def occurrences(rule, start_time, end_time):
+    rule_start, rule_end, period, until, rule_id = rule
+    # First occurrence ending at or after start_time, last one starting at or before end_time
+    first = max(0, -(-(start_time - rule_end) // period))
+    last = min((end_time - rule_start) // period, (until - rule_start) // period)
+    return [(rule_start + index * period, rule_end + index * period, rule_id) for index in range(first, last + 1)]
+
+# Get the end time of the last occurrence of a rule
+def last_end(rule):
+    return rule[1] + (rule[3] - rule[0]) // rule[2] * rule[2]
+
+
+### Per item intervals ###
+# Keeps the reservations of one item sorted by start time, and its recurring reservations as rules.
+# Reservations are split into length classes, class c holding those whose end_time - start_time has bit length c,
+# so every one of them is shorter than 2 ** c. A lookup only scans each class back by that bound instead of by the
+# longest reservation of the item, so one long reservation doesn't slow down lookups among short ones.
+# A lookup costs a binary search per class (at most 33 for 32 bit timestamps) plus the reservations it finds and,
+# per class, the few that start less than 2 ** c before it but end before it (bounded by the item's quantity,
+# as they would otherwise overlap). Adding and removing is a binary search plus a list insert or delete,
+# which moves O(n) memory but stays cheaper than a balanced tree in Python at the sizes one item has.
+class ItemIntervals:
+    def __init__(self):
+        # Length class -> sorted list of (start_time, end_time, reservation_id)
+        self.classes = {}
+        # Sorted list of (start_time, end_time, period, until, rule_id) of recurring reservations
+        self.rules = []
+
+    def add(self, reservation_id, start_time, end_time):
+        length_class = (end_time - start_time).bit_length()
+        if length_class not in self.classes:
+            self.classes[length_class] = []
+        bisect.insort(self.classes[length_class], (start_time, end_time, reservation_id))
+
+    def remove(self, reservation_id, start_time, end_time):
+        length_class = (end_time - start_time).bit_length()
+        intervals = self.classes.get(length_class)
+        if intervals is None:
+            return
+        # Find the exact entry with a binary search
+        index = bisect.bisect_left(intervals, (start_time, end_time, reservation_id))
+        if index < len(intervals) and intervals[index][2] == reservation_id:
+            del intervals[index]
+            if not intervals:
+                del self.classes[length_class]
+
+    # Get all reservations sorted by start time
+    def intervals(self):
+        return list(heapq.merge(*self.classes.values()))
+
+    def add_rule(self, rule):
+        bisect.insort(self.rules, rule)
+
+    def remove_rule(self, rule):
+        index = bisect.bisect_left(self.rules, rule)
+        if index < len(self.rules) and self.rules[index] == rule:
+            del self.rules[index]
+
+    # Get rules with an occurrence that can overlap the given times
+    def active_rules(self, start_time, end_time):
+        high = bisect.bisect_right(self.rules, (end_time, float('inf')))
+        return [rule for rule in self.rules[:high] if last_end(rule) >= start_time]
+
+    # Get the (intervals, low, high) slice of each length class that can overlap the given times
+    # Only reservations of class c starting less than 2 ** c before start time can reach it
+    def candidates(self, start_time, end_time):
+        for length_class, intervals in self.classes.items():
+            low = bisect.bisect_left(intervals, (start_time - (1 << length_class) + 1,))
+            high = bisect.bisect_right(intervals, (end_time, float('inf'), float('inf')))
+            yield intervals, low, high
+
+    # Get reservations and occurrences where start time is before end time and end time is after start time
+    def overlapping(self, start_time, end_time):
+        overlapping = []
+        for intervals, low, high in self.candidates(start_time, end_time):
+            overlapping += [interval for interval in intervals[low:high] if interval[1] >= start_time]
+        if self.rules:
+            for rule in self.active_rules(start_time, end_time):
+                overlapping += occurrences(rule, start_time, end_time)
+        overlapping.sort()
+        return overlapping
+
+    # Get the most reservations overlapping at any one time between the given times
+    def peak(self, start_time, end_time):
+        return peak(self.overlapping(start_time, end_time))
+
+    # Check if fewer than capacity reservations overlap at any one time between the given times
+    def is_free(self, start_time, end_time, capacity=1):
+        if capacity != 1:
+            return self.peak(start_time, end_time) < capacity
+        # Same candidates as overlapping() but stops at the first conflict
+        for intervals, low, high in self.candidates(start_time, end_time):
+            for index in range(low, high):
+                if intervals[index][1] >= start_time:
+                    return False
+        for rule in self.active_rules(start_time, end_time) if self.rules else ():
+            if occurrences(rule, start_time, end_time):
+                return False
+        return True
+
+
+### Reservation index ###
+# In-memory copy of the reservations table, grouped by item.
+class IntervalIndex:
+    def __init__(self):
+        # Item id -> ItemIntervals
+        self.items = {}
+        # Reservation id -> [item, start_time, end_time, status]
+        self.reservations = {}
+        # Rule id -> (item, rule) of recurring reservations
+        self.rules = {}
+        # Functions called with (item, start_time, end_time) when a reservation or rule is added or removed
+        self.listeners = []
+        # Objects told about each reservation through load(rows), update(reservation_id, start_time, end_time, status)
+        # and discard(reservation_id), called while the index is locked so they see changes in order
+        self.watchers = []
+        # Guards all dictionaries
+        self.lock = threading.Lock()
+
+    # Fill the index from the reservations and recurring_reservations tables of the given databases
+    def load(self, *dbs):
+        rows = []
+        rules = []
+        for db in dbs:
+            rows += db.execute('SELECT id, item_id, start_time, end_time, status FROM reservations').fetchall()
+            rules += db.execute('SELECT id, item_id, start_time, end_time, period, until FROM recurring_reservations').fetchall()
+        with self.lock:
+            self.items = {}
+            self.reservations = {}
+            self.rules = {}
+            for reservation_id, item, start_time, end_time, status in rows:
+                self._add(reservation_id, item, start_time, end_time, status)
+            for rule_id, item, start_time, end_time, period, until in rules:
+                self._add_rule(item, (start_time, end_time, period, until, rule_id))
+            for watcher in self.watchers:
+                watcher.load(rows)
+
+    # Adding a reservation that is already indexed replaces it, so replaying a change after a reload is harmless
+    def _add(self, reservation_id, item, start_time, end_time, status):
+        previous = self.reservations.get(reservation_id)
+        if previous is not None:
+            self.items[previous[0]].remove(reservation_id, previous[1], previous[2])
+        if item not in self.items:
+            self.items[item] = ItemIntervals()
+        self.items[item].add(reservation_id, start_time, end_time)
+        self.reservations[reservation_id] = [item, start_time, end_time, status]
+
+    def add(self, reservation_id, item, start_time, end_time, status):
+        with self.lock:
+            self._add(reservation_id, item, start_time, end_time, status)
+            for watcher in self.watchers:
+                watcher.update(reservation_id, start_time, end_time, status)
+        self.notify(item, start_time, end_time)
+
+    def remove(self, reservation_id):
+        with self.lock:
+            reservation = self.reservations.pop(reservation_id, None)
+            if reservation is None:
+                return
+            item, start_time, end_time, status = reservation
+            self.items[item].remove(reservation_id, start_time, end_time)
+            for watcher in self.watchers:
+                watcher.discard(reservation_id)
+        self.notify(item, start_time, end_time)
+
+    def _add_rule(self, item, rule):
+        previous = self.rules.get(rule[4])
+        if previous is not None:
+            self.items[previous[0]].remove_rule(previous[1])
+        if item not in self.items:
+            self.items[item] = ItemIntervals()
+        self.items[item].add_rule(rule)
+        self.rules[rule[4]] = (item, rule)
+
+    # Add a recurring reservation, repeating [start_time, end_time] every period seconds until the given time
+    def add_rule(self, rule_id, item, start_time, end_time, period, until):
+        rule = (start_time, end_time, period, until, rule_id)
+        with self.lock:
+            self._add_rule(item, rule)
+        self.notify(item, start_time, last_end(rule))
+
+    def remove_rule(self, rule_id):
+        with self.lock:
+            entry = self.rules.pop(rule_id, None)
+            if entry is None:
+                return
+            item, rule = entry
+            self.items[item].remove_rule(rule)
+        self.notify(item, rule[0], last_end(rule))
+
+    # Get the item of a recurring reservation, or None if it doesn't exist
+    def get_rule_item(self, rule_id):
+        with self.lock:
+            entry = self.rules.get(rule_id)
+            return entry[0] if entry is not None else None
+
+    # Tell listeners that the availability of an item changed between the given times
+    def notify(self, item, start_time, end_time):
+        for listener in self.listeners:
+            listener(item, start_time, end_time)
+
+    # Remove all reservations and recurring reservations of an item
+    def remove_item(self, item):
+        with self.lock:
+            item_intervals = self.items.pop(item, None)
+            if item_intervals is None:
+                return
+            removed = item_intervals.intervals()
+            for interval in removed:
+                del self.reservations[interval[2]]
+                for watcher in self.watchers:
+                    watcher.discard(interval[2])
+            for rule in item_intervals.rules:
+                del self.rules[rule[4]]
+        for interval in removed:
+            self.notify(item, interval[0], interval[1])
+        for rule in item_intervals.rules:
+            self.notify(item, rule[0], last_end(rule))
+
+    # Get the item of a reservation, or None if it doesn't exist
+    def get_item(self, reservation_id):
+        with self.lock:
+            reservation = self.reservations.get(reservation_id)
+            return reservation[0] if reservation is not None else None
+
+    def set_status(self, reservation_id, status):
+        with self.lock:
+            if reservation_id in self.reservations:
+                reservation = self.reservations[reservation_id]
+                reservation[3] = status
+                for watcher in self.watchers:
+                    watcher.update(reservation_id, reservation[1], reservation[2], status)
+
+    # Check if an item has fewer than capacity reservations overlapping at any one time between the given times
+    def is_free(self, item, start_time, end_time, capacity=1):
+        with self.lock:
+            if item not in self.items:
+                return True
+            return self.items[item].is_free(start_time, end_time, capacity)
+
+    # Get how many more reservations of an item fit between the given times
+    def remaining(self, item, start_time, end_time, capacity=1):
+        with self.lock:
+            if item not in self.items:
+                return capacity
+            return max(0, capacity - self.items[item].peak(start_time, end_time))
+
+    # Get (start_time, end_time, reservation_id) of reservations overlapping the given times
+    def overlapping(self, item, start_time, end_time):
+        with self.lock:
+            if item not in self.items:
+                return []
+            return self.items[item].overlapping(start_time, end_time)
+
+
+### Overlap counting ###
+# Get the (time, change) events of (start_time, end_time, ...) intervals with inclusive bounds, sorted by time.
+# An interval counts from its start time until its end time + 1, ends sort before starts at the same time.
+def sweep(intervals):
+    events = []
+    for interval in intervals:
+        events.append((interval[0], 1))
+        events.append((interval[1] + 1, -1))
+    events.sort()
+    return events
+
+# Get the most intervals overlapping at any one time
+def peak(intervals):
+    count = highest = 0
+    for time, change in sweep(intervals):
+        count += change
+        highest = max(highest, count)
+    return highest
+
+# Get the sorted (start_time, end_time) parts where at least capacity intervals overlap, bounds inclusive
+def saturated(intervals, capacity):
+    events = sweep(intervals)
+    parts = []
+    count = 0
+    for index, (time, change) in enumerate(events):
+        count += change
+        # The count at a time is only known after its last event
+        if index + 1 == len(events) or events[index + 1][0] == time:
+            continue
+        if count >= capacity:
+            parts.append((time, events[index + 1][0] - 1))
+    return parts
+
+
+### Timeline ###
+# Split [start_time, end_time] into busy and free intervals with a single sweep.
+# intervals must be (start_time, end_time, ...) sorted by start time, all bounds inclusive.
+# An item with a capacity above 1 is only busy where that many intervals overlap.
+# Free intervals are aligned to granularity seconds and shorter ones than min_slot are dropped.
+def timeline(intervals, start_time, end_time, min_slot=0, granularity=0, capacity=1):
+    if capacity != 1:
+        intervals = saturated(intervals, capacity)
+    busy = []
+    for interval in intervals:
+        # Clip to the requested window
+        busy_start = max(interval[0], start_time)
+        busy_end = min(interval[1], end_time)
+        if busy_start > busy_end:
+            continue
+        # Merge with the previous interval if they overlap or touch
+        if busy and busy_start <= busy[-1][1] + 1:
+            busy[-1][1] = max(busy[-1][1], busy_end)
+        else:
+            busy.append([busy_start, busy_end])
+    # Free intervals are the gaps between busy ones
+    free = []
+    cursor = start_time
+    for busy_start, busy_end in busy + [[end_time + 1, end_time + 1]]:
+        free_start = cursor
+        free_end = busy_start - 1
+        cursor = busy_end + 1
+        # Align to granularity, the inclusive end becomes the last second before a boundary
+        if granularity > 0:
+            free_start = -(-free_start // granularity) * granularity
+            free_end = (free_end + 1) // granularity * granularity - 1
+        if free_end >= free_start and free_end - free_start + 1 >= min_slot:
+            free.append([free_start, free_end])
+    return busy, free
@@ -0,0 +1,112 @@
+# This is meant to be imported and used as a module.
+# It is not meant to be run directly.
+
+### Imports for metrics ###
+import threading
+
+
+# Escape a label value for the Prometheus text format
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# Format label names and values as {name="value",...}
+def format_labels(names, values, extra=()):
+    pairs = ['{}="{}"'.format(name, escape(value)) for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+### Metric types ###
+# Counter that only goes up, one value per combination of labels
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        # Label values -> count
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} counter'.format(self.name)]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append('{}{} {}'.format(self.name, format_labels(self.labels, key), value))
+        return lines
+
+# Histogram with cumulative buckets, one set per combination of labels
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # Label values -> [bucket counts..., sum, count]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = [0] * (len(self.buckets) + 2)
+            series = self.values[key]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} histogram'.format(self.name)]
+        with self.lock:
+            for key, series in sorted(self.values.items()):
+                for index, bound in enumerate(self.buckets):
+                    lines.append('{}_bucket{} {}'.format(self.name, format_labels(self.labels, key, [('le', bound)]), series[index]))
+                lines.append('{}_bucket{} {}'.format(self.name, format_labels(self.labels, key, [('le', '+Inf')]), series[-1]))
+                lines.append('{}_sum{} {}'.format(self.name, format_labels(self.labels, key), series[-2]))
+                lines.append('{}_count{} {}'.format(self.name, format_labels(self.labels, key), series[-1]))
+        return lines
+
+# Value read from a function when metrics are rendered
+class Gauge:
+    def __init__(self, name, help, function, type='gauge'):
+        self.name = name
+        self.help = help
+        self.function = function
+        self.type = type
+
+    def render(self):
+        return ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} {}'.format(self.name, self.type),
+            '{} {}'.format(self.name, self.function())]
+
+
+### Registry ###
+# Collects metrics and renders them for a /metrics endpoint
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, labels=()):
+        return self.add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), **options):
+        return self.add(Histogram(name, help, labels, **options))
+
+    def gauge(self, name, help, function, type='gauge'):
+        return self.add(Gauge(name, help, function, type))
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    # Render all metrics in the Prometheus text format
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
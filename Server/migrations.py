@@ -0,0 +1,218 @@
+# This is meant to be imported and used as a module.
+# It is not meant to be run directly.
+
+# Versioned schema migrations.
+# The schema version is stored in PRAGMA user_version, each migration runs in its own
+# transaction and bumps the version, so existing database files are upgraded in place.
+
+### Imports for migrations ###
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+### Migrations ###
+
+# 1: Create three tables: users, reservations, and items
+def create_tables(db):
+    db.execute('''CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        hash TEXT NOT NULL,
+        salt TEXT NOT NULL,
+        email TEXT NOT NULL,
+        permissions TEXT NOT NULL
+    )''')
+    db.execute('''CREATE TABLE IF NOT EXISTS reservations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL,
+        start_time INTEGER NOT NULL,
+        end_time INTEGER NOT NULL,
+        item TEXT NOT NULL,
+        status TEXT NOT NULL
+    )''')
+    db.execute('''CREATE TABLE IF NOT EXISTS items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE NOT NULL,
+        description TEXT NOT NULL,
+        status TEXT NOT NULL
+    )''')
+
+# 2: Index reservations for conflict lookups and the admin listings
+def add_reservation_indexes(db):
+    db.execute('CREATE INDEX IF NOT EXISTS reservations_item_time ON reservations (item, start_time, end_time)')
+    db.execute('CREATE INDEX IF NOT EXISTS reservations_status_start ON reservations (status, start_time)')
+    db.execute('CREATE INDEX IF NOT EXISTS reservations_status_end ON reservations (status, end_time)')
+    # Lent reservations used to be stored as 'lended'
+    db.execute("UPDATE reservations SET status = 'lent' WHERE status = 'lended'")
+
+# 3: Reference users and items by integer id instead of copying their names
+def use_integer_keys(db):
+    db.execute('''CREATE TABLE reservations_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+        item_id INTEGER NOT NULL REFERENCES items (id) ON DELETE CASCADE,
+        start_time INTEGER NOT NULL,
+        end_time INTEGER NOT NULL,
+        status TEXT NOT NULL
+    )''')
+    # Copy reservations whose user and item still exist
+    migrated = db.execute('''INSERT INTO reservations_new (id, user_id, item_id, start_time, end_time, status)
+        SELECT reservations.id, users.id, items.id, reservations.start_time, reservations.end_time, reservations.status
+        FROM reservations
+        JOIN users ON users.username = reservations.username
+        JOIN items ON items.name = reservations.item''').rowcount
+    # Keep orphans, whose user or item no longer exists, as they were so they can be checked by hand
+    db.execute('''CREATE TABLE reservations_orphaned AS SELECT * FROM reservations
+        WHERE NOT EXISTS (SELECT 1 FROM users WHERE users.username = reservations.username)
+        OR NOT EXISTS (SELECT 1 FROM items WHERE items.name = reservations.item)''')
+    orphaned = db.execute('SELECT COUNT(*) FROM reservations_orphaned').fetchone()[0]
+    if orphaned:
+        logger.warning('Migrated %d reservations to integer keys, %d reservations whose user or item no longer exists '
+            'were moved to reservations_orphaned', migrated, orphaned)
+    elif migrated:
+        logger.warning('Migrated %d reservations to integer keys', migrated)
+    # Keep reservation ids increasing past ones that were already handed out
+    sequence = db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'reservations'").fetchone()
+    db.execute('DROP TABLE reservations')
+    db.execute('ALTER TABLE reservations_new RENAME TO reservations')
+    if sequence is not None:
+        db.execute("UPDATE sqlite_sequence SET seq = max(seq, ?) WHERE name = 'reservations'", (sequence[0],))
+    db.execute('CREATE INDEX reservations_item_time ON reservations (item_id, start_time, end_time)')
+    db.execute('CREATE INDEX reservations_user ON reservations (user_id)')
+    db.execute('CREATE INDEX reservations_status_start ON reservations (status, start_time)')
+    db.execute('CREATE INDEX reservations_status_end ON reservations (status, end_time)')
+
+# 4: Keep finished reservations in a separate table so the reservations table only holds current bookings
+def add_archive(db):
+    db.execute('''CREATE TABLE reservations_archive (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+        item_id INTEGER NOT NULL REFERENCES items (id) ON DELETE CASCADE,
+        start_time INTEGER NOT NULL,
+        end_time INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        archived_at INTEGER NOT NULL
+    )''')
+    db.execute('CREATE INDEX reservations_archive_user ON reservations_archive (user_id, start_time)')
+    db.execute('CREATE INDEX reservations_archive_item ON reservations_archive (item_id, start_time)')
+
+# 5: Let an item stand for several identical units
+def add_item_quantity(db):
+    db.execute('ALTER TABLE items ADD COLUMN quantity INTEGER NOT NULL DEFAULT 1')
+
+# 6: Store recurring reservations as rules that repeat a reservation every period seconds
+def add_recurring_reservations(db):
+    db.execute('''CREATE TABLE recurring_reservations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+        item_id INTEGER NOT NULL REFERENCES items (id) ON DELETE CASCADE,
+        start_time INTEGER NOT NULL,
+        end_time INTEGER NOT NULL,
+        period INTEGER NOT NULL,
+        until INTEGER NOT NULL
+    )''')
+    db.execute('CREATE INDEX recurring_reservations_item ON recurring_reservations (item_id, start_time)')
+    db.execute('CREATE INDEX recurring_reservations_user ON recurring_reservations (user_id)')
+
+# 7: Keep archived reservations when their item is removed, like the archives of shard files
+def keep_archive_of_removed_items(db):
+    db.execute('''CREATE TABLE reservations_archive_new (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+        item_id INTEGER NOT NULL,
+        start_time INTEGER NOT NULL,
+        end_time INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        archived_at INTEGER NOT NULL
+    )''')
+    db.execute('INSERT INTO reservations_archive_new SELECT id, user_id, item_id, start_time, end_time, status, archived_at FROM reservations_archive')
+    db.execute('DROP TABLE reservations_archive')
+    db.execute('ALTER TABLE reservations_archive_new RENAME TO reservations_archive')
+    db.execute('CREATE INDEX reservations_archive_user ON reservations_archive (user_id, start_time)')
+    db.execute('CREATE INDEX reservations_archive_item ON reservations_archive (item_id, start_time)')
+
+# All migrations in order, a database at version N has the first N applied
+migrations = [
+    create_tables,
+    add_reservation_indexes,
+    use_integer_keys,
+    add_archive,
+    add_item_quantity,
+    add_recurring_reservations,
+    keep_archive_of_removed_items,
+]
+
+
+### Shard migrations ###
+# Shard files only hold reservations. Users and items live in the main database,
+# so the ids can't be foreign keys and removing an item deletes its reservations explicitly.
+
+# 1: Create the reservation tables
+def create_shard_tables(db):
+    db.execute('''CREATE TABLE reservations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        item_id INTEGER NOT NULL,
+        start_time INTEGER NOT NULL,
+        end_time INTEGER NOT NULL,
+        status TEXT NOT NULL
+    )''')
+    db.execute('CREATE INDEX reservations_item_time ON reservations (item_id, start_time, end_time)')
+    db.execute('CREATE INDEX reservations_user ON reservations (user_id)')
+    db.execute('CREATE INDEX reservations_status_start ON reservations (status, start_time)')
+    db.execute('CREATE INDEX reservations_status_end ON reservations (status, end_time)')
+    db.execute('''CREATE TABLE reservations_archive (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        item_id INTEGER NOT NULL,
+        start_time INTEGER NOT NULL,
+        end_time INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        archived_at INTEGER NOT NULL
+    )''')
+    db.execute('CREATE INDEX reservations_archive_user ON reservations_archive (user_id, start_time)')
+    db.execute('CREATE INDEX reservations_archive_item ON reservations_archive (item_id, start_time)')
+
+# 2: Store recurring reservations as rules, like migration 6 of the main database
+def create_shard_recurring_reservations(db):
+    db.execute('''CREATE TABLE recurring_reservations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        item_id INTEGER NOT NULL,
+        start_time INTEGER NOT NULL,
+        end_time INTEGER NOT NULL,
+        period INTEGER NOT NULL,
+        until INTEGER NOT NULL
+    )''')
+    db.execute('CREATE INDEX recurring_reservations_item ON recurring_reservations (item_id, start_time)')
+    db.execute('CREATE INDEX recurring_reservations_user ON recurring_reservations (user_id)')
+
+# All shard migrations in order
+shard_migrations = [
+    create_shard_tables,
+    create_shard_recurring_reservations,
+]
+
+
+### Running migrations ###
+
+# Get the schema version of a database
+def get_version(db):
+    return db.execute('PRAGMA user_version').fetchone()[0]
+
+# Apply all migrations newer than the database's version
+def migrate(db, steps=migrations):
+    version = get_version(db)
+    for number, migration in enumerate(steps, start=1):
+        if number <= version:
+            continue
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            migration(db)
+            db.execute('PRAGMA user_version = {}'.format(number))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+    return get_version(db)
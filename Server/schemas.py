@@ -0,0 +1,157 @@
+# This is meant to be imported and used as a module.
+# It is not meant to be run directly.
+
+# Declarative parsing of request fields.
+# A route lists the fields it takes once, as a Schema of typed fields, and the fields of a form or JSON body
+# are parsed and checked in one pass into a namedtuple, or into a list of errors naming each bad field.
+
+### Imports for schemas ###
+import collections
+import datetime
+
+# Format of readable times
+time_format = '%Y-%m-%d %H:%M:%S'
+# Latest timestamp a time field accepts
+max_timestamp = 2**32
+
+
+### Times ###
+
+# Convert a readable local time to a timestamp
+# Times in the exact YYYY-MM-DD HH:MM:SS layout are read by slicing, anything else falls back to strptime
+def parse_time(value):
+    if len(value) == 19 and value[4] == '-' and value[7] == '-' and value[10] == ' ' and value[13] == ':' and value[16] == ':':
+        parts = (value[0:4], value[5:7], value[8:10], value[11:13], value[14:16], value[17:19])
+        if all(part.isdigit() for part in parts):
+            return int(datetime.datetime(*map(int, parts)).timestamp())
+    return int(datetime.datetime.strptime(value, time_format).timestamp())
+
+
+### Fields ###
+# Each field reads one value by name. A missing or empty value is an error if the field is required,
+# otherwise the field's default. parse(value) returns the typed value or raises ValueError with the reason.
+
+class Field:
+    def __init__(self, name, required=True, default=None):
+        self.name = name
+        self.required = required
+        self.default = default
+
+    def parse(self, value):
+        return value
+
+    # Error for a value of the wrong type or format
+    def invalid(self):
+        return ValueError('Invalid {}'.format(self.name))
+
+# Non-empty string, optionally one of some choices
+class Text(Field):
+    def __init__(self, name, required=True, default=None, choices=None):
+        super().__init__(name, required, default)
+        self.choices = choices
+
+    def parse(self, value):
+        if not isinstance(value, str):
+            raise self.invalid()
+        if self.choices is not None and value not in self.choices:
+            raise ValueError('{} must be one of {}'.format(self.name, ', '.join(self.choices)))
+        return value
+
+# Integer given as a number or a string, or by one of the names in names
+class Integer(Field):
+    def __init__(self, name, required=True, default=None, minimum=None, names=None):
+        super().__init__(name, required, default)
+        self.minimum = minimum
+        self.names = names or {}
+
+    def parse(self, value):
+        if isinstance(value, str) and value in self.names:
+            return self.names[value]
+        if isinstance(value, bool) or not isinstance(value, (int, str)):
+            raise self.invalid()
+        try:
+            value = int(value)
+        except ValueError:
+            raise self.invalid()
+        if self.minimum is not None and value < self.minimum:
+            raise ValueError('{} must be at least {}'.format(self.name, self.minimum))
+        return value
+
+# Readable local time, or a timestamp in a JSON body
+class Time(Field):
+    def parse(self, value):
+        if isinstance(value, str):
+            try:
+                value = parse_time(value)
+            except ValueError:
+                raise self.invalid()
+        elif isinstance(value, bool) or not isinstance(value, int):
+            raise self.invalid()
+        if value < 0 or value > max_timestamp:
+            raise ValueError('{} is out of range'.format(self.name))
+        return value
+
+# true or false, also given as 1 or 0
+class Boolean(Field):
+    def __init__(self, name, default=False):
+        super().__init__(name, False, default)
+
+    def parse(self, value):
+        if value in (True, 'true', '1'):
+            return True
+        if value in (False, 'false', '0'):
+            return False
+        raise self.invalid()
+
+# List of names, given as a list or as one comma separated string
+class Names(Field):
+    def __init__(self, name, required=False):
+        super().__init__(name, required)
+
+    def parse(self, value):
+        if isinstance(value, str):
+            value = [name.strip() for name in value.split(',')]
+        if not isinstance(value, list) or not all(isinstance(name, str) for name in value):
+            raise self.invalid()
+        return tuple(name for name in value if name) or None
+
+# List of any values, like objects parsed with their own schema
+class List(Field):
+    def parse(self, value):
+        if not isinstance(value, list):
+            raise ValueError('{} must be a list'.format(self.name))
+        return value
+
+
+### Schemas ###
+
+# Fields taken by a route
+# error is the message reported for any invalid field, the first field's error if not given
+class Schema:
+    def __init__(self, *fields, error=None):
+        self.fields = fields
+        self.error = error
+        # Parsed fields are returned as a namedtuple with an attribute per field
+        self.type = collections.namedtuple('Fields', [field.name for field in fields])
+
+    # Parse the fields of a form or JSON object
+    # Returns (fields, None) or (None, errors) where errors lists {'field': name, 'error': reason} of every bad field
+    def parse(self, fields):
+        if not hasattr(fields, 'get'):
+            return None, [{'field': None, 'error': 'Body must be an object'}]
+        values = []
+        errors = []
+        for field in self.fields:
+            value = fields.get(field.name)
+            if value is None or value == '':
+                if field.required:
+                    errors.append({'field': field.name, 'error': 'Missing {}'.format(field.name)})
+                values.append(field.default)
+                continue
+            try:
+                values.append(field.parse(value))
+            except ValueError as e:
+                errors.append({'field': field.name, 'error': str(e)})
+        if errors:
+            return None, errors
+        return self.type(*values), None
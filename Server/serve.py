@@ -0,0 +1,46 @@
+# Production server for the reservation API
+# Password hashing runs on a pool of worker processes while requests are served on threads,
+# so cheap requests like /items don't queue behind logins and registrations.
+# Uses waitress if it is installed, otherwise werkzeug's threaded server.
+# Run with: python serve.py [--host HOST] [--port PORT] [--threads N] [--hash-workers N]
+import argparse
+from werkzeug.serving import run_simple
+# waitress is optional
+try:
+    import waitress
+except ImportError:
+    waitress = None
+# Import hashing.py
+import hashing
+
+
+def main():
+    # Get command line arguments
+    parser = argparse.ArgumentParser(description='Run the reservation server in production mode')
+    parser.add_argument('--host', help='Address to listen on')
+    parser.add_argument('--port', type=int, help='Port to listen on')
+    parser.add_argument('--threads', type=int, help='Request threads when serving with waitress')
+    parser.add_argument('--hash-workers', type=int, help='Password hashing processes, 0 for one per CPU')
+    args = parser.parse_args()
+    # Import the app only in the server process, hashing workers don't need it
+    import app
+    # Command line arguments override the server section of the config file
+    server_config = app.config.get('server', {})
+    host = args.host or server_config.get('host', '0.0.0.0')
+    port = args.port or server_config.get('port', 6969)
+    threads = args.threads or server_config.get('threads', 16)
+    hash_workers = args.hash_workers if args.hash_workers is not None else server_config.get('hash_workers', 0)
+    # Start hashing workers before serving requests
+    hashing.start_pool(hash_workers)
+    try:
+        if waitress is not None:
+            waitress.serve(app.app, host=host, port=port, threads=threads)
+        else:
+            # Serve each request on its own thread, without the debugger or reloader
+            run_simple(host, port, app.app, threaded=True, use_reloader=False, use_debugger=False)
+    finally:
+        hashing.stop_pool()
+
+
+if __name__ == '__main__':
+    main()
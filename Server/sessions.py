@@ -0,0 +1,74 @@
+# This is meant to be imported and used as a module.
+# It is not meant to be run directly.
+
+### Imports for sessions ###
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+
+
+### Session store ###
+# Issues signed session tokens of the form <session id>.<expiry>.<signature>.
+# Tokens are also tracked server-side so they can be revoked before they expire.
+class SessionStore:
+    def __init__(self, secret_key, lifetime):
+        # Key used to sign tokens
+        self.secret_key = secret_key.encode('utf-8')
+        # Seconds a token stays valid
+        self.lifetime = lifetime
+        # Session id -> (user, expiry)
+        self.sessions = {}
+        # Number of sessions that triggers the next prune of expired sessions
+        self.prune_at = 1024
+        # Guards the sessions dictionary
+        self.lock = threading.Lock()
+
+    # Sign the session id and expiry
+    def sign(self, session_id, expiry):
+        message = '{}.{}'.format(session_id, expiry).encode('utf-8')
+        return hmac.new(self.secret_key, message, hashlib.sha256).hexdigest()
+
+    # Create a new token for an authenticated user
+    def issue(self, user):
+        session_id = secrets.token_urlsafe(16)
+        expiry = int(time.time()) + self.lifetime
+        with self.lock:
+            # Prune expired sessions once the store has doubled in size
+            if len(self.sessions) >= self.prune_at:
+                self.prune()
+                self.prune_at = max(1024, 2 * len(self.sessions))
+            self.sessions[session_id] = (user, expiry)
+        # Return token and its expiry
+        return '{}.{}.{}'.format(session_id, expiry, self.sign(session_id, expiry)), expiry
+
+    # Get the user of a valid token, or None
+    def verify(self, token):
+        # Split token into its parts
+        parts = token.split('.')
+        if len(parts) != 3 or not parts[1].isdigit():
+            return None
+        session_id, expiry, signature = parts
+        # Check signature and expiry before looking up the session
+        if not hmac.compare_digest(signature, self.sign(session_id, expiry)):
+            return None
+        if int(expiry) < time.time():
+            return None
+        # Check that the session has not been revoked
+        session = self.sessions.get(session_id)
+        if session is None:
+            return None
+        return session[0]
+
+    # Revoke a token, returns True if it was active
+    def revoke(self, token):
+        session_id = token.split('.')[0]
+        with self.lock:
+            return self.sessions.pop(session_id, None) is not None
+
+    # Drop expired sessions
+    def prune(self):
+        now = time.time()
+        for session_id in [session_id for session_id, session in self.sessions.items() if session[1] < now]:
+            del self.sessions[session_id]
@@ -0,0 +1,141 @@
+# This is meant to be imported and used as a module.
+# It is not meant to be run directly.
+
+### Imports for shards ###
+import os
+import sqlite3
+# Import database.py
+import database
+# Import migrations.py
+import migrations
+# Import writer.py
+import writer
+
+# Columns copied when a reservation moves between shards
+table_columns = {
+    'reservations': ('id', 'user_id', 'item_id', 'start_time', 'end_time', 'status'),
+    'reservations_archive': ('id', 'user_id', 'item_id', 'start_time', 'end_time', 'status', 'archived_at'),
+    'recurring_reservations': ('id', 'user_id', 'item_id', 'start_time', 'end_time', 'period', 'until'),
+}
+# Tables whose ids are handed out by next_id, so they stay unique across shards
+sequenced_tables = ('reservations', 'recurring_reservations')
+
+
+### Shard set ###
+# Partitions reservations across database files by item, so writes to different items
+# don't wait for the same SQLite write lock.
+# Item i belongs to shard i % count. Shard 0 is the main database, which also holds users and items,
+# shard k > 0 is its own file with its own pool and writer thread, so one shard behaves exactly like
+# the unsharded database. New reservation ids in shard k are congruent to k modulo count, which keeps
+# ids unique across shards. Pooled shard connections attach the main database as 'core' so reads can
+# join users and items, writer connections don't, so a shard transaction never locks the main database.
+class ShardSet:
+    def __init__(self, main_pool, main_writer, count=1, path_template='./Data/shard{}.db', max_batch=64):
+        # Number of shards
+        self.count = max(1, count)
+        # Path of shard k > 0 is path_template.format(k)
+        self.path_template = path_template
+        # Pool and writer of each shard, configured like the main ones
+        self.pools = [main_pool]
+        self.writers = [main_writer]
+        for shard in range(1, self.count):
+            pool = database.ConnectionPool(path_template.format(shard),
+                size=main_pool.size,
+                synchronous=main_pool.synchronous,
+                cache_size=main_pool.cache_size,
+                cached_statements=main_pool.cached_statements,
+                on_query=main_pool.on_query,
+                on_open=main_pool.on_open,
+                attach={'core': main_pool.path})
+            self.pools.append(pool)
+            self.writers.append(writer.WriteQueue(pool, max_batch, main_writer.timeout, main_writer.on_commit_error))
+
+    # Get the shard an item belongs to
+    def shard_of(self, item_id):
+        return item_id % self.count
+
+    # Get the pool and writer of an item's shard
+    def pool(self, item_id):
+        return self.pools[self.shard_of(item_id)]
+    def writer(self, item_id):
+        return self.writers[self.shard_of(item_id)]
+
+    # Get the id for a new row of an item in a sequenced table, must run on the shard's writer
+    def next_id(self, db_cur, item_id, table='reservations'):
+        shard = self.shard_of(item_id)
+        row = db_cur.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()
+        last = row[0] if row is not None else 0
+        # Smallest id above the last one that is congruent to the shard number
+        return last + ((shard - last) % self.count or self.count)
+
+    # Create or upgrade the schema of every shard file, the main database is migrated separately
+    def migrate(self):
+        for pool in self.pools[1:]:
+            db = pool.open(attached=False)
+            try:
+                migrations.migrate(db, migrations.shard_migrations)
+            finally:
+                db.close()
+
+    # Move reservations stored in the wrong shard, which happens after the number of shards changed.
+    # Shard files beyond the current count are drained and deleted.
+    # Must run before the writers are started, returns the number of reservations moved.
+    def rebalance(self):
+        dbs = [pool.open(attached=False) for pool in self.pools]
+        stale = []
+        shard = self.count
+        while os.path.exists(self.path_template.format(shard)):
+            stale.append(self.path_template.format(shard))
+            dbs.append(sqlite3.connect(stale[-1]))
+            # Bring the file up to date so every table can be read from it
+            migrations.migrate(dbs[-1], migrations.shard_migrations)
+            shard += 1
+        moved = 0
+        try:
+            for source, db in enumerate(dbs):
+                for table, columns in table_columns.items():
+                    # Rows of stale files all have to move
+                    if source < self.count:
+                        rows = db.execute('SELECT {} FROM {} WHERE item_id % ? != ?'.format(', '.join(columns), table), (self.count, source)).fetchall()
+                    else:
+                        rows = db.execute('SELECT {} FROM {}'.format(', '.join(columns), table)).fetchall()
+                    if not rows:
+                        continue
+                    # Copy to the owning shards first, so a crash leaves duplicates rather than losing rows
+                    targets = {}
+                    for row in rows:
+                        targets.setdefault(self.shard_of(row[2]), []).append(row)
+                    for target, target_rows in targets.items():
+                        dbs[target].executemany('INSERT OR REPLACE INTO {} ({}) VALUES ({})'.format(table, ', '.join(columns), ', '.join('?' * len(columns))), target_rows)
+                        dbs[target].commit()
+                    ids = [row[0] for row in rows]
+                    for index in range(0, len(ids), 500):
+                        chunk = ids[index:index + 500]
+                        db.execute('DELETE FROM {} WHERE id IN ({})'.format(table, ', '.join('?' * len(chunk))), chunk)
+                    db.commit()
+                    moved += len(rows)
+            # Continue every shard's ids after the highest id handed out by any shard
+            for table in sequenced_tables:
+                last = 0
+                for db in dbs:
+                    row = db.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()
+                    if row is not None:
+                        last = max(last, row[0])
+                for db in dbs[:self.count]:
+                    if db.execute('UPDATE sqlite_sequence SET seq = max(seq, ?) WHERE name = ?', (last, table)).rowcount == 0:
+                        db.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (table, last))
+                    db.commit()
+        finally:
+            for db in dbs:
+                db.close()
+        # Drained files are no longer needed
+        for path in stale:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+        return moved
+
+    # Start every shard's writer thread
+    def start(self):
+        for write_queue in self.writers:
+            write_queue.start()
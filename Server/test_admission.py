@@ -0,0 +1,88 @@
+# Tests for admission.py
+# Run with: python -m pytest (or python -m unittest) from the Server folder
+import unittest
+# Import admission.py
+import admission
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class RateLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.limiter = admission.RateLimiter(2, 3, max_keys=2, clock=self.clock)
+
+    # A burst is let through, then requests wait for tokens to come back
+    def test_burst_and_refill(self):
+        self.assertEqual([self.limiter.take('a') for index in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(self.limiter.take('a'), 0.5)
+        self.clock.now += 0.5
+        self.assertEqual(self.limiter.take('a'), 0)
+        # Buckets never hold more than burst tokens
+        self.clock.now += 100
+        self.assertEqual([self.limiter.take('a') for index in range(3)], [0, 0, 0])
+        self.assertGreater(self.limiter.take('a'), 0)
+
+    # Keys have their own buckets
+    def test_keys(self):
+        for index in range(3):
+            self.limiter.take('a')
+        self.assertGreater(self.limiter.take('a'), 0)
+        self.assertEqual(self.limiter.take('b'), 0)
+
+    # Only the most recently seen keys are kept, a forgotten key starts with a full bucket
+    def test_max_keys(self):
+        for index in range(3):
+            self.limiter.take('a')
+        self.limiter.take('b')
+        self.limiter.take('c')
+        self.assertEqual(list(self.limiter.buckets), ['b', 'c'])
+        self.assertEqual(self.limiter.take('a'), 0)
+
+    def test_disabled(self):
+        limiter = admission.RateLimiter(0, 1, clock=self.clock)
+        self.assertEqual([limiter.take('a') for index in range(10)], [0] * 10)
+        self.assertEqual(len(limiter.buckets), 0)
+
+
+class KeysTest(unittest.TestCase):
+    # Failed passwords for a user don't use up the budget the user has from elsewhere
+    def test_attempts_apart_from_user(self):
+        limiter = admission.RateLimiter(1, 2, clock=Clock())
+        for index in range(5):
+            limiter.take(admission.attempt_key('10.0.0.1', 'admin'))
+        self.assertGreater(limiter.take(admission.attempt_key('10.0.0.1', 'admin')), 0)
+        self.assertEqual(limiter.take(admission.attempt_key('10.0.0.2', 'admin')), 0)
+        self.assertEqual(limiter.take(admission.user_key(1)), 0)
+
+    # A user has one key, whichever way the request authenticated
+    def test_one_key_per_user(self):
+        self.assertEqual(admission.user_key(1), admission.user_key(1))
+        self.assertNotEqual(admission.user_key(1), admission.user_key(2))
+        self.assertNotEqual(admission.user_key(1), admission.attempt_key('10.0.0.1', 1))
+
+
+class ConcurrencyLimitTest(unittest.TestCase):
+    def test_limit(self):
+        limit = admission.ConcurrencyLimit(2)
+        self.assertTrue(limit.acquire())
+        self.assertTrue(limit.acquire())
+        self.assertFalse(limit.acquire())
+        self.assertEqual(limit.active, 2)
+        limit.release()
+        self.assertTrue(limit.acquire())
+
+    def test_unlimited(self):
+        limit = admission.ConcurrencyLimit(0)
+        self.assertTrue(all(limit.acquire() for index in range(100)))
+        self.assertEqual(limit.active, 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+# Tests for analytics.py
+# Run with: python -m pytest (or python -m unittest) from the Server folder
+import os
+import time
+import unittest
+# Import analytics.py
+import analytics
+
+
+@unittest.skipIf(analytics.numpy is None, 'NumPy is not installed')
+class UtilizationTest(unittest.TestCase):
+    # Occurrences of recurring reservations count as reserved time, but not towards no-shows
+    def test_untracked_rows(self):
+        rows = analytics.numpy.array([[1, 0, 99, 0], [1, 100, 199, 1], [1, 200, 399, -1]], dtype=analytics.numpy.int64)
+        result = analytics.utilization([(1, 'scope', 1)], rows, 0, 399, 200, now=1000)
+        self.assertEqual(result['items']['scope']['reservations'], 3)
+        self.assertEqual(result['items']['scope']['occupancy'], [1.0, 1.0])
+        self.assertEqual(result['items']['scope']['no_show_rate'], 0.5)
+
+
+@unittest.skipIf(analytics.numpy is None, 'NumPy is not installed')
+class HeatmapTest(unittest.TestCase):
+    # Run in a time zone with daylight saving time
+    def setUp(self):
+        self.zone = os.environ.get('TZ')
+        os.environ['TZ'] = 'America/New_York'
+        time.tzset()
+
+    def tearDown(self):
+        if self.zone is None:
+            del os.environ['TZ']
+        else:
+            os.environ['TZ'] = self.zone
+        time.tzset()
+
+    # The offset changes at the second clocks are changed
+    def test_offset_changes(self):
+        # 2025-03-01 to 2025-12-01 UTC, clocks went forward on 2025-03-09 07:00 UTC and back on 2025-11-02 06:00 UTC
+        changes, offsets = analytics.offset_changes(1740787200, 1764547200)
+        self.assertEqual(changes.tolist(), [1740787200, 1741503600, 1762063200])
+        self.assertEqual(offsets.tolist(), [-18000, -14400, -18000])
+
+    # Every hour lands in the weekday and hour of its own local time, also after clocks change
+    def test_heatmap_across_change(self):
+        numpy = analytics.numpy
+        start_time = 1741132800
+        end_time = start_time + 14 * 86400 - 1
+        # One reservation per hour, each a second longer so every hour can be told apart
+        starts = numpy.arange(start_time, end_time, 3600, dtype=numpy.int64)
+        rows = numpy.stack([numpy.ones(len(starts), dtype=numpy.int64), starts, starts + numpy.arange(len(starts)), numpy.ones(len(starts), dtype=numpy.int64)], axis=1)
+        heatmap = numpy.array(analytics.utilization([(1, 'scope', 1)], rows, start_time, end_time, 86400, now=0)['heatmap'])
+        reserved = numpy.zeros((7, 24))
+        available = numpy.zeros((7, 24))
+        for index, start in enumerate(starts.tolist()):
+            local = time.localtime(start)
+            reserved[local.tm_wday, local.tm_hour] += index + 1
+            available[local.tm_wday, local.tm_hour] += 3600
+        expected = numpy.divide(reserved, available, out=numpy.zeros((7, 24)), where=available > 0)
+        self.assertTrue(numpy.allclose(heatmap, expected, atol=1e-4))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+# Tests for archive.py
+# Run with: python -m pytest (or python -m unittest) from the Server folder
+import os
+import tempfile
+import time
+import unittest
+# Import archive.py
+import archive
+# Import database.py
+import database
+# Import migrations.py
+import migrations
+# Import writer.py
+import writer
+
+
+class ArchiverTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.pool = database.ConnectionPool(os.path.join(self.folder.name, 'shard.db'))
+        self.now = now = int(time.time())
+        with self.pool.connection() as db:
+            migrations.migrate(db, migrations.shard_migrations)
+            db.executemany('INSERT INTO reservations (id, user_id, item_id, start_time, end_time, status) VALUES (?, 1, 1, ?, ?, ?)', [
+                # Finished long ago
+                (1, now - 10000, now - 9000, 'returned'),
+                (2, now - 8000, now - 7000, 'pending'),
+                # Overdue, stays listed until returned
+                (3, now - 6000, now - 5000, 'lent'),
+                # Ended within the retention
+                (4, now - 2000, now - 1000, 'returned'),
+                # Ahead
+                (5, now + 1000, now + 2000, 'pending'),
+            ])
+            db.commit()
+        self.queue = writer.WriteQueue(self.pool, timeout=5)
+        self.queue.start()
+        self.archived = []
+        self.archiver = archive.Archiver(self.queue, retention=3600, interval=0, batch_size=1, on_archive=self.archived.extend)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def ids(self, table):
+        with self.pool.connection() as db:
+            return [row[0] for row in db.execute('SELECT id FROM {} ORDER BY id'.format(table))]
+
+    # Finished reservations are moved in batches, the rest stays
+    def test_archive(self):
+        self.assertEqual(self.archiver.archive(), 2)
+        self.assertEqual(self.ids('reservations'), [3, 4, 5])
+        self.assertEqual(self.ids('reservations_archive'), [1, 2])
+        self.assertEqual(sorted(self.archived), [1, 2])
+        self.assertEqual(self.archiver.archived, 2)
+        # Nothing left to do
+        self.assertEqual(self.archiver.archive(), 0)
+
+    # Archived reservations keep their times and status and stay in the history
+    def test_query(self):
+        self.archiver.archive()
+        with self.pool.connection() as db:
+            archived = db.execute('SELECT user_id, item_id, start_time, end_time, status FROM reservations_archive WHERE id = 2').fetchone()
+            history = db.execute('SELECT id FROM reservations UNION ALL SELECT id FROM reservations_archive ORDER BY id').fetchall()
+        self.assertEqual(archived, (1, 1, self.now - 8000, self.now - 7000, 'pending'))
+        self.assertEqual([row[0] for row in history], [1, 2, 3, 4, 5])
+
+    # Only pending reservations are expired, they are archived as expired
+    def test_expire(self):
+        self.assertEqual(self.archiver.expire([2, 3, 5, 42]), [2, 5])
+        self.assertEqual(self.ids('reservations'), [1, 3, 4])
+        with self.pool.connection() as db:
+            self.assertEqual(db.execute('SELECT id, status FROM reservations_archive ORDER BY id').fetchall(), [(2, 'expired'), (5, 'expired')])
+        self.assertEqual(self.archived, [2, 5])
+
+    # A failing run is logged and the thread keeps going
+    def test_run_error(self):
+        self.archiver.interval = 0.01
+        def fail():
+            self.archiver.stop()
+            raise RuntimeError('disk gone')
+        self.archiver.archive = fail
+        with self.assertLogs('archive', 'ERROR'):
+            self.archiver.run()
+
+
+if __name__ == '__main__':
+    unittest.main()
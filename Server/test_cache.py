@@ -0,0 +1,64 @@
+# Tests for cache.py
+# Run with: python -m pytest (or python -m unittest) from the Server folder
+import unittest
+# Import cache.py
+import cache
+
+
+class AvailabilityCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = cache.AvailabilityCache(max_entries=2, ttl=60)
+
+    def put(self, start_time, end_time, value):
+        self.cache.put(start_time, end_time, value, self.cache.generation)
+
+    def test_get_put(self):
+        self.assertIsNone(self.cache.get(0, 100))
+        self.put(0, 100, [{'name': 'a'}])
+        self.assertEqual(self.cache.get(0, 100), [{'name': 'a'}])
+        self.assertEqual(self.cache.stats(), {'entries': 1, 'hits': 1, 'misses': 1, 'invalidations': 0})
+
+    # The least recently used entry is evicted first
+    def test_lru(self):
+        self.put(0, 100, [])
+        self.put(100, 200, [])
+        self.cache.get(0, 100)
+        self.put(200, 300, [])
+        self.assertEqual(list(self.cache.entries), [(0, 100), (200, 300)])
+
+    # Expired entries are dropped when read
+    def test_ttl(self):
+        self.cache.ttl = -1
+        self.put(0, 100, [])
+        self.assertIsNone(self.cache.get(0, 100))
+        self.assertEqual(len(self.cache.entries), 0)
+
+    # Only entries whose window overlaps the change are dropped, bounds are inclusive
+    def test_invalidate(self):
+        self.put(0, 100, [])
+        self.put(200, 300, [])
+        self.cache.invalidate(100, 150)
+        self.assertEqual(list(self.cache.entries), [(200, 300)])
+        self.cache.invalidate(150, 199)
+        self.assertEqual(list(self.cache.entries), [(200, 300)])
+        self.assertEqual(self.cache.stats()['invalidations'], 1)
+
+    # Entries listing a changed item are dropped
+    def test_invalidate_item(self):
+        self.put(0, 100, [{'name': 'a'}])
+        self.put(200, 300, [{'name': 'b'}])
+        self.cache.invalidate_item('a')
+        self.assertEqual(list(self.cache.entries), [(200, 300)])
+        self.cache.clear()
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+    # A value computed before an invalidation is not stored
+    def test_stale_put(self):
+        generation = self.cache.generation
+        self.cache.invalidate(500, 600)
+        self.cache.put(0, 100, [], generation)
+        self.assertIsNone(self.cache.get(0, 100))
+
+
+if __name__ == '__main__':
+    unittest.main()
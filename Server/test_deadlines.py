@@ -0,0 +1,84 @@
+# Tests for deadlines.py
+# Run with: python -m pytest (or python -m unittest) from the Server folder
+import unittest
+# Import deadlines.py
+import deadlines
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class DeadlineTrackerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock(1000)
+        self.tracker = deadlines.DeadlineTracker(expire_after=100, clock=self.clock)
+        # (reservation_id, item, start_time, end_time, status)
+        self.tracker.load([
+            (1, 1, 500, 900, 'lent'),
+            (2, 1, 900, 1100, 'lent'),
+            (3, 2, 800, 900, 'pending'),
+            (4, 2, 1200, 1300, 'pending'),
+            (5, 3, 100, 200, 'returned'),
+        ])
+
+    # Deadlines already passed when loaded are listed right away, returned reservations are not tracked
+    def test_load(self):
+        self.assertEqual(self.tracker.get_overdue(), [(900, 1)])
+        self.assertEqual(self.tracker.get_late(), [(800, 3)])
+        self.assertEqual(self.tracker.stats(), {'overdue': 1, 'late': 1, 'tracked': 4})
+
+    # Reservations move to the sets once their deadline passes
+    def test_advance(self):
+        self.clock.now = 1250
+        self.assertEqual(self.tracker.get_overdue(), [(900, 1), (1100, 2)])
+        self.assertEqual(self.tracker.get_late(), [(800, 3), (1200, 4)])
+
+    # Status changes and removals take reservations out of the sets and the heaps
+    def test_update_and_discard(self):
+        # Lent out, so no longer late but not overdue yet
+        self.tracker.update(3, 800, 1500, 'lent')
+        self.assertEqual(self.tracker.get_late(), [])
+        self.assertEqual(self.tracker.get_overdue(), [(900, 1)])
+        self.tracker.update(1, 500, 900, 'returned')
+        self.tracker.discard(2)
+        self.tracker.discard(42)
+        self.clock.now = 2000
+        self.assertEqual(self.tracker.get_overdue(), [(1500, 3)])
+        self.assertEqual(self.tracker.get_late(), [(1200, 4)])
+        self.assertEqual(self.tracker.stats()['tracked'], 2)
+
+    # Pages continue after the cursor
+    def test_paging(self):
+        self.tracker.load([(index, 1, index, 2000, 'pending') for index in range(10)])
+        first = self.tracker.get_late(limit=4)
+        self.assertEqual(first, [(index, index) for index in range(4)])
+        self.assertEqual(self.tracker.get_late(cursor=first[-1], limit=4), [(index, index) for index in range(4, 8)])
+        self.assertEqual(self.tracker.get_late(cursor=(9, 9)), [])
+
+    # Late reservations are due once expire_after seconds passed since their start
+    def test_expiry(self):
+        self.assertEqual(self.tracker.due_for_expiry(), [3])
+        self.tracker.discard(3)
+        self.assertEqual(self.tracker.due_for_expiry(), [])
+        self.assertEqual(self.tracker.next_expiry(), 1200 + 100 - 1000)
+        self.tracker.update(3, 800, 900, 'pending')
+        self.clock.now = 1350
+        self.assertEqual(self.tracker.due_for_expiry(), [3, 4])
+        self.assertEqual(self.tracker.due_for_expiry(limit=1), [3])
+
+    # Stale heap entries are dropped once they outnumber the tracked reservations
+    def test_compact(self):
+        for step in range(200):
+            self.tracker.update(4, 1200 + step, 1300 + step, 'pending')
+        self.assertLessEqual(len(self.tracker.pending_heap), 2 * len(self.tracker.deadlines) + 65)
+        self.clock.now = 1500
+        self.assertEqual(self.tracker.get_late(), [(800, 3), (1399, 4)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+# Tests for feed.py
+# Run with: python -m pytest (or python -m unittest) from the Server folder
+import unittest
+# Import feed.py
+import feed
+
+
+class ChangeFeedTest(unittest.TestCase):
+    def setUp(self):
+        self.feed = feed.ChangeFeed(capacity=3)
+
+    # Events after a sequence number are returned in order
+    def test_resume(self):
+        for index in range(3):
+            self.feed.publish('reservation.created', {'id': index})
+        self.assertEqual([event[0] for event in self.feed.since(1)], [2, 3])
+        self.assertEqual(self.feed.since(3), [])
+
+    # A client that missed events no longer kept has to reload
+    def test_reset_when_events_dropped(self):
+        for index in range(5):
+            self.feed.publish('reservation.created', {'id': index})
+        self.assertIsNone(self.feed.since(1))
+        self.assertEqual([event[0] for event in self.feed.since(2)], [3, 4, 5])
+
+    # A sequence number ahead of the feed is from before a restart
+    def test_reset_when_ahead(self):
+        self.feed.publish('item.added', {'name': 'scope'})
+        self.assertIsNone(self.feed.since(7))
+
+    # Ids carry the epoch of their server run
+    def test_event_id_round_trip(self):
+        self.feed.publish('item.added', {'name': 'scope'})
+        event_id = self.feed.event_id(1)
+        self.assertEqual(self.feed.parse_id(event_id), 1)
+        self.assertEqual(feed.to_json(self.feed, self.feed.since(0)[0])['id'], event_id)
+        self.assertTrue(feed.to_sse(self.feed, self.feed.since(0)[0]).startswith('id: {}\n'.format(event_id)))
+
+    # An id of another server run gets a reset, even if its number is still kept in this run
+    def test_reset_after_restart(self):
+        restarted = feed.ChangeFeed(capacity=100)
+        for index in range(10):
+            restarted.publish('reservation.created', {'id': index})
+        old_id = self.feed.event_id(5)
+        self.assertEqual(restarted.parse_id(old_id), -1)
+        self.assertIsNone(restarted.since(restarted.parse_id(old_id)))
+        self.assertIsNone(restarted.wait(restarted.parse_id(old_id), 0))
+        # Ids without an epoch are from before epochs were added
+        self.assertIsNone(restarted.since(restarted.parse_id('5')))
+
+    # Malformed ids are rejected
+    def test_invalid_id(self):
+        for value in ('abc', 'x:y', '{}:-2'.format(self.feed.epoch)):
+            with self.assertRaises(ValueError):
+                self.feed.parse_id(value)
+
+
+class ParseTimeoutTest(unittest.TestCase):
+    # Timeouts are capped at the longest wait
+    def test_clamp(self):
+        self.assertEqual(feed.parse_timeout(None, 30), 30)
+        self.assertEqual(feed.parse_timeout('5', 30), 5)
+        self.assertEqual(feed.parse_timeout('0', 30), 0)
+        self.assertEqual(feed.parse_timeout('1e9', 30), 30)
+
+    # NaN would make wait_for block forever, infinite and negative waits are rejected too
+    def test_invalid(self):
+        for value in ('nan', 'NaN', 'inf', '-inf', '-1', 'soon', ''):
+            with self.assertRaises(ValueError):
+                feed.parse_timeout(value, 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+# Tests for intervals.py
+# Run with: python -m pytest (or python -m unittest) from the Server folder
+import unittest
+# Import intervals.py
+import intervals
+
+
+class ItemIntervalsTest(unittest.TestCase):
+    def setUp(self):
+        self.item = intervals.ItemIntervals()
+        self.item.add(1, 100, 200)
+        self.item.add(2, 300, 400)
+
+    # Bounds are inclusive, so touching reservations overlap
+    def test_overlap_edges(self):
+        self.assertEqual(self.item.overlapping(200, 250), [(100, 200, 1)])
+        self.assertEqual(self.item.overlapping(250, 300), [(300, 400, 2)])
+        self.assertEqual(self.item.overlapping(201, 299), [])
+        self.assertEqual(self.item.overlapping(0, 99), [])
+        self.assertEqual(self.item.overlapping(0, 1000), [(100, 200, 1), (300, 400, 2)])
+        self.assertFalse(self.item.is_free(200, 250))
+        self.assertTrue(self.item.is_free(201, 299))
+
+    # A long reservation is found from anywhere inside it
+    def test_long_reservation(self):
+        self.item.add(3, 0, 10000)
+        self.assertEqual(self.item.overlapping(5000, 5001), [(0, 10000, 3)])
+        self.assertFalse(self.item.is_free(5000, 5001))
+
+    # A long reservation doesn't widen the scan among short ones
+    def test_length_classes(self):
+        for index in range(1000):
+            self.item.add(10 + index, 1000 + index * 10, 1000 + index * 10 + 5)
+        self.item.add(3, 0, 100000)
+        scanned = sum(high - low for intervals, low, high in self.item.candidates(9000, 9001))
+        self.assertLess(scanned, 10)
+        self.assertEqual(self.item.overlapping(9000, 9001), [(0, 100000, 3), (9000, 9005, 810)])
+        self.assertEqual(len(self.item.intervals()), 1003)
+        self.assertEqual(self.item.intervals()[:2], [(0, 100000, 3), (100, 200, 1)])
+
+    # Removing the last reservation of a length class drops the class
+    def test_remove(self):
+        self.item.add(3, 0, 10000)
+        self.item.remove(3, 0, 10000)
+        self.assertEqual(sorted(self.item.classes), [7])
+        self.assertTrue(self.item.is_free(5000, 5001))
+        self.item.remove(1, 100, 200)
+        self.item.remove(2, 300, 400)
+        self.assertEqual(self.item.classes, {})
+        # Removing something that isn't there changes nothing
+        self.item.remove(9, 0, 10)
+        self.assertEqual(self.item.classes, {})
+
+    # Zero length reservations only match their own second
+    def test_zero_length(self):
+        self.item.add(3, 250, 250)
+        self.assertEqual(self.item.overlapping(250, 250), [(250, 250, 3)])
+        self.assertTrue(self.item.is_free(251, 299))
+        self.assertTrue(self.item.is_free(201, 249))
+
+    # Items with several units are only full where that many reservations overlap
+    def test_capacity(self):
+        self.item.add(3, 150, 350)
+        self.assertEqual(self.item.peak(0, 1000), 2)
+        self.assertFalse(self.item.is_free(150, 160, 2))
+        self.assertTrue(self.item.is_free(210, 290, 2))
+        self.assertTrue(self.item.is_free(0, 1000, 3))
+
+    # Occurrences of a rule are checked like reservations
+    def test_rules(self):
+        self.item.add_rule((1000, 1100, 500, 3000, 7))
+        self.assertEqual(self.item.overlapping(1550, 1600), [(1500, 1600, 7)])
+        self.assertFalse(self.item.is_free(2550, 2560))
+        # The last occurrence starts no later than until
+        self.assertFalse(self.item.is_free(3100, 3400))
+        self.assertTrue(self.item.is_free(3101, 3400))
+        self.item.remove_rule((1000, 1100, 500, 3000, 7))
+        self.assertTrue(self.item.is_free(1550, 1600))
+
+
+class RecurrenceTest(unittest.TestCase):
+    # Only occurrences inside the window are returned, with inclusive bounds
+    def test_occurrences(self):
+        rule = (100, 150, 1000, 10000, 1)
+        self.assertEqual(intervals.occurrences(rule, 0, 99), [])
+        self.assertEqual(intervals.occurrences(rule, 150, 1100), [(100, 150, 1), (1100, 1150, 1)])
+        self.assertEqual(intervals.occurrences(rule, 151, 1099), [])
+        self.assertEqual(len(intervals.occurrences(rule, 0, 100000)), 10)
+        self.assertEqual(intervals.occurrences(rule, 9100, 100000), [(9100, 9150, 1)])
+
+    def test_last_end(self):
+        self.assertEqual(intervals.last_end((100, 150, 1000, 10000, 1)), 9150)
+        self.assertEqual(intervals.last_end((100, 150, 1000, 100, 1)), 150)
+
+
+class PeakTest(unittest.TestCase):
+    def test_peak(self):
+        self.assertEqual(intervals.peak([]), 0)
+        self.assertEqual(intervals.peak([(0, 10), (20, 30)]), 1)
+        # Touching intervals overlap
+        self.assertEqual(intervals.peak([(0, 10), (10, 20)]), 2)
+        self.assertEqual(intervals.peak([(0, 100), (10, 20), (15, 30), (25, 40)]), 3)
+
+    # With a capacity above 1 an item is only busy where that many reservations overlap
+    def test_timeline_capacity(self):
+        busy, free = intervals.timeline([(10, 20), (15, 30)], 0, 40, capacity=2)
+        self.assertEqual(busy, [[15, 20]])
+        self.assertEqual(free, [[0, 14], [21, 40]])
+
+    # Free slots are whole granularity steps, bounds stay inclusive
+    def test_timeline_granularity(self):
+        busy, free = intervals.timeline([(3600, 7199)], 0, 10799, granularity=3600)
+        self.assertEqual(busy, [[3600, 7199]])
+        self.assertEqual(free, [[0, 3599], [7200, 10799]])
+        self.assertEqual(intervals.timeline([], 0, 10799, granularity=3600)[1], [[0, 10799]])
+        # Free time that doesn't cover a whole step is dropped
+        self.assertEqual(intervals.timeline([(1000, 3000)], 0, 5000, granularity=3600)[1], [])
+        self.assertEqual(intervals.timeline([(1000, 3000)], 0, 7300, granularity=3600)[1], [[3600, 7199]])
+
+    # Slots exactly min_slot seconds long are kept, one second slots too
+    def test_timeline_min_slot(self):
+        busy, free = intervals.timeline([(10, 19), (30, 30)], 0, 40, min_slot=10)
+        self.assertEqual(free, [[0, 9], [20, 29], [31, 40]])
+        self.assertEqual(intervals.timeline([(10, 19), (30, 30)], 0, 40, min_slot=11)[1], [])
+        self.assertEqual(intervals.timeline([(0, 4), (6, 10)], 0, 10)[1], [[5, 5]])
+
+
+class IntervalIndexTest(unittest.TestCase):
+    def test_add_remove(self):
+        index = intervals.IntervalIndex()
+        changes = []
+        index.listeners.append(lambda item, start_time, end_time: changes.append((item, start_time, end_time)))
+        index.add(1, 5, 100, 200, 'pending')
+        index.add(2, 5, 150, 250, 'pending')
+        self.assertEqual(index.remaining(5, 100, 300, 2), 0)
+        self.assertEqual(index.get_item(1), 5)
+        index.remove(1)
+        self.assertEqual(index.remaining(5, 100, 300, 2), 1)
+        self.assertTrue(index.is_free(5, 100, 149))
+        self.assertTrue(index.is_free(6, 0, 1000))
+        self.assertEqual(changes, [(5, 100, 200), (5, 150, 250), (5, 100, 200)])
+
+    # Adding a reservation again, as a commit hook does after a reload, replaces it instead of counting it twice
+    def test_add_again(self):
+        index = intervals.IntervalIndex()
+        index.add(1, 5, 100, 200, 'pending')
+        index.add(1, 5, 100, 200, 'pending')
+        self.assertEqual(index.remaining(5, 100, 200, 2), 1)
+        index.remove(1)
+        self.assertTrue(index.is_free(5, 100, 200))
+        # Moved to another item
+        index.add(1, 5, 100, 200, 'pending')
+        index.add(1, 6, 100, 200, 'pending')
+        self.assertTrue(index.is_free(5, 100, 200))
+        self.assertFalse(index.is_free(6, 100, 200))
+        index.add_rule(2, 5, 1000, 1100, 500, 3000)
+        index.add_rule(2, 5, 1000, 1100, 500, 3000)
+        self.assertEqual(index.remaining(5, 1000, 1100, 2), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
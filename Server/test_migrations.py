@@ -0,0 +1,119 @@
+# Tests for migrations.py
+# Run with: python -m pytest (or python -m unittest) from the Server folder
+import os
+import tempfile
+import unittest
+# Import database.py
+import database
+# Import migrations.py
+import migrations
+
+
+# Schema of databases created before migrations were versioned
+baseline_schema = '''
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT UNIQUE NOT NULL,
+    hash TEXT NOT NULL,
+    salt TEXT NOT NULL,
+    email TEXT NOT NULL,
+    permissions TEXT NOT NULL
+);
+CREATE TABLE reservations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    start_time INTEGER NOT NULL,
+    end_time INTEGER NOT NULL,
+    item TEXT NOT NULL,
+    status TEXT NOT NULL
+);
+CREATE TABLE items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT UNIQUE NOT NULL,
+    description TEXT NOT NULL,
+    status TEXT NOT NULL
+);
+'''
+
+
+class MigrationsTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.pool = database.ConnectionPool(os.path.join(self.folder.name, 'test.db'))
+        self.db = self.pool.open()
+
+    def tearDown(self):
+        self.db.close()
+        self.folder.cleanup()
+
+    def columns(self, table):
+        return [row[1] for row in self.db.execute('PRAGMA table_info({})'.format(table))]
+
+    # A new database gets every migration
+    def test_new_database(self):
+        self.assertEqual(migrations.migrate(self.db), len(migrations.migrations))
+        self.assertEqual(migrations.get_version(self.db), 7)
+        self.assertEqual(self.columns('reservations'), ['id', 'user_id', 'item_id', 'start_time', 'end_time', 'status'])
+        self.assertIn('quantity', self.columns('items'))
+        self.assertEqual(self.columns('recurring_reservations'), ['id', 'user_id', 'item_id', 'start_time', 'end_time', 'period', 'until'])
+        self.assertEqual(self.columns('reservations_archive'), ['id', 'user_id', 'item_id', 'start_time', 'end_time', 'status', 'archived_at'])
+        # Running again changes nothing
+        self.assertEqual(migrations.migrate(self.db), 7)
+
+    # A database of the unversioned schema is upgraded in place, keeping its reservations
+    def test_baseline_database(self):
+        self.db.executescript(baseline_schema)
+        self.db.execute("INSERT INTO users (username, hash, salt, email, permissions) VALUES ('alice', 'h', 's', 'e', 'user')")
+        self.db.execute("INSERT INTO items (name, description, status) VALUES ('scope', 'd', 'available')")
+        self.db.executemany('INSERT INTO reservations (id, username, start_time, end_time, item, status) VALUES (?, ?, ?, ?, ?, ?)', [
+            (1, 'alice', 100, 200, 'scope', 'pending'),
+            (2, 'alice', 300, 400, 'scope', 'lended'),
+            # Orphans whose user or item was removed
+            (3, 'bob', 500, 600, 'scope', 'pending'),
+            (4, 'alice', 700, 800, 'camera', 'pending'),
+        ])
+        self.db.commit()
+        with self.assertLogs('migrations', 'WARNING') as logs:
+            self.assertEqual(migrations.migrate(self.db), 7)
+        self.assertIn('Migrated 2 reservations', logs.output[0])
+        self.assertIn('2 reservations whose user or item no longer exists', logs.output[0])
+        self.assertEqual(self.db.execute('SELECT id, user_id, item_id, start_time, end_time, status FROM reservations ORDER BY id').fetchall(),
+            [(1, 1, 1, 100, 200, 'pending'), (2, 1, 1, 300, 400, 'lent')])
+        self.assertEqual(self.db.execute('SELECT id, username, item FROM reservations_orphaned ORDER BY id').fetchall(),
+            [(3, 'bob', 'scope'), (4, 'alice', 'camera')])
+        self.assertEqual(self.db.execute('SELECT quantity FROM items').fetchall(), [(1,)])
+        # New reservation ids keep increasing past the ones handed out before the upgrade
+        self.db.execute("INSERT INTO reservations (user_id, item_id, start_time, end_time, status) VALUES (1, 1, 900, 1000, 'pending')")
+        self.assertEqual(self.db.execute('SELECT max(id) FROM reservations').fetchone()[0], 5)
+
+    # Archived reservations outlive their item, but not their user
+    def test_archive_of_removed_item(self):
+        migrations.migrate(self.db)
+        self.db.execute("INSERT INTO users (username, hash, salt, email, permissions) VALUES ('alice', 'h', 's', 'e', 'user')")
+        self.db.execute("INSERT INTO items (name, description, status) VALUES ('scope', 'd', 'available')")
+        self.db.execute("INSERT INTO reservations_archive VALUES (1, 1, 1, 100, 200, 'returned', 300)")
+        self.db.execute('DELETE FROM items')
+        self.assertEqual(self.db.execute('SELECT id, item_id FROM reservations_archive').fetchall(), [(1, 1)])
+        self.db.execute('DELETE FROM users')
+        self.assertEqual(self.db.execute('SELECT id FROM reservations_archive').fetchall(), [])
+
+    # A failing migration is rolled back and leaves the version unchanged
+    def test_failed_migration(self):
+        def broken(db):
+            db.execute('CREATE TABLE half_done (id INTEGER)')
+            raise RuntimeError('broken')
+        steps = migrations.migrations[:2] + [broken]
+        with self.assertRaises(RuntimeError):
+            migrations.migrate(self.db, steps)
+        self.assertEqual(migrations.get_version(self.db), 2)
+        self.assertIsNone(self.db.execute("SELECT name FROM sqlite_master WHERE name = 'half_done'").fetchone())
+
+    # Shard files get their own reservation tables
+    def test_shard_migrations(self):
+        self.assertEqual(migrations.migrate(self.db, migrations.shard_migrations), len(migrations.shard_migrations))
+        for table in ('reservations', 'reservations_archive', 'recurring_reservations'):
+            self.assertTrue(self.columns(table))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+# Tests for schemas.py
+# Run with: python -m pytest (or python -m unittest) from the Server folder
+import datetime
+import unittest
+# Import schemas.py
+import schemas
+
+
+class ParseTimeTest(unittest.TestCase):
+    # The sliced fast path gives the same timestamp as strptime
+    def test_fast_path(self):
+        for value in ('2025-01-01 00:00:00', '2025-07-15 13:45:30', '1999-12-31 23:59:59'):
+            expected = int(datetime.datetime.strptime(value, schemas.time_format).timestamp())
+            self.assertEqual(schemas.parse_time(value), expected)
+
+    # Other layouts strptime accepts still work
+    def test_fallback(self):
+        self.assertEqual(schemas.parse_time('2025-1-1 0:00:00'), schemas.parse_time('2025-01-01 00:00:00'))
+
+    def test_invalid(self):
+        for value in ('', 'x', '2025-13-01 00:00:00', '2025-01-01 24:00:00', '2025-01-01T00:00:00', '2025-01-01 00:00:0x'):
+            with self.assertRaises(ValueError):
+                schemas.parse_time(value)
+
+
+class FieldsTest(unittest.TestCase):
+    def test_text(self):
+        field = schemas.Text('status', choices=('pending', 'lent'))
+        self.assertEqual(field.parse('lent'), 'lent')
+        self.assertRaises(ValueError, field.parse, 'lost')
+        self.assertRaises(ValueError, field.parse, 5)
+
+    def test_integer(self):
+        field = schemas.Integer('limit', minimum=1, names={'all': 0})
+        self.assertEqual(field.parse('10'), 10)
+        self.assertEqual(field.parse(10), 10)
+        self.assertEqual(field.parse('all'), 0)
+        for value in ('0', 'ten', True, 1.5, None):
+            self.assertRaises(ValueError, field.parse, value)
+
+    def test_time(self):
+        field = schemas.Time('start_time')
+        self.assertEqual(field.parse('2025-01-01 00:00:00'), schemas.parse_time('2025-01-01 00:00:00'))
+        # JSON bodies may give timestamps
+        self.assertEqual(field.parse(1735689600), 1735689600)
+        for value in ('tomorrow', -1, schemas.max_timestamp + 1, True, 1.5):
+            self.assertRaises(ValueError, field.parse, value)
+
+    def test_boolean(self):
+        field = schemas.Boolean('archived')
+        self.assertTrue(field.parse('true'))
+        self.assertTrue(field.parse('1'))
+        self.assertFalse(field.parse(False))
+        self.assertRaises(ValueError, field.parse, 'yes')
+
+    def test_names(self):
+        field = schemas.Names('items')
+        self.assertEqual(field.parse('scope, camera,'), ('scope', 'camera'))
+        self.assertEqual(field.parse(['scope']), ('scope',))
+        self.assertIsNone(field.parse(' , '))
+        self.assertRaises(ValueError, field.parse, [1])
+
+    def test_list(self):
+        self.assertEqual(schemas.List('items').parse([{}]), [{}])
+        self.assertRaises(ValueError, schemas.List('items').parse, 'scope')
+
+
+class SchemaTest(unittest.TestCase):
+    def setUp(self):
+        self.schema = schemas.Schema(schemas.Text('name'), schemas.Integer('quantity', required=False, default=1, minimum=1))
+
+    def test_parse(self):
+        fields, errors = self.schema.parse({'name': 'scope', 'quantity': '3'})
+        self.assertIsNone(errors)
+        self.assertEqual((fields.name, fields.quantity), ('scope', 3))
+
+    # Missing and empty optional fields get their default
+    def test_default(self):
+        for body in ({'name': 'scope'}, {'name': 'scope', 'quantity': ''}):
+            fields, errors = self.schema.parse(body)
+            self.assertEqual(fields.quantity, 1)
+
+    # Every bad field is reported, not just the first
+    def test_errors(self):
+        fields, errors = self.schema.parse({'name': '', 'quantity': '0'})
+        self.assertIsNone(fields)
+        self.assertEqual(errors, [{'field': 'name', 'error': 'Missing name'}, {'field': 'quantity', 'error': 'quantity must be at least 1'}])
+
+    # A JSON body that isn't an object
+    def test_not_an_object(self):
+        for body in (None, [1, 2], 'scope'):
+            fields, errors = self.schema.parse(body)
+            self.assertIsNone(fields)
+            self.assertEqual(errors, [{'field': None, 'error': 'Body must be an object'}])
+
+
+if __name__ == '__main__':
+    unittest.main()
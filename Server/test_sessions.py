@@ -0,0 +1,67 @@
+# Tests for sessions.py
+# Run with: python -m pytest (or python -m unittest) from the Server folder
+import time
+import unittest
+# Import sessions.py
+import sessions
+
+
+class SessionStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.store = sessions.SessionStore('secret', 3600)
+
+    # An issued token verifies to its user until it expires
+    def test_issue(self):
+        token, expiry = self.store.issue('admin')
+        self.assertEqual(self.store.verify(token), 'admin')
+        self.assertAlmostEqual(expiry, time.time() + 3600, delta=5)
+        self.assertEqual(token.split('.')[1], str(expiry))
+
+    # A revoked token is refused even though its signature is still valid
+    def test_revoke(self):
+        token, expiry = self.store.issue('admin')
+        other, expiry = self.store.issue('admin')
+        self.assertTrue(self.store.revoke(token))
+        self.assertIsNone(self.store.verify(token))
+        # Other sessions of the same user stay valid
+        self.assertEqual(self.store.verify(other), 'admin')
+        # Revoking twice or revoking an unknown token does nothing
+        self.assertFalse(self.store.revoke(token))
+        self.assertFalse(self.store.revoke('unknown.0.0'))
+        self.assertFalse(self.store.revoke('garbage'))
+
+    # Tokens with a changed expiry or signature, a wrong key or the wrong shape are refused
+    def test_tampered(self):
+        token, expiry = self.store.issue('admin')
+        session_id, expiry, signature = token.split('.')
+        self.assertIsNone(self.store.verify('{}.{}.{}'.format(session_id, int(expiry) + 3600, signature)))
+        self.assertIsNone(self.store.verify('{}.{}.{}'.format(session_id, expiry, '0' * len(signature))))
+        self.assertIsNone(sessions.SessionStore('other secret', 3600).verify(token))
+        for bad in ['', 'admin', session_id + '.' + expiry, session_id + '.soon.' + signature, token + '.extra']:
+            self.assertIsNone(self.store.verify(bad))
+
+    # Expired tokens are refused and pruned
+    def test_expired(self):
+        store = sessions.SessionStore('secret', -10)
+        token, expiry = store.issue('admin')
+        self.assertIsNone(store.verify(token))
+        live, expiry = self.store.issue('user')
+        self.store.sessions.update(store.sessions)
+        self.store.prune()
+        self.assertEqual(list(self.store.sessions.values()), [('user', expiry)])
+
+    # Issuing prunes expired sessions once the store has grown past prune_at
+    def test_prune_on_issue(self):
+        store = sessions.SessionStore('secret', -10)
+        for index in range(10):
+            store.issue('admin')
+        store.lifetime = 3600
+        store.prune_at = 10
+        token, expiry = store.issue('user')
+        self.assertEqual(list(store.sessions.values()), [('user', expiry)])
+        self.assertEqual(store.prune_at, 1024)
+        self.assertEqual(store.verify(token), 'user')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+# Tests for writer.py
+# Run with: python -m pytest (or python -m unittest) from the Server folder
+import os
+import tempfile
+import threading
+import unittest
+# Import database.py
+import database
+# Import writer.py
+import writer
+
+
+class WriteQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.pool = database.ConnectionPool(os.path.join(self.folder.name, 'test.db'))
+        with self.pool.connection() as db:
+            db.execute('CREATE TABLE rows (value INTEGER UNIQUE)')
+            db.commit()
+        self.commits = 0
+        self.pool.on_query = self.count_commits
+        self.queue = writer.WriteQueue(self.pool, max_batch=64, timeout=5)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def count_commits(self, sql, seconds):
+        if sql == 'COMMIT':
+            self.commits += 1
+
+    def values(self):
+        with self.pool.connection() as db:
+            return sorted(row[0] for row in db.execute('SELECT value FROM rows'))
+
+    # Insert a value, or reject it if it is negative
+    def insert(self, value):
+        def apply(db_cur):
+            db_cur.execute('INSERT INTO rows (value) VALUES (?)', (value,))
+            if value < 0:
+                raise writer.Rejected('Negative value')
+            return value
+        return apply
+
+    # Operations queued while the writer is busy are committed together
+    def test_group_commit(self):
+        operations = [writer.WriteOperation(self.insert(value)) for value in range(10)]
+        for operation in operations:
+            self.queue.operations.put(operation)
+        self.queue.start()
+        self.assertEqual([operation.wait(5) for operation in operations], list(range(10)))
+        self.assertEqual(self.values(), list(range(10)))
+        self.assertEqual(self.commits, 1)
+
+    # A rejected operation is rolled back without affecting the rest of its group
+    def test_rejected_rollback(self):
+        operations = [writer.WriteOperation(self.insert(value)) for value in (1, -2, 3)]
+        for operation in operations:
+            self.queue.operations.put(operation)
+        self.queue.start()
+        self.assertEqual(operations[0].wait(5), 1)
+        with self.assertRaises(writer.Rejected):
+            operations[1].wait(5)
+        self.assertEqual(operations[2].wait(5), 3)
+        self.assertEqual(self.values(), [1, 3])
+
+    # Commit hooks run after the commit and before the caller is woken up
+    def test_after_commit(self):
+        self.queue.start()
+        seen = []
+        self.assertEqual(self.queue.execute(self.insert(5), seen.append), 5)
+        self.assertEqual(seen, [5])
+        # Hooks of failed operations don't run
+        with self.assertRaises(writer.Rejected):
+            self.queue.execute(self.insert(-1), seen.append)
+        with self.assertRaises(Exception):
+            self.queue.execute(self.insert(5), seen.append)
+        self.assertEqual(seen, [5])
+
+    # A failing commit hook is reported and doesn't stop the writer
+    def test_after_commit_error(self):
+        errors = []
+        self.queue.on_commit_error = errors.append
+        self.queue.start()
+        def hook(result):
+            raise KeyError(result)
+        with self.assertLogs('writer', 'ERROR'):
+            self.assertEqual(self.queue.execute(self.insert(1), hook), 1)
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(self.queue.execute(self.insert(2)), 2)
+
+    # Recovery runs once per group, after the hooks of the whole group
+    def test_after_commit_error_group(self):
+        calls = []
+        self.queue.on_commit_error = lambda error: calls.append(('recover', error.args[0]))
+        def hook(result):
+            calls.append(('hook', result))
+            if result == 1:
+                raise KeyError(result)
+        operations = [writer.WriteOperation(self.insert(value), hook) for value in range(3)]
+        for operation in operations:
+            self.queue.operations.put(operation)
+        with self.assertLogs('writer', 'ERROR'):
+            self.queue.start()
+            for operation in operations:
+                operation.wait(5)
+        self.assertEqual(calls, [('hook', 0), ('hook', 1), ('hook', 2), ('recover', 1)])
+
+    # Callers don't wait forever for a writer that doesn't answer, and abandoned operations are skipped
+    def test_timeout(self):
+        self.queue.timeout = 0.05
+        with self.assertRaises(writer.WriterError):
+            self.queue.execute(self.insert(1))
+        self.queue.start()
+        self.assertEqual(self.queue.execute(self.insert(2)), 2)
+        self.assertEqual(self.values(), [2])
+
+    # Once the writer thread stops, pending and later operations fail instead of hanging
+    def test_writer_stopped(self):
+        def fail(attached=True):
+            raise OSError('disk gone')
+        self.pool.open = fail
+        pending = writer.WriteOperation(self.insert(1))
+        self.queue.operations.put(pending)
+        with self.assertLogs('writer', 'ERROR'):
+            self.queue.start()
+            self.queue.thread.join(5)
+        with self.assertRaises(writer.WriterError):
+            pending.wait(1)
+        with self.assertRaises(writer.WriterError):
+            self.queue.execute(self.insert(2))
+
+    # Concurrent callers each get their own result
+    def test_concurrent_callers(self):
+        self.queue.start()
+        results = {}
+        def call(value):
+            results[value] = self.queue.execute(self.insert(value))
+        threads = [threading.Thread(target=call, args=(value,)) for value in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, {value: value for value in range(20)})
+        self.assertLessEqual(self.commits, 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
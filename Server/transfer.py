@@ -0,0 +1,131 @@
+# Bulk import and export of items, users, reservations and recurring reservations through a running server
+# Imports are sent in parts of --rows rows, one request each, so large files stay below the upload limit,
+# and rejected rows are reported with their line numbers in the input file.
+# Run with: python transfer.py import KIND FILE [--format csv|ndjson] [--rows N]
+#           python transfer.py export KIND [--output FILE] [--format csv|ndjson] [--credentials]
+# KIND is items, users, reservations or recurring. Both take [--url URL] and [--token TOKEN | --username NAME --password PASSWORD]
+import argparse
+import getpass
+import json
+import shutil
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+# Import bulk.py
+import bulk
+
+
+### Requests ###
+
+# Send a POST request and return the response
+# Requests turned away with 429 are sent again after the time the server asks for, up to retries times
+def post(url, data, headers=None, retries=10):
+    request = urllib.request.Request(url, data=data, headers=headers or {}, method='POST')
+    while True:
+        try:
+            return urllib.request.urlopen(request)
+        except urllib.error.HTTPError as e:
+            if e.code != 429 or retries <= 0:
+                raise
+            retries -= 1
+            time.sleep(int(e.headers.get('Retry-After') or 1))
+
+# Send a form and return the JSON response
+def post_form(url, fields):
+    with post(url, urllib.parse.urlencode(fields).encode('utf-8')) as response:
+        return json.load(response)
+
+# Get a session token for the admin
+def get_token(args):
+    if args.token:
+        return args.token
+    username = args.username or input('Username: ')
+    password = args.password or getpass.getpass('Password: ')
+    result = post_form(args.url + '/token', {'username': username, 'password': password})
+    if 'token' not in result:
+        sys.exit('Login failed: {}'.format(result.get('error')))
+    return result['token']
+
+
+### Commands ###
+
+# Import a file part by part, returns the number of rejected rows
+def import_file(args, token):
+    format = args.format or bulk.detect_format(args.file) or 'csv'
+    imported = 0
+    rejected = 0
+    with open(args.file, encoding='utf-8-sig', newline='') as lines:
+        for part in bulk.chunked(bulk.read_rows(lines, format), args.rows):
+            # Rows that can't be read are reported here, the rest are sent as NDJSON
+            sent = []
+            for line, row, error in part:
+                if error is None:
+                    sent.append((line, row))
+                else:
+                    print('line {}: {}'.format(line, error), file=sys.stderr)
+                    rejected += 1
+            if not sent:
+                continue
+            body = ''.join(json.dumps(row) + '\n' for line, row in sent).encode('utf-8')
+            with post('{}/admin/import/{}?format=ndjson'.format(args.url, args.kind), body,
+                    {'Authorization': 'Bearer ' + token, 'Content-Type': bulk.content_types['ndjson']}) as response:
+                result = json.load(response)
+            if 'imported' not in result:
+                sys.exit('Import failed: {}'.format(result.get('error')))
+            imported += result['imported']
+            rejected += result['rejected']
+            # Lines of the result count the rows of the part
+            for error in result['errors']:
+                print('line {}: {}'.format(sent[error['line'] - 1][0], error['error']), file=sys.stderr)
+            if result['rejected'] > len(result['errors']):
+                print('{} more rows rejected'.format(result['rejected'] - len(result['errors'])), file=sys.stderr)
+            if result['status'] != 'success':
+                sys.exit('Import failed: {}'.format(result.get('error')))
+    print('Imported {} {}, rejected {}'.format(imported, args.kind, rejected))
+    return rejected
+
+# Export to a file or standard output
+def export_file(args, token):
+    format = args.format or (bulk.detect_format(args.output) if args.output else None) or 'csv'
+    fields = {'token': token, 'format': format}
+    if args.credentials:
+        fields['credentials'] = 'true'
+    with post('{}/admin/export/{}'.format(args.url, args.kind), urllib.parse.urlencode(fields).encode('utf-8')) as response:
+        # Errors come back as JSON instead of the export
+        if response.headers.get_content_type() == 'application/json':
+            sys.exit('Export failed: {}'.format(json.load(response).get('error')))
+        if args.output:
+            with open(args.output, 'wb') as output:
+                shutil.copyfileobj(response, output)
+        else:
+            shutil.copyfileobj(response, sys.stdout.buffer)
+
+
+def main():
+    # Get command line arguments
+    parser = argparse.ArgumentParser(description='Import and export items, users, reservations and recurring reservations in bulk')
+    parser.add_argument('command', choices=('import', 'export'))
+    parser.add_argument('kind', choices=tuple(bulk.columns))
+    parser.add_argument('file', nargs='?', help='File to import')
+    parser.add_argument('--output', help='File to export to, standard output if not given')
+    parser.add_argument('--format', choices=bulk.formats, help='File format, guessed from the file name if not given')
+    parser.add_argument('--rows', type=int, default=10000, help='Rows sent per import request')
+    parser.add_argument('--credentials', action='store_true', help='Export password hashes and salts of users')
+    parser.add_argument('--url', default='http://localhost:6969', help='Address of the server')
+    parser.add_argument('--token', help='Admin session token')
+    parser.add_argument('--username', help='Admin username')
+    parser.add_argument('--password', help='Admin password')
+    args = parser.parse_args()
+    if args.command == 'import' and not args.file:
+        parser.error('import needs a file')
+    args.url = args.url.rstrip('/')
+    token = get_token(args)
+    if args.command == 'import':
+        sys.exit(1 if import_file(args, token) else 0)
+    export_file(args, token)
+
+
+if __name__ == '__main__':
+    main()
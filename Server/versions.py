@@ -0,0 +1,53 @@
+# This is meant to be imported and used as a module.
+# It is not meant to be run directly.
+
+### Imports for versions ###
+import hashlib
+import json
+import secrets
+import threading
+
+
+### Table versions ###
+# Counts committed changes to each table, so a response can be tagged with the versions of the
+# tables it was built from and a client that already has it can be told so without running a query.
+# It is fed by IntervalIndex as a watcher, so every reservation write is counted,
+# writes to other tables bump their counters themselves once committed.
+class TableVersions:
+    def __init__(self, tables=('items', 'users', 'reservations')):
+        # Table name -> number of changes since the server started
+        self.versions = dict.fromkeys(tables, 0)
+        # Differs between server runs, so tags handed out before a restart never match
+        self.epoch = secrets.token_hex(8)
+        self.lock = threading.Lock()
+
+    # Count a change to each given table
+    def bump(self, *tables):
+        with self.lock:
+            for table in tables:
+                self.versions[table] += 1
+
+    # Get the versions of the given tables
+    def get(self, *tables):
+        with self.lock:
+            return tuple(self.versions[table] for table in tables)
+
+    # Get an entity tag for a response built from the given tables, extra is any JSON value it also depends on
+    # Versions must be read before the response is built, so a write racing the request only makes the tag older
+    def etag(self, tables, extra=None):
+        key = json.dumps([self.epoch, tables, self.get(*tables), extra], sort_keys=True, default=str)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()[:24]
+
+    ## Watcher interface ##
+
+    # The reservations were reloaded
+    def load(self, rows):
+        self.bump('reservations')
+
+    # A reservation was added or changed status
+    def update(self, reservation_id, start_time, end_time, status):
+        self.bump('reservations')
+
+    # A reservation was removed
+    def discard(self, reservation_id):
+        self.bump('reservations')
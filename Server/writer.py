@@ -0,0 +1,165 @@
+# This is meant to be imported and used as a module.
+# It is not meant to be run directly.
+
+### Imports for writer ###
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+# Raised by an operation to undo its own changes and report an error to the caller
+class Rejected(Exception):
+    pass
+
+# Raised to a caller whose operation was not applied because the writer thread stopped or didn't answer in time
+class WriterError(Exception):
+    pass
+
+
+### Write operation ###
+# A unit of work for the writer thread.
+# apply(db_cur) runs inside the group's transaction and returns the result.
+# after_commit(result) runs once the group is committed, before the caller is woken up.
+class WriteOperation:
+    def __init__(self, apply, after_commit=None):
+        self.apply = apply
+        self.after_commit = after_commit
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+        # Set when the caller stopped waiting, the operation is skipped if it hasn't started yet
+        self.abandoned = False
+
+    # Wait up to timeout seconds for the operation and return its result, or raise its error
+    def wait(self, timeout=None):
+        if not self.done.wait(timeout):
+            self.abandoned = True
+            raise WriterError('Write timed out')
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+### Write queue ###
+# Serializes writes through one connection and commits them in groups,
+# so concurrent requests neither race their conflict checks nor pay one fsync each.
+# If the writer thread stops, pending and later operations fail with WriterError instead of waiting forever.
+class WriteQueue:
+    def __init__(self, pool, max_batch=64, timeout=30, on_commit_error=None):
+        # Pool the writer connection is opened from
+        self.pool = pool
+        # Most operations committed in one transaction
+        self.max_batch = max_batch
+        # Longest a caller waits for its operation, in seconds
+        self.timeout = timeout
+        # Called once per group with the first error when after_commit hooks fail, so state kept beside the database can be rebuilt
+        self.on_commit_error = on_commit_error
+        # Pending operations
+        self.operations = queue.Queue()
+        self.thread = None
+        # WriterError given to every operation once the writer thread stopped
+        self.failed = None
+
+    # Start the writer thread
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='writer', daemon=True)
+            self.thread.start()
+
+    # Queue an operation and wait for its result
+    def execute(self, apply, after_commit=None):
+        if self.failed is not None:
+            raise self.failed
+        operation = WriteOperation(apply, after_commit)
+        self.operations.put(operation)
+        # The thread may have stopped after the check, then nobody else takes the operation
+        if self.failed is not None:
+            self.fail_pending()
+        return operation.wait(self.timeout)
+
+    # Fail the given and all queued operations with the writer's error
+    def fail_pending(self, group=()):
+        for operation in group:
+            if not operation.done.is_set():
+                operation.result = None
+                operation.error = self.failed
+                operation.done.set()
+        while True:
+            try:
+                operation = self.operations.get_nowait()
+            except queue.Empty:
+                return
+            operation.error = self.failed
+            operation.done.set()
+
+    # Writer thread loop
+    def run(self):
+        group = []
+        try:
+            # Writes only touch the pool's own database, so attached ones are left unlocked
+            db = self.pool.open(attached=False)
+            # Transactions are managed explicitly
+            db.isolation_level = None
+            db_cur = db.cursor()
+            while True:
+                # Block for the first operation, then take whatever else is waiting
+                group = [self.operations.get()]
+                while len(group) < self.max_batch:
+                    try:
+                        group.append(self.operations.get_nowait())
+                    except queue.Empty:
+                        break
+                self.commit_group(db_cur, group)
+                group = []
+        except Exception as e:
+            logger.exception('Writer thread of %s stopped', self.pool.path)
+            self.failed = WriterError('Writer thread stopped: {}'.format(e))
+            self.fail_pending(group)
+
+    # Apply a group of operations in one transaction
+    def commit_group(self, db_cur, group):
+        try:
+            db_cur.execute('BEGIN IMMEDIATE')
+            for operation in group:
+                # The caller gave up waiting, don't apply it behind its back
+                if operation.abandoned:
+                    operation.error = WriterError('Write timed out')
+                    continue
+                # Each operation can be undone on its own with a savepoint
+                db_cur.execute('SAVEPOINT operation')
+                try:
+                    operation.result = operation.apply(db_cur)
+                    db_cur.execute('RELEASE operation')
+                except Exception as e:
+                    db_cur.execute('ROLLBACK TO operation')
+                    db_cur.execute('RELEASE operation')
+                    operation.error = e
+            db_cur.execute('COMMIT')
+        except Exception as e:
+            # The whole group failed, a failed rollback stops the writer thread
+            for operation in group:
+                operation.result = None
+                operation.error = e
+            if db_cur.connection.in_transaction:
+                db_cur.execute('ROLLBACK')
+        # Run commit hooks
+        hook_error = None
+        for operation in group:
+            if operation.error is None and operation.after_commit is not None:
+                try:
+                    operation.after_commit(operation.result)
+                except Exception as e:
+                    # The write is committed, but what the hook keeps beside the database may now be wrong
+                    logger.exception('Commit hook failed on %s', self.pool.path)
+                    hook_error = hook_error or e
+        # Recover once, after every hook of the group ran, so the later hooks don't apply their changes again on top
+        if hook_error is not None and self.on_commit_error is not None:
+            try:
+                self.on_commit_error(hook_error)
+            except Exception:
+                logger.exception('Recovering from a failed commit hook failed on %s', self.pool.path)
+        # Wake up callers
+        for operation in group:
+            operation.done.set()